@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Letter, AnalysisResult, GeneratedResponse
+from .models import Letter, AnalysisResult, GeneratedResponse, AnalysisJob, AnalysisCacheEntry
+from .services.letter_search import search_letters
 
 
 @admin.register(Letter)
@@ -14,6 +15,13 @@ class LetterAdmin(admin.ModelAdmin):
 
     get_short_subject.short_description = 'Тема'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по search_vector (GIN индекс) вместо ILIKE по полному тексту писем
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        return search_letters(queryset, search_term), False
+
 
 @admin.register(AnalysisResult)
 class AnalysisResultAdmin(admin.ModelAdmin):
@@ -24,4 +32,16 @@ class AnalysisResultAdmin(admin.ModelAdmin):
 @admin.register(GeneratedResponse)
 class GeneratedResponseAdmin(admin.ModelAdmin):
     list_display = ['id', 'letter', 'response_style', 'is_selected', 'generated_at']
-    list_filter = ['response_style', 'is_selected']
\ No newline at end of file
+    list_filter = ['response_style', 'is_selected']
+
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'letter', 'status', 'attempts', 'locked_by', 'created_at', 'finished_at']
+    list_filter = ['status']
+
+
+@admin.register(AnalysisCacheEntry)
+class AnalysisCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'key', 'model_name', 'hits', 'created_at', 'last_used_at']
+    readonly_fields = ['key', 'model_name', 'result', 'sla_offset_seconds', 'hits', 'created_at', 'last_used_at']
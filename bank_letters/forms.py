@@ -84,4 +84,21 @@ class ClassificationCategoriesForm(forms.Form):
             return categories_data
 
         except json.JSONDecodeError:
-            raise forms.ValidationError("Неверный формат данных категорий")
\ No newline at end of file
+            raise forms.ValidationError("Неверный формат данных категорий")
+
+class LetterBulkImportForm(forms.Form):
+    """Форма массовой загрузки писем из выгрузки почтовой системы"""
+    file = forms.FileField(
+        label="Файл с письмами",
+        help_text="Поддерживаются mbox, .eml, CSV (колонки sender, subject, original_text) и ZIP архивы с ними",
+        widget=forms.ClearableFileInput(attrs={
+            'class': 'form-control',
+            'accept': '.mbox,.eml,.csv,.zip',
+        })
+    )
+    enqueue_analysis = forms.BooleanField(
+        label="Поставить письма в очередь анализа",
+        required=False,
+        initial=True,
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
+    )
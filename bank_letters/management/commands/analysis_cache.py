@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from bank_letters.services.analysis_cache import AnalysisCache
+
+
+class Command(BaseCommand):
+    help = "Обслуживание кэша результатов анализа: статистика, очистка устаревших записей, полная очистка"
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['stats', 'prune', 'clear'])
+
+    def handle(self, *args, **options):
+        cache = AnalysisCache(enabled=True)
+
+        if options['action'] == 'prune':
+            deleted = cache.prune()
+            self.stdout.write(self.style.SUCCESS(f"Удалено записей: {deleted}"))
+        elif options['action'] == 'clear':
+            deleted = cache.clear()
+            self.stdout.write(self.style.SUCCESS(f"Кэш очищен, удалено записей: {deleted}"))
+        else:
+            stats = cache.stats()
+            self.stdout.write(f"Записей в кэше: {stats['entries']} (лимит {cache.max_entries})")
+            self.stdout.write(f"Время жизни записи: {cache.ttl}")
+            self.stdout.write(f"Всего попаданий: {stats['total_hits']}")
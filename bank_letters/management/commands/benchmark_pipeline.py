@@ -0,0 +1,76 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bank_letters.services.pipeline_benchmark import PipelineBenchmark, delete_benchmark_letters
+
+
+def _seconds(value):
+    return '-' if value is None else f"{value:.3f}"
+
+
+class Command(BaseCommand):
+    help = ("Сквозной нагрузочный тест: загрузка письма -> анализ -> генерация ответа -> вопрос к письму; "
+            "выводит пропускную способность и задержки p50/p95/p99 по этапам")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--letters', type=int, default=100, help='Сколько писем провести через сценарий')
+        parser.add_argument('--concurrency', type=int, default=10, help='Число одновременных пользователей')
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Обработчики очереди анализа, запускаемые тестом (0 - уже запущенные отдельно)')
+        parser.add_argument('--response-style', type=int, default=1, choices=(1, 2, 3, 4),
+                            help='Стиль генерируемого ответа')
+        parser.add_argument('--analysis-timeout', type=float, default=120.0,
+                            help='Сколько ждать анализа одного письма (секунды)')
+        parser.add_argument('--poll-interval', type=float, default=0.2,
+                            help='Пауза между опросами статуса анализа (секунды)')
+        parser.add_argument('--seed', type=int, help='Начальное значение генератора писем')
+        parser.add_argument('--cleanup', action='store_true', help='Удалить созданные тестом письма после замера')
+        parser.add_argument('--allow-remote-llm', action='store_true',
+                            help='Разрешить тест без LLM_BASE_URL (запросы пойдут в настоящий API)')
+
+    def handle(self, *args, **options):
+        if options['letters'] < 1 or options['concurrency'] < 1 or options['workers'] < 0:
+            raise CommandError("--letters и --concurrency должны быть положительными, --workers - неотрицательным")
+        if not os.getenv('LLM_BASE_URL') and not options['allow_remote_llm']:
+            raise CommandError("LLM_BASE_URL не задан: запустите run_fake_llm_server и укажите его адрес "
+                               "или добавьте --allow-remote-llm")
+
+        letters = options['letters']
+        step = max(1, letters // 10)
+        benchmark = PipelineBenchmark(
+            letters=letters,
+            concurrency=options['concurrency'],
+            workers=options['workers'],
+            response_style=options['response_style'],
+            analysis_timeout=options['analysis_timeout'],
+            poll_interval=options['poll_interval'],
+            seed=options['seed'],
+            progress=lambda done: done % step == 0 and self.stdout.write(f"  выполнено сценариев: {done}/{letters}"),
+        )
+
+        self.stdout.write(
+            f"Сценариев: {letters}, одновременно: {options['concurrency']}, "
+            f"обработчиков анализа: {options['workers'] or 'внешние'}, LLM: {os.getenv('LLM_BASE_URL') or 'API'}"
+        )
+        report = benchmark.run()
+
+        self.stdout.write(
+            f"\nЗавершено сценариев: {report.completed} из {letters} за {report.elapsed:.1f} с, "
+            f"пропускная способность: {report.throughput:.2f} писем/с"
+        )
+        self.stdout.write(f"{'этап':<20}{'число':>8}{'ошибки':>8}{'в сек.':>9}"
+                          f"{'p50, с':>9}{'p95, с':>9}{'p99, с':>9}{'макс., с':>10}")
+        for row in report.rows():
+            self.stdout.write(
+                f"{row['stage']:<20}{row['count']:>8}{row['errors']:>8}{row['rps']:>9.2f}"
+                f"{_seconds(row['p50']):>9}{_seconds(row['p95']):>9}{_seconds(row['p99']):>9}"
+                f"{_seconds(row['max']):>10}"
+            )
+        if report.error_samples:
+            self.stdout.write("\nПримеры ошибок:")
+            for sample in report.error_samples:
+                self.stdout.write(f"  {sample}")
+
+        if options['cleanup']:
+            self.stdout.write(f"Удалено писем теста: {delete_benchmark_letters()}")
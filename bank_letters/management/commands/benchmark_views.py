@@ -0,0 +1,79 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bank_letters.models import Letter
+from bank_letters.services.synthetic_data import SyntheticDataGenerator
+from bank_letters.services.view_benchmark import ViewBenchmark, real_letters_exist
+
+
+def _value(value):
+    return '-' if value is None else value
+
+
+class Command(BaseCommand):
+    help = ("Замеряет время ответа, число запросов к БД и пик памяти представлений (список, статистика, "
+            "страницы письма, смена категорий); с --sizes дополняет базу синтетическими письмами до каждого объема")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='',
+                            help='Объемы базы через запятую, например 100000,300000,1000000 '
+                                 '(по умолчанию - замер текущей базы)')
+        parser.add_argument('--repeat', type=int, default=5, help='Сколько раз выполнить каждый запрос')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Размер пачки при создании писем')
+        parser.add_argument('--seed', type=int, help='Начальное значение генераторов')
+        parser.add_argument('--no-classification-flows', action='store_true',
+                            help='Не замерять смену и сброс категорий')
+        parser.add_argument('--allow-real-letters', action='store_true',
+                            help='Замерять смену и сброс категорий в базе с несинтетическими письмами')
+        parser.add_argument('--json', dest='json_path', help='Сохранить результаты в JSON файл')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(',') if size.strip())
+        except ValueError:
+            raise CommandError("--sizes должен содержать числа через запятую")
+        if options['repeat'] < 1 or any(size < 1 for size in sizes):
+            raise CommandError("--repeat и объемы должны быть положительными")
+        if (not options['no_classification_flows'] and not options['allow_real_letters']
+                and real_letters_exist()):
+            raise CommandError("В базе есть несинтетические письма: сценарии смены категорий запускайте "
+                               "на отдельной базе, добавьте --no-classification-flows или --allow-real-letters")
+
+        generator = SyntheticDataGenerator(seed=options['seed'], batch_size=options['batch_size'])
+        benchmark = ViewBenchmark(
+            repeat=options['repeat'],
+            seed=options['seed'],
+            classification_flows=not options['no_classification_flows'],
+        )
+
+        rows = []
+        for size in sizes or [None]:
+            if size is not None:
+                missing = size - Letter.objects.count()
+                if missing > 0:
+                    self.stdout.write(f"Создание синтетических писем: {missing}...")
+                    generator.generate(missing)
+
+            results = [result.as_dict() for result in benchmark.run()]
+            rows.extend(results)
+            self._write_table(results)
+            for row in results:
+                if row['errors']:
+                    self.stderr.write(f"{row['view']}: неожиданных ответов {row['errors']} ({row['last_error']})")
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as f:
+                json.dump(rows, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f"Результаты сохранены в {options['json_path']}")
+
+    def _write_table(self, results):
+        letters = results[0]['letters'] if results else Letter.objects.count()
+        self.stdout.write(f"\nПисем в базе: {letters}")
+        self.stdout.write(f"{'представление':<36}{'p50, мс':>9}{'p95, мс':>9}{'макс., мс':>11}"
+                          f"{'запросов':>10}{'память, КБ':>12}{'ошибки':>8}")
+        for row in results:
+            self.stdout.write(
+                f"{row['view']:<36}{_value(row['p50_ms']):>9}{_value(row['p95_ms']):>9}{_value(row['max_ms']):>11}"
+                f"{row['queries']:>10}{row['peak_memory_kb']:>12}{row['errors']:>8}"
+            )
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bank_letters.services.retrievers import BM25Retriever
+
+
+class Command(BaseCommand):
+    help = "Строит локальный индекс BM25 по txt файлам базы знаний (для RAG_BACKEND=bm25)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data-folder', default='data_simple')
+        parser.add_argument('--index-path', default=None, help="По умолчанию RAG_INDEX_PATH или .rag_index/bm25.idx")
+        parser.add_argument('--query', default=None, help="Проверочный запрос после построения индекса")
+
+    def handle(self, *args, **options):
+        retriever = BM25Retriever(data_folder=options['data_folder'], index_path=options['index_path'])
+        doc_count, term_count = retriever.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Индекс построен: {doc_count} фрагментов, {term_count} термов -> {retriever.index_path}"
+        ))
+
+        if options['query']:
+            started = time.perf_counter()
+            chunks = retriever.search(options['query'])
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.stdout.write(f"Запрос выполнен за {elapsed_ms:.3f} мс, найдено {len(chunks)} фрагментов")
+            for chunk in chunks:
+                preview = chunk.text.splitlines()[-1] if chunk.text else ''
+                self.stdout.write(f"  {chunk.score:.3f}  {chunk.source}: {preview[:80]}")
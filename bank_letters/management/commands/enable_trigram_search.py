@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, DatabaseError
+
+STATEMENTS = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # CONCURRENTLY не блокирует запись в таблицу писем на время построения индекса
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS letter_sender_trgm_idx "
+    "ON bank_letters_letter USING gin (sender gin_trgm_ops)",
+)
+
+
+class Command(BaseCommand):
+    help = "Включает нечеткий поиск по отправителю: расширение pg_trgm и триграммный индекс по sender"
+
+    def handle(self, *args, **options):
+        try:
+            with connection.cursor() as cursor:
+                for statement in STATEMENTS:
+                    cursor.execute(statement)
+        except DatabaseError as e:
+            raise CommandError(f"Не удалось включить pg_trgm (нужны права на CREATE EXTENSION): {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            "pg_trgm включен, индекс letter_sender_trgm_idx создан. Перезапустите процессы приложения."
+        ))
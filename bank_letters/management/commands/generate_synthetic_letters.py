@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bank_letters.services.synthetic_data import (
+    SyntheticDataGenerator, delete_synthetic_letters, synthetic_letter_count,
+)
+
+
+class Command(BaseCommand):
+    help = ("Создает синтетические письма с результатами анализа, вариантами ответов и вопросами "
+            "для нагрузочных тестов (benchmark_views)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('count', type=int, nargs='?', default=0, help='Сколько писем создать')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Размер пачки для bulk_create')
+        parser.add_argument('--days', type=int, default=365, help='За какой период распределить даты загрузки')
+        parser.add_argument('--seed', type=int, help='Начальное значение генератора')
+        parser.add_argument('--delete', action='store_true', help='Удалить ранее созданные синтетические письма')
+
+    def handle(self, *args, **options):
+        if options['delete']:
+            self.stdout.write(f"Удалено объектов: {delete_synthetic_letters()}")
+            if not options['count']:
+                return
+        if options['count'] < 1:
+            raise CommandError("Укажите количество писем или --delete")
+        if options['batch_size'] < 1 or options['days'] < 1:
+            raise CommandError("--batch-size и --days должны быть положительными")
+
+        step = options['batch_size'] * 10
+        generator = SyntheticDataGenerator(
+            seed=options['seed'],
+            days=options['days'],
+            batch_size=options['batch_size'],
+            progress=lambda done, total: (done % step == 0 or done == total)
+            and self.stdout.write(f"  создано писем: {done}/{total}"),
+        )
+        totals = generator.generate(options['count'])
+        self.stdout.write(
+            f"Создано писем: {totals['letters']}, результатов анализа: {totals['analyses']}, "
+            f"вариантов ответов: {totals['responses']}, вопросов: {totals['questions']}"
+        )
+        self.stdout.write(f"Всего синтетических писем: {synthetic_letter_count()}")
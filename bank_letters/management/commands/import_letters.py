@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bank_letters.services.letter_import import LetterImporter
+
+
+class Command(BaseCommand):
+    help = "Массовый импорт писем из mbox, .eml (файлов и каталогов), CSV и ZIP архивов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Файлы или каталоги для импорта')
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help='Размер пачки для bulk_create')
+        parser.add_argument('--no-analysis', action='store_true',
+                            help='Не ставить импортированные письма в очередь анализа')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size должен быть положительным")
+
+        importer = LetterImporter(
+            chunk_size=options['chunk_size'],
+            enqueue=not options['no_analysis'],
+            progress=lambda report: self.stdout.write(
+                f"  {report.name}: импортировано {report.imported}, пропущено {report.skipped}"
+            ),
+        )
+
+        total_imported = 0
+        total_skipped = 0
+        for path in options['paths']:
+            self.stdout.write(f"Импорт {path}...")
+            try:
+                reports = importer.import_path(path)
+            except OSError as e:
+                self.stderr.write(f"Не удалось открыть {path}: {e}")
+                continue
+
+            for report in reports:
+                total_imported += report.imported
+                total_skipped += report.skipped
+                self.stdout.write(
+                    f"{report.name}: импортировано {report.imported}, пропущено {report.skipped}"
+                )
+                for error in report.errors:
+                    self.stderr.write(f"  {error}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Готово: импортировано {total_imported}, пропущено {total_skipped}"
+        ))
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from bank_letters.models import Letter, LetterLshBucket
+from bank_letters.services.near_duplicates import index_letters
+
+
+class Command(BaseCommand):
+    help = "Строит сигнатуры MinHash и индекс почти дубликатов для писем, загруженных до его появления"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help="Удалить индекс и связи дубликатов и построить их заново (после смены порога)")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            with transaction.atomic():
+                LetterLshBucket.objects.all().delete()
+                Letter.objects.update(minhash_signature=None, duplicate_of=None, duplicate_similarity=None)
+
+        # Письма индексируются по возрастанию id: представителем группы становится самое раннее
+        pending = Letter.objects.filter(minhash_signature__isnull=True).only('id', 'subject', 'original_text')
+        last_id = 0
+        indexed = duplicates = 0
+        while True:
+            letters = list(pending.filter(id__gt=last_id).order_by('id')[:options['batch_size']])
+            if not letters:
+                break
+            duplicates += len(index_letters(letters))
+            indexed += len(letters)
+            last_id = letters[-1].id
+            self.stdout.write(f"Обработано писем: {indexed}")
+
+        self.stdout.write(self.style.SUCCESS(f"Проиндексировано писем: {indexed}, почти дубликатов: {duplicates}"))
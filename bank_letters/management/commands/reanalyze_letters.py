@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from bank_letters.models import CategoryRegistryVersion
+from bank_letters.services.reanalysis import reanalysis_progress, start_reanalysis, stop_reanalysis
+
+
+class Command(BaseCommand):
+    help = ("Показывает ход фонового повторного анализа писем после смены категорий; "
+            "письма анализируют обработчики run_analysis_workers")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', action='store_true',
+                            help="Запустить повторный анализ писем, проанализированных по прежним версиям категорий")
+        parser.add_argument('--stop', action='store_true',
+                            help="Приостановить постановку новых порций (поставленные задачи доработают)")
+
+    def handle(self, *args, **options):
+        if options['start'] and options['stop']:
+            raise CommandError("Укажите только один из параметров --start и --stop")
+
+        if options['start']:
+            with transaction.atomic():
+                CategoryRegistryVersion.objects.get_or_create(pk=1)
+                start_reanalysis()
+            self.stdout.write("Повторный анализ запущен")
+        elif options['stop']:
+            stop_reanalysis()
+            self.stdout.write("Повторный анализ приостановлен")
+
+        progress = reanalysis_progress()
+        state = "идет" if progress['active'] else "не идет"
+        self.stdout.write(f"Версия категорий: {progress['version']}, повторный анализ {state}")
+        if progress['started_at']:
+            self.stdout.write(f"Запущен: {progress['started_at']:%Y-%m-%d %H:%M:%S}")
+        if progress['finished_at']:
+            self.stdout.write(f"Завершен: {progress['finished_at']:%Y-%m-%d %H:%M:%S}")
+        self.stdout.write(
+            f"Проанализировано по текущим категориям: {progress['done']} из {progress['analyzed']} "
+            f"({progress['percent']}%), в очереди: {progress['queued']}, с ошибкой: {progress['failed']}"
+        )
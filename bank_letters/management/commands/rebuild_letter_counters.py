@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from bank_letters.services.letter_statistics import counters_enabled, rebuild_letter_counters
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает таблицу счетчиков писем LetterCounter (после включения LETTER_COUNTERS_ENABLED или массовых изменений)"
+
+    def handle(self, *args, **options):
+        if not counters_enabled():
+            self.stdout.write(self.style.WARNING(
+                "LETTER_COUNTERS_ENABLED выключен: счетчики пересчитаны, но не будут обновляться при сохранении писем"
+            ))
+        rows = rebuild_letter_counters()
+        self.stdout.write(self.style.SUCCESS(f"Счетчики пересчитаны: {rows} записей"))
@@ -0,0 +1,64 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def _worker_main(stop_event, poll_interval, drain):
+    """Точка входа дочернего процесса-обработчика"""
+    # Останавливаемся по сигналу от родителя, а не по Ctrl+C в каждом процессе
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from bank_letters.services.analysis_queue import run_worker
+    from bank_letters.services.llm_client import LLMClient
+
+    try:
+        run_worker(LLMClient(), stop_event=stop_event, poll_interval=poll_interval, drain=drain)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Запускает обработчики очереди анализа писем (можно запускать на нескольких узлах)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Количество процессов-обработчиков на этом узле')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Пауза между проверками пустой очереди (секунды)')
+        parser.add_argument('--drain', action='store_true',
+                            help='Обработать очередь и завершиться')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+
+        # Дочерние процессы не должны наследовать открытые соединения с БД
+        connections.close_all()
+
+        ctx = multiprocessing.get_context('fork')
+        stop_event = ctx.Event()
+        processes = [
+            ctx.Process(
+                target=_worker_main,
+                args=(stop_event, options['poll_interval'], options['drain']),
+                name=f'analysis-worker-{i + 1}',
+            )
+            for i in range(workers)
+        ]
+
+        def _stop(signum, frame):
+            self.stdout.write("Получен сигнал остановки, завершаем обработчики...")
+            stop_event.set()
+
+        signal.signal(signal.SIGINT, _stop)
+        signal.signal(signal.SIGTERM, _stop)
+
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Запущено обработчиков анализа: {workers}")
+
+        for process in processes:
+            process.join()
+
+        self.stdout.write(self.style.SUCCESS("Обработчики анализа остановлены"))
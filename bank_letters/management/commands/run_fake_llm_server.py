@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bank_letters.services.fake_llm_server import (
+    OPERATIONS, FakeLLMConfig, FakeLLMServer, LatencyDistribution, load_analyses,
+)
+
+
+class Command(BaseCommand):
+    help = ("Запускает локальный OpenAI-совместимый сервер вместо Yandex Cloud для нагрузочных тестов; "
+            "приложение подключается к нему через LLM_BASE_URL")
+    # Серверу не нужны БД и проверки проекта
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8081)
+        parser.add_argument('--latency', default='0',
+                            help=("Задержка ответа по умолчанию: fixed:0.5, uniform:0.2,1.5, normal:0.8,0.2, "
+                                  "lognormal:0.8,0.5 (медиана, sigma), exponential:0.5"))
+        for operation in OPERATIONS:
+            parser.add_argument(f'--{operation}-latency', help=f'Задержка операции {operation} (по умолчанию --latency)')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 500')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Доля ответов 429')
+        parser.add_argument('--hang-rate', type=float, default=0.0,
+                            help='Доля запросов, ответ на которые задерживается на --hang-seconds')
+        parser.add_argument('--hang-seconds', type=float, default=60.0)
+        parser.add_argument('--analyses', help='JSON файл с заготовленными результатами анализа (RequestAnalysis)')
+        parser.add_argument('--stream-chunks', type=int, default=20, help='Число фрагментов потокового ответа')
+        parser.add_argument('--seed', type=int, help='Начальное значение генератора случайных чисел')
+        parser.add_argument('--verbose', action='store_true', help='Журналировать каждый запрос')
+
+    def handle(self, *args, **options):
+        try:
+            default = LatencyDistribution.parse(options['latency'])
+            latency = {
+                operation: LatencyDistribution.parse(options[f'{operation}_latency'])
+                if options[f'{operation}_latency'] else default
+                for operation in OPERATIONS
+            }
+            analyses = load_analyses(options['analyses']) if options['analyses'] else []
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        rates = (options['error_rate'], options['rate_limit_rate'], options['hang_rate'])
+        if any(rate < 0 for rate in rates) or sum(rates) > 1:
+            raise CommandError("Доли ошибок должны быть неотрицательными и в сумме не больше 1")
+
+        config = FakeLLMConfig(
+            latency=latency,
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            hang_rate=options['hang_rate'],
+            hang_seconds=options['hang_seconds'],
+            analyses=analyses,
+            stream_chunks=options['stream_chunks'],
+            seed=options['seed'],
+        )
+        server = FakeLLMServer((options['host'], options['port']), config, verbose=options['verbose'])
+
+        self.stdout.write(f"Локальный LLM сервер: {server.base_url}")
+        self.stdout.write("Задержки: " + ", ".join(f"{op}={latency[op]}" for op in OPERATIONS))
+        if analyses:
+            self.stdout.write(f"Заготовленных результатов анализа: {len(analyses)}")
+        self.stdout.write(f"Для приложения: LLM_BASE_URL={server.base_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write("Сервер остановлен")
+        finally:
+            server.server_close()
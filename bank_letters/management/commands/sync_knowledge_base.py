@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bank_letters.services.llm_client import LLMClient
+from bank_letters.services.rag_sync import KnowledgeBaseSync
+
+
+class Command(BaseCommand):
+    help = "Инкрементально синхронизирует txt файлы базы знаний с векторным хранилищем"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Только показать, что изменится")
+        parser.add_argument(
+            '--prune-untracked', action='store_true',
+            help="Удалить из хранилища файлы, которых нет в манифесте (дубли прежних загрузок)"
+        )
+        parser.add_argument('--workers', type=int, default=None, help="Размер пула потоков (по умолчанию RAG_SYNC_THREADS или 8)")
+
+    def handle(self, *args, **options):
+        llm_client = LLMClient()
+        sync = KnowledgeBaseSync(llm_client, max_workers=options['workers'])
+        report = sync.sync(dry_run=options['dry_run'], prune_untracked=options['prune_untracked'])
+
+        self.stdout.write(report.summary())
+        if report.errors:
+            raise CommandError(f"Синхронизация завершилась с ошибками: {len(report.errors)}")
@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bank_letters.models import AnalysisResult, Letter
+from bank_letters.services.analysis_queue import build_analysis_text
+from bank_letters.services.category_registry import get_category_registry
+from bank_letters.services.preclassifier import TARGET_FIELDS, get_preclassifier, save_model, train_model
+from bank_letters.services.response_processor import DEFAULT_SUMMARY
+
+# Результаты, полученные от нейросети (из кэша - тоже ее ответы); старые записи без source - тоже LLM
+TRAINING_SOURCES = ('llm', 'cache', None)
+
+
+class Command(BaseCommand):
+    help = "Обучает локальный предклассификатор на результатах анализа писем нейросетью"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-examples', type=int, default=100,
+                            help="Минимальное число писем для обучения (по умолчанию 100)")
+        parser.add_argument('--holdout', type=float, default=0.2,
+                            help="Доля писем для проверки и калибровки уверенности (по умолчанию 0.2)")
+        parser.add_argument('--threshold', type=float, default=None,
+                            help="Порог уверенности для отчета (по умолчанию PRECLASSIFIER_THRESHOLD)")
+        parser.add_argument('--output', default=None,
+                            help="Файл модели (по умолчанию PRECLASSIFIER_MODEL_PATH)")
+
+    def handle(self, *args, **options):
+        preclassifier = get_preclassifier()
+        threshold = options['threshold'] or preclassifier.threshold
+        output = options['output'] or preclassifier.model_path
+
+        category_ids = {category['id'] for category in Letter.get_classification_choices_for_llm()}
+        examples = self._examples(category_ids)
+        if len(examples) < options['min_examples']:
+            raise CommandError(
+                f"Недостаточно писем для обучения: {len(examples)} (нужно не меньше {options['min_examples']})"
+            )
+
+        model, report = train_model(examples, category_ids, holdout=options['holdout'], threshold=threshold)
+        save_model(model, output)
+
+        self.stdout.write(f"Писем для обучения: {report['examples']}, на проверке: {report['holdout']}")
+        for field, stats in report['fields'].items():
+            self.stdout.write(f"  {field}: точность {stats['accuracy']:.1%}, температура {stats['temperature']}")
+        precision = f"{report['precision']:.1%}" if report['precision'] is not None else "-"
+        self.stdout.write(
+            f"При пороге {threshold}: без LLM обрабатывается {report['coverage']:.1%} писем, "
+            f"все три поля верны в {precision} из них"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Модель сохранена в {output}"))
+
+    def _examples(self, category_ids):
+        examples = []
+        # Письма, проанализированные по прежнему набору категорий, в обучение не берем
+        results = AnalysisResult.objects.exclude(
+            Letter.stale_classification_q(get_category_registry().version, prefix='letter__')
+        ).select_related('letter').only(
+            'analysis_data', 'letter__sender', 'letter__subject', 'letter__original_text'
+        )
+        for result in results.iterator(chunk_size=500):
+            data = result.analysis_data or {}
+            if data.get('source') not in TRAINING_SOURCES or data.get('summary') == DEFAULT_SUMMARY:
+                continue
+            if any(data.get(field) is None for field in TARGET_FIELDS):
+                continue
+            # Категории из прежнего набора для текущей модели бесполезны
+            if data['classification'] not in category_ids:
+                continue
+            examples.append((build_analysis_text(result.letter), {field: data[field] for field in TARGET_FIELDS}))
+        return examples
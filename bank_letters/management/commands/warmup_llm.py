@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bank_letters.services.llm_client import LLMClient
+from bank_letters.services.token_budget import HeuristicEncoder, get_encoder
+
+
+class Command(BaseCommand):
+    help = (
+        "Подготавливает RAG заранее: определяет векторное хранилище и сохраняет его в манифест "
+        "(или строит локальный индекс BM25) и скачивает кодировку tiktoken в TIKTOKEN_CACHE_DIR, "
+        "чтобы процессы приложения стартовали без обращений к сети"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--refresh', action='store_true',
+            help="Игнорировать сохраненный манифест и заново запросить хранилище у API"
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        encoder = get_encoder()
+        if isinstance(encoder, HeuristicEncoder):
+            self.stderr.write("Кодировка tiktoken недоступна, токены будут оцениваться по длине текста")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Кодировка tiktoken {encoder.encoding.name} загружена"))
+
+        llm_client = LLMClient()
+        retriever = llm_client.retriever
+
+        if retriever.local:
+            if options['refresh']:
+                retriever.rebuild()
+            if not retriever.is_available():
+                raise CommandError("Локальный индекс BM25 пуст: нет txt файлов в папке с данными")
+            self.stdout.write(self.style.SUCCESS(
+                f"Индекс BM25 готов: {len(retriever.index)} фрагментов ({retriever.index_path})"
+            ))
+        else:
+            vector_store_id = llm_client.ensure_rag(refresh=options['refresh'])
+            if not vector_store_id:
+                raise CommandError("Не удалось определить векторное хранилище, подробности выше")
+            entry = llm_client.rag_manifest.get_store(llm_client.rag_manifest_key) or {}
+            self.stdout.write(self.style.SUCCESS(
+                f"Векторное хранилище {llm_client.vector_store_name}: {vector_store_id}, "
+                f"файлов в манифесте: {len(entry.get('files', {}))} ({llm_client.rag_manifest.path})"
+            ))
+
+        self.stdout.write(f"Готово за {time.perf_counter() - started:.2f} с")
@@ -0,0 +1,80 @@
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.urls import Resolver404, resolve
+
+from bank_letters.services.metrics import VIEW_SECONDS
+from bank_letters.structured_logging import log_context
+
+
+class ViewMetricsMiddleware:
+    """Время обработки запросов по представлениям (метрика bank_letters_view_seconds).
+
+    Для потоковых ответов (SSE) замеряется время до начала ответа.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, started)
+        return response
+
+    def _observe(self, request, response, started):
+        match = getattr(request, 'resolver_match', None)
+        VIEW_SECONDS.observe(
+            time.perf_counter() - started,
+            view=match.url_name if match and match.url_name else 'unmatched',
+            method=request.method,
+            status=response.status_code,
+        )
+
+
+class RequestContextMiddleware:
+    """Идентификатор запроса (X-Request-ID) и номер письма из URL для записей журнала"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _context(self, request):
+        request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+        try:
+            letter_id = resolve(request.path_info).kwargs.get('letter_id')
+        except Resolver404:
+            letter_id = None
+        return request_id, letter_id
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request_id, letter_id = self._context(request)
+        with log_context(request_id=request_id, letter_id=letter_id):
+            response = self.get_response(request)
+        response['X-Request-ID'] = request_id
+        return response
+
+    async def __acall__(self, request):
+        request_id, letter_id = self._context(request)
+        with log_context(request_id=request_id, letter_id=letter_id):
+            response = await self.get_response(request)
+        response['X-Request-ID'] = request_id
+        return response
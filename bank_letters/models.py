@@ -1,5 +1,7 @@
 # models.py
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import models, transaction
 from django.utils import timezone
 
 
@@ -21,6 +23,30 @@ class ClassificationCategory(models.Model):
         return f"{self.number}. {self.name}"
 
 
+class CategoryRegistryVersion(models.Model):
+    """Версия набора категорий (единственная строка): меняется при каждом изменении категорий,
+    по ней процессы узнают, что закэшированный реестр категорий устарел"""
+    version = models.BigIntegerField(default=0, verbose_name="Версия")
+    updated_at = models.DateTimeField(auto_now=True)
+    # Фоновый повторный анализ писем, проанализированных по прежним версиям (services/reanalysis.py)
+    reanalysis_active = models.BooleanField(default=False, verbose_name="Идет повторный анализ")
+    reanalysis_started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начало повторного анализа")
+    reanalysis_finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Окончание повторного анализа")
+
+    class Meta:
+        verbose_name = "Версия категорий"
+        verbose_name_plural = "Версия категорий"
+
+    def __str__(self):
+        return f"Версия категорий {self.version}"
+
+
+class LetterManager(models.Manager):
+    def get_queryset(self):
+        # Поисковый вектор и сигнатура нужны только в поиске - не загружаем их вместе с письмом
+        return super().get_queryset().defer('search_vector', 'minhash_signature')
+
+
 class Letter(models.Model):
     # Базовые категории (будут использоваться только если нет пользовательских)
     BASE_CLASSIFICATION_CHOICES = [
@@ -58,6 +84,13 @@ class Letter(models.Model):
         ('archived', 'В архиве'),
     ]
 
+    # Группы статусов для сортировки списка: письма в работе выше завершенных
+    STATUS_GROUP_IN_WORK = 1
+    STATUS_GROUP_CLOSED = 2
+    STATUS_GROUP_OTHER = 3
+    IN_WORK_STATUSES = ['new', 'analyzed', 'response_generated']
+    CLOSED_STATUSES = ['done', 'archived']
+
     # Основные поля (заполняются пользователем)
     sender = models.CharField(
         max_length=255,
@@ -120,15 +153,101 @@ class Letter(models.Model):
         default='new',
         verbose_name="Статус"
     )
+    # Вычисляется СУБД из статуса, чтобы сортировку списка писем обслуживал индекс
+    status_group = models.GeneratedField(
+        expression=models.Case(
+            models.When(status__in=IN_WORK_STATUSES, then=models.Value(STATUS_GROUP_IN_WORK)),
+            models.When(status__in=CLOSED_STATUSES, then=models.Value(STATUS_GROUP_CLOSED)),
+            default=models.Value(STATUS_GROUP_OTHER),
+        ),
+        output_field=models.SmallIntegerField(),
+        db_persist=True,
+        verbose_name="Группа статуса"
+    )
+    # Полнотекстовый индекс (русская морфология): тема и отправитель важнее краткого
+    # содержания, а оно - текста письма и ответа. Поддерживается самой СУБД.
+    search_vector = models.GeneratedField(
+        expression=(
+            SearchVector('subject', 'sender', weight='A', config='russian')
+            + SearchVector('summary', weight='B', config='russian')
+            + SearchVector('original_text', 'final_response', weight='C', config='russian')
+        ),
+        output_field=SearchVectorField(),
+        db_persist=True,
+        verbose_name="Поисковый вектор"
+    )
+
+    # Почти дубликаты (services/near_duplicates.py): сигнатура MinHash текста и
+    # ссылка на самое раннее похожее письмо - представителя группы
+    minhash_signature = models.BinaryField(null=True, blank=True, verbose_name="Сигнатура MinHash")
+    duplicate_of = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='duplicates',
+        verbose_name="Почти дубликат письма"
+    )
+    duplicate_similarity = models.FloatField(null=True, blank=True, verbose_name="Сходство с письмом")
+
+    # Версия набора категорий, по которому письмо проанализировано (CategoryRegistryVersion).
+    # Письма с меньшей версией анализируются повторно в фоне; пусто - анализ до появления версий
+    classification_version = models.BigIntegerField(null=True, blank=True, verbose_name="Версия категорий анализа")
+
+    objects = LetterManager()
 
     class Meta:
         verbose_name = "Письмо"
         verbose_name_plural = "Письма"
         ordering = ['-uploaded_at']
+        indexes = [
+            # Срочные и просроченные письма для статистики
+            models.Index(fields=['sla_deadline'], name='letter_sla_deadline_idx'),
+            # Порядок списка писем (см. services/letter_pagination.py): без фильтров,
+            # с фильтром по статусу и с фильтром по классификации
+            models.Index(fields=['status_group', 'sla_deadline', '-uploaded_at', '-id'], name='letter_list_order_idx'),
+            models.Index(fields=['status', 'sla_deadline', '-uploaded_at', '-id'], name='letter_list_status_idx'),
+            models.Index(
+                fields=['classification', 'status_group', 'sla_deadline', '-uploaded_at', '-id'],
+                name='letter_list_class_idx'
+            ),
+            # Очередь повторного анализа по SLA (services/reanalysis.py)
+            models.Index(fields=['classification_version', 'sla_deadline'], name='letter_class_version_idx'),
+            # Полнотекстовый поиск (services/letter_search.py)
+            GinIndex(fields=['search_vector'], name='letter_search_vector_idx'),
+        ]
 
     def __str__(self):
         return f"Письмо #{self.id} - {self.subject}"
 
+    def save(self, *args, **kwargs):
+        """Сохраняет письмо; при включенных счетчиках статистики обновляет их в той же транзакции"""
+        from bank_letters.services.letter_statistics import counters_enabled, COUNTED_FIELDS, apply_counter_change
+
+        update_fields = kwargs.get('update_fields')
+        if not counters_enabled() or (update_fields is not None and not set(update_fields) & set(COUNTED_FIELDS)):
+            return super().save(*args, **kwargs)
+
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding and self.pk is not None:
+                # Блокируем строку, чтобы параллельные изменения письма не посчитались дважды
+                previous = Letter.objects.select_for_update().filter(pk=self.pk).values(*COUNTED_FIELDS).first()
+            super().save(*args, **kwargs)
+            apply_counter_change(previous, {field: getattr(self, field) for field in COUNTED_FIELDS})
+
+    def delete(self, *args, **kwargs):
+        from bank_letters.services.letter_statistics import counters_enabled, COUNTED_FIELDS, apply_counter_change
+
+        if not counters_enabled():
+            return super().delete(*args, **kwargs)
+
+        with transaction.atomic():
+            previous = Letter.objects.select_for_update().filter(pk=self.pk).values(*COUNTED_FIELDS).first()
+            result = super().delete(*args, **kwargs)
+            apply_counter_change(previous, None)
+        return result
+
     def get_short_subject(self):
         """Возвращает укороченную тему (первые 50 символов)"""
         if len(self.subject) > 50:
@@ -136,31 +255,35 @@ class Letter(models.Model):
         return self.subject
 
     def get_classification_display(self):
-        """Возвращает отображаемое название классификации"""
+        """Возвращает отображаемое название классификации (из кэша категорий, без запросов к БД)"""
+        from bank_letters.services.category_registry import get_category_registry
+
         if self.classification is None:
             return "Не определен"
+        return get_category_registry().get_name(self.classification)
 
-        try:
-            # Сначала проверяем пользовательские категории
-            custom_categories = ClassificationCategory.objects.filter(is_active=True)
-            if custom_categories.exists():
-                for category in custom_categories:
-                    if category.number == self.classification:
-                        return category.name
+    @staticmethod
+    def stale_classification_q(version, prefix=''):
+        """Условие "проанализировано по прежнему набору категорий" для текущей версии version.
 
-            # Если пользовательских нет или не нашли совпадение, используем базовые
-            for num, name in self.BASE_CLASSIFICATION_CHOICES:
-                if num == self.classification:
-                    return name
+        Письмо без версии проанализировано до ее появления - считается версией 0
+        (до первой смены категорий). prefix - путь к письму, например 'letter__'.
+        """
+        stale = models.Q(**{f'{prefix}classification_version__lt': version})
+        if version > 0:
+            stale |= models.Q(**{f'{prefix}classification_version__isnull': True})
+        return ~models.Q(**{f'{prefix}status': 'new'}) & stale
 
-            return "Не определен"
-        except Exception as e:
-            # На случай ошибки БД, используем базовые категории
-            print(f"Ошибка в get_classification_display: {e}")
-            for num, name in self.BASE_CLASSIFICATION_CHOICES:
-                if num == self.classification:
-                    return name
-            return "Не определен"
+    def is_classification_stale_for(self, version):
+        """То же условие, что stale_classification_q, для загруженного письма"""
+        return self.status != 'new' and (self.classification_version or 0) < version
+
+    @property
+    def is_classification_stale(self):
+        """Письмо проанализировано по прежнему набору категорий и ждет повторного анализа"""
+        from bank_letters.services.category_registry import get_category_registry
+
+        return self.is_classification_stale_for(get_category_registry().version)
 
     @classmethod
     def get_base_classification_choices(cls):
@@ -170,54 +293,61 @@ class Letter(models.Model):
     @classmethod
     def get_classification_choices(cls):
         """Возвращает актуальные choices для классификации (только number и name)"""
-        try:
-            # Проверяем, есть ли активные пользовательские категории
-            custom_categories = ClassificationCategory.objects.filter(is_active=True)
-            if custom_categories.exists():
-                # ВОЗВРАЩАЕМ ТОЛЬКО (number, name) - без description!
-                choices = [(cat.number, cat.name) for cat in custom_categories.order_by('number')]
-                print(f"Используются пользовательские категории: {choices}")
-                return choices
-            # Возвращаем базовые категории (они уже в правильном формате)
-            print(f"Используются базовые категории: {cls.BASE_CLASSIFICATION_CHOICES}")
-            return cls.BASE_CLASSIFICATION_CHOICES
-        except Exception as e:
-            print(f"Ошибка в get_classification_choices: {e}")
-            # На случай ошибки БД, возвращаем базовые категории
-            return cls.BASE_CLASSIFICATION_CHOICES
+        from bank_letters.services.category_registry import get_category_registry
+
+        return list(get_category_registry().choices)
 
     @classmethod
     def clear_classification_cache(cls):
-        """Очищает кэш категорий (если он используется)"""
-        if hasattr(cls, '_classification_choices_cache'):
-            delattr(cls, '_classification_choices_cache')
+        """Сбрасывает кэш категорий во всех процессах"""
+        from bank_letters.services.category_registry import bump_category_version
+
+        bump_category_version()
 
     @classmethod
     def get_classification_choices_for_llm(cls):
         """Возвращает полные данные категорий для LLM (с описаниями)"""
-        try:
-            custom_categories = ClassificationCategory.objects.filter(is_active=True)
-            if custom_categories.exists():
-                return [
-                    {
-                        "id": cat.number,
-                        "name": cat.name,
-                        "description": cat.description or ""
-                    }
-                    for cat in custom_categories.order_by('number')
-                ]
-            # Для базовых категорий создаем аналогичную структуру
-            return [
-                {
-                    "id": number,
-                    "name": name,
-                    "description": ""
-                }
-                for number, name in cls.BASE_CLASSIFICATION_CHOICES
-            ]
-        except Exception as e:
-            print(f"Ошибка в get_classification_choices_for_llm: {e}")
-            return []
+        from bank_letters.services.category_registry import get_category_registry
+
+        return get_category_registry().for_llm()
+
+
+class LetterCounter(models.Model):
+    """Количество писем по значению поля (статус, классификация, критичность) для статистики.
+
+    Используется при LETTER_COUNTERS_ENABLED=true: обновляется при сохранении письма,
+    полностью пересчитывается командой rebuild_letter_counters.
+    """
+    dimension = models.CharField(max_length=32, verbose_name="Поле")
+    value = models.CharField(max_length=64, blank=True, verbose_name="Значение")
+    count = models.BigIntegerField(default=0, verbose_name="Количество")
+
+    class Meta:
+        verbose_name = "Счетчик писем"
+        verbose_name_plural = "Счетчики писем"
+        constraints = [
+            models.UniqueConstraint(fields=['dimension', 'value'], name='unique_letter_counter'),
+        ]
+
+    def __str__(self):
+        return f"{self.dimension}={self.value}: {self.count}"
+
+
+class LetterLshBucket(models.Model):
+    """Корзина LSH-индекса сигнатуры письма: письма с общей корзиной - кандидаты в дубликаты"""
+    letter = models.ForeignKey(Letter, on_delete=models.CASCADE, related_name='lsh_buckets', verbose_name="Письмо")
+    band = models.SmallIntegerField(verbose_name="Полоса")
+    bucket = models.BigIntegerField(verbose_name="Корзина")
+
+    class Meta:
+        verbose_name = "Корзина LSH"
+        verbose_name_plural = "Корзины LSH"
+        indexes = [
+            models.Index(fields=['bucket'], name='letter_lsh_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"Письмо #{self.letter_id}, полоса {self.band}"
 
 
 class AnalysisResult(models.Model):
@@ -255,4 +385,84 @@ class LetterQuestion(models.Model):
         ordering = ['-asked_at']
 
     def __str__(self):
-        return f"Вопрос к письму #{self.letter.id}"
\ No newline at end of file
+        return f"Вопрос к письму #{self.letter.id}"
+
+class AnalysisJob(models.Model):
+    """Задача фонового анализа письма (очередь в БД)"""
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Выполнена'),
+        ('failed', 'Ошибка'),
+    ]
+
+    ACTIVE_STATUSES = ['pending', 'running']
+
+    letter = models.ForeignKey(
+        Letter,
+        on_delete=models.CASCADE,
+        related_name='analysis_jobs',
+        verbose_name="Письмо"
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name="Статус задачи"
+    )
+    attempts = models.IntegerField(default=0, verbose_name="Количество попыток")
+    max_attempts = models.IntegerField(default=3, verbose_name="Максимум попыток")
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="Не раньше чем")
+    locked_by = models.CharField(max_length=255, blank=True, verbose_name="Обработчик")
+    locked_at = models.DateTimeField(null=True, blank=True, verbose_name="Взята в работу")
+    last_error = models.TextField(blank=True, verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата постановки")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Дата завершения")
+    # Задача повторного анализа после смены категорий: версия, для которой она поставлена
+    category_version = models.BigIntegerField(null=True, blank=True, verbose_name="Версия категорий")
+
+    class Meta:
+        verbose_name = "Задача анализа"
+        verbose_name_plural = "Задачи анализа"
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='analysis_job_queue_idx'),
+        ]
+        constraints = [
+            # Не больше одной активной задачи на письмо
+            models.UniqueConstraint(
+                fields=['letter'],
+                condition=models.Q(status__in=['pending', 'running']),
+                name='unique_active_analysis_job',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Задача анализа письма #{self.letter_id} ({self.get_status_display()})"
+
+
+
+class AnalysisCacheEntry(models.Model):
+    """Кэш результатов анализа по содержимому письма"""
+    key = models.CharField(max_length=64, unique=True, verbose_name="Ключ")
+    model_name = models.CharField(max_length=255, verbose_name="Модель")
+    result = models.JSONField(verbose_name="Результат анализа")
+    sla_offset_seconds = models.IntegerField(
+        null=True,
+        blank=True,
+        verbose_name="Смещение дедлайна (секунды)",
+        help_text="Дедлайн пересчитывается относительно момента попадания в кэш"
+    )
+    hits = models.IntegerField(default=0, verbose_name="Попадания")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    last_used_at = models.DateTimeField(default=timezone.now, verbose_name="Последнее использование")
+
+    class Meta:
+        verbose_name = "Кэш анализа"
+        verbose_name_plural = "Кэш анализа"
+        indexes = [
+            models.Index(fields=['last_used_at'], name='analysis_cache_lru_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key[:12]}... ({self.hits} попаданий)"
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import timedelta
+
+from django.db import IntegrityError
+from django.db.models import F, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from bank_letters.models import AnalysisCacheEntry
+
+# Строки-обращения, которые в массовых рассылках отличаются только получателем
+# Удаляется только само обращение: до первой запятой или восклицательного знака (не больше
+# нескольких слов - имя получателя) либо строка целиком, если в ней нет ничего, кроме обращения.
+# Текст письма в той же строке ("Здравствуйте, у меня списали...") остается в ключе.
+GREETING_RE = re.compile(
+    r'^[ \t]*(?:уважаем\w*|добрый[ \t]+(?:день|вечер)|доброе[ \t]+утро|здравствуй\w*|dear|hello)\b'
+    r'(?:(?:[ \t]+[\w.-]+){0,4}[ \t]*[,!]|[ \t]*$)?',
+    re.IGNORECASE | re.MULTILINE
+)
+
+SLA_DEADLINE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def normalize_letter_text(text):
+    """Нормализует текст письма для ключа кэша"""
+    text = GREETING_RE.sub('', text or '')
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+
+def categories_fingerprint(categories):
+    """Отпечаток активного набора категорий"""
+    payload = json.dumps(
+        [(c.get('id'), c.get('name'), c.get('description', '')) for c in categories or []],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def make_cache_key(text, categories, model_name, prompt_version):
+    """Ключ кэша: текст письма, набор категорий, модель и версия промпта (CompiledPrompt.version)"""
+    key_source = '\x1f'.join([
+        hashlib.sha256(normalize_letter_text(text).encode('utf-8')).hexdigest(),
+        categories_fingerprint(categories),
+        model_name,
+        str(prompt_version),
+    ])
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """Постоянный кэш результатов анализа писем в БД с вытеснением по размеру и времени жизни"""
+
+    # Как часто (в записях) проверять превышение размера кэша
+    PRUNE_EVERY = 100
+
+    def __init__(self, enabled=None, ttl_hours=None, max_entries=None):
+        if enabled is None:
+            enabled = os.getenv('ANALYSIS_CACHE_ENABLED', 'true').lower() == 'true'
+        self.enabled = enabled
+        self.ttl = timedelta(hours=ttl_hours or int(os.getenv('ANALYSIS_CACHE_TTL_HOURS', 24 * 30)))
+        self.max_entries = max_entries or int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', 100000))
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._puts_since_prune = 0
+
+    def get(self, key):
+        """Возвращает результат анализа или None. Дедлайн пересчитывается от текущего момента."""
+        if not self.enabled:
+            return None
+
+        now = timezone.now()
+        entry = AnalysisCacheEntry.objects.filter(key=key, created_at__gte=now - self.ttl).first()
+        if entry is None:
+            self._count(hit=False)
+            return None
+
+        AnalysisCacheEntry.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used_at=now)
+        self._count(hit=True)
+
+        result = dict(entry.result)
+        if entry.sla_offset_seconds is not None:
+            result['sla_deadline'] = (now + timedelta(seconds=entry.sla_offset_seconds)).strftime(SLA_DEADLINE_FORMAT)
+        return result
+
+    def put(self, key, result, model_name):
+        """Сохраняет успешный результат анализа"""
+        if not self.enabled:
+            return
+
+        sla_offset_seconds = None
+        deadline = parse_datetime(result.get('sla_deadline') or '')
+        if deadline is not None:
+            now = timezone.now()
+            if timezone.is_naive(deadline):
+                # ResponseProcessor форматирует дедлайн от timezone.now() без зоны
+                now = now.replace(tzinfo=None)
+            sla_offset_seconds = round((deadline - now).total_seconds())
+
+        try:
+            AnalysisCacheEntry.objects.update_or_create(
+                key=key,
+                defaults={
+                    'model_name': model_name,
+                    'result': result,
+                    'sla_offset_seconds': sla_offset_seconds,
+                    'created_at': timezone.now(),
+                    'last_used_at': timezone.now(),
+                }
+            )
+        except IntegrityError:
+            # Тот же результат параллельно записал другой обработчик
+            return
+
+        with self._lock:
+            self._puts_since_prune += 1
+            should_prune = self._puts_since_prune >= self.PRUNE_EVERY
+            if should_prune:
+                self._puts_since_prune = 0
+        if should_prune:
+            self.prune()
+
+    def prune(self):
+        """Удаляет устаревшие записи и самые давно использованные сверх лимита"""
+        deleted, _ = AnalysisCacheEntry.objects.filter(created_at__lt=timezone.now() - self.ttl).delete()
+
+        overflow = AnalysisCacheEntry.objects.count() - self.max_entries
+        if overflow > 0:
+            stale_ids = list(
+                AnalysisCacheEntry.objects.order_by('last_used_at').values_list('id', flat=True)[:overflow]
+            )
+            deleted += AnalysisCacheEntry.objects.filter(id__in=stale_ids).delete()[0]
+
+        return deleted
+
+    def clear(self):
+        return AnalysisCacheEntry.objects.all().delete()[0]
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        """Счетчики попаданий текущего процесса и общий размер кэша"""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'enabled': self.enabled,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total * 100, 1) if total else 0,
+            'entries': AnalysisCacheEntry.objects.count(),
+            'total_hits': AnalysisCacheEntry.objects.aggregate(total=Sum('hits'))['total'] or 0,
+        }
@@ -0,0 +1,235 @@
+import logging
+import os
+import socket
+import time
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from bank_letters.models import Letter, AnalysisResult, AnalysisJob
+from bank_letters.services.metrics import ANALYSIS_RESULTS, DB_SAVE_SECONDS
+from bank_letters.structured_logging import log_context
+
+logger = logging.getLogger(__name__)
+
+# Через сколько секунд задача в статусе running считается брошенной
+# (обработчик упал или был убит) и может быть взята другим обработчиком
+JOB_LEASE_SECONDS = int(os.getenv('ANALYSIS_JOB_LEASE_SECONDS', 600))
+# Базовая задержка перед повторной попыткой (растет с каждой попыткой)
+JOB_RETRY_DELAY_SECONDS = int(os.getenv('ANALYSIS_JOB_RETRY_DELAY_SECONDS', 30))
+
+
+def build_analysis_text(letter):
+    """Подготавливает текст письма для анализа"""
+    return f"""
+    ОТПРАВИТЕЛЬ: {letter.sender}
+    ТЕМА: {letter.subject}
+    ТЕКСТ ПИСЬМА:
+    {letter.original_text}
+    """
+
+
+def apply_analysis_result(letter, analysis_result, category_version=None):
+    """Сохраняет результат анализа в письмо и AnalysisResult.
+
+    category_version - версия категорий, по которой выполнен анализ. Повторный анализ
+    (письмо уже не новое) обновляет классификацию, критичность и краткое содержание,
+    но не трогает статус, дедлайн, стиль и подготовленный ответ.
+    """
+    from bank_letters.services.category_registry import get_category_registry
+
+    reanalysis = letter.status != 'new'
+    letter.summary = analysis_result['summary']
+    letter.classification = analysis_result['classification']
+    letter.criticality_level = analysis_result['criticality_level']
+    letter.classification_version = (
+        category_version if category_version is not None else get_category_registry().version
+    )
+
+    if not reanalysis:
+        letter.response_style = analysis_result['response_style']
+        letter.processing_time_hours = analysis_result['processing_time_hours']
+
+        # Парсим дедлайн
+        sla_deadline_str = analysis_result['sla_deadline']
+        if sla_deadline_str:
+            try:
+                letter.sla_deadline = parse_datetime(sla_deadline_str)
+            except (ValueError, TypeError):
+                # Если не удалось распарсить, используем расчет по часам
+                letter.sla_deadline = timezone.now() + timedelta(
+                    hours=letter.processing_time_hours
+                )
+
+        letter.status = 'analyzed'
+
+    with DB_SAVE_SECONDS.time(operation='analysis'), transaction.atomic():
+        letter.save()
+        # Сохраняем полный анализ
+        AnalysisResult.objects.update_or_create(
+            letter=letter,
+            defaults={'analysis_data': analysis_result}
+        )
+        # Письмо уже проанализировано - ожидающие задачи больше не нужны
+        AnalysisJob.objects.filter(letter=letter, status='pending').update(
+            status='done', finished_at=timezone.now()
+        )
+    ANALYSIS_RESULTS.inc(source=analysis_result.get('source', 'llm'))
+
+    return letter
+
+
+def analyze_letter_now(letter, llm_client):
+    """Синхронный анализ письма нейросетью с сохранением результата.
+
+    Для почти дубликата уже проанализированного письма нейросеть не вызывается.
+    """
+    from bank_letters.services.category_registry import get_category_registry
+    from bank_letters.services.near_duplicates import reuse_duplicate_analysis
+
+    # Категории и их версия берутся из одного снимка реестра: если категории сменятся
+    # во время анализа, письмо останется устаревшим и будет проанализировано повторно
+    registry = get_category_registry()
+    analysis_result = reuse_duplicate_analysis(letter)
+    if analysis_result is None:
+        analysis_result = llm_client.analyze_letter(build_analysis_text(letter), registry.for_llm())
+    return apply_analysis_result(letter, analysis_result, category_version=registry.version)
+
+
+def enqueue_analysis(letter):
+    """Ставит письмо в очередь на анализ (не создает дубликатов активных задач)"""
+    existing = AnalysisJob.objects.filter(
+        letter=letter, status__in=AnalysisJob.ACTIVE_STATUSES
+    ).first()
+    if existing:
+        return existing
+
+    try:
+        with transaction.atomic():
+            return AnalysisJob.objects.create(letter=letter)
+    except IntegrityError:
+        # Задачу параллельно поставил другой запрос
+        return AnalysisJob.objects.filter(
+            letter=letter, status__in=AnalysisJob.ACTIVE_STATUSES
+        ).first()
+
+
+def get_active_job(letter_id):
+    """Возвращает последнюю задачу анализа письма (если есть)"""
+    return AnalysisJob.objects.filter(letter_id=letter_id).order_by('-created_at').first()
+
+
+def claim_next_job(worker_id):
+    """Забирает следующую задачу из очереди.
+
+    Использует SELECT ... FOR UPDATE SKIP LOCKED, поэтому любое количество
+    обработчиков на разных процессах и узлах не мешают друг другу.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=JOB_LEASE_SECONDS)
+
+    # Брошенные задачи, исчерпавшие попытки, больше не перезапускаем
+    AnalysisJob.objects.filter(
+        status='running', locked_at__lt=stale_before, attempts__gte=F('max_attempts')
+    ).update(status='failed', finished_at=now, last_error='Превышено время выполнения задачи')
+
+    with transaction.atomic():
+        job = (
+            AnalysisJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status='pending', run_after__lte=now) |
+                Q(status='running', locked_at__lt=stale_before)
+            )
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.status = 'running'
+        job.attempts += 1
+        job.locked_by = worker_id
+        job.locked_at = now
+        job.save(update_fields=['status', 'attempts', 'locked_by', 'locked_at'])
+
+    return job
+
+
+def run_job(job, llm_client):
+    """Выполняет задачу анализа. Вызов LLM происходит вне транзакции."""
+    try:
+        letter = Letter.objects.get(id=job.letter_id)
+
+        # Письмо уже проанализировано (например, вручную) - ничего не делаем.
+        # Задача повторного анализа выполняется, только если письмо еще устарело
+        if letter.status == 'new' or (job.category_version is not None and letter.is_classification_stale):
+            analyze_letter_now(letter, llm_client)
+
+        AnalysisJob.objects.filter(id=job.id).update(
+            status='done',
+            finished_at=timezone.now(),
+            last_error='',
+        )
+        return True
+
+    except Letter.DoesNotExist:
+        AnalysisJob.objects.filter(id=job.id).update(status='failed', finished_at=timezone.now())
+        return False
+
+    except Exception as e:
+        logger.exception("Ошибка при выполнении задачи анализа #%s: %s", job.id, e)
+        if job.attempts < job.max_attempts:
+            AnalysisJob.objects.filter(id=job.id).update(
+                status='pending',
+                run_after=timezone.now() + timedelta(seconds=JOB_RETRY_DELAY_SECONDS * job.attempts),
+                last_error=str(e),
+            )
+        else:
+            AnalysisJob.objects.filter(id=job.id).update(
+                status='failed',
+                finished_at=timezone.now(),
+                last_error=str(e),
+            )
+        return False
+
+
+def make_worker_id():
+    """Идентификатор обработчика: узел и процесс"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def run_worker(llm_client, stop_event=None, poll_interval=2.0, drain=False):
+    """Цикл обработчика очереди анализа.
+
+    Если drain=True, обработчик завершается, когда очередь опустела.
+    Когда очередь пуста, обработчик ставит следующую порцию писем
+    на повторный анализ после смены категорий (services/reanalysis.py).
+    """
+    from bank_letters.services.reanalysis import schedule_reanalysis
+
+    worker_id = make_worker_id()
+    processed = 0
+
+    while stop_event is None or not stop_event.is_set():
+        job = claim_next_job(worker_id)
+        if job is None and schedule_reanalysis():
+            continue
+        if job is None:
+            if drain:
+                break
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+
+        # Записи журнала при анализе письма помечаются задачей и номером письма
+        with log_context(request_id=f'job-{job.id}', letter_id=job.letter_id):
+            run_job(job, llm_client)
+        processed += 1
+
+    return processed
@@ -0,0 +1,409 @@
+import asyncio
+import logging
+import os
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from openai import AsyncOpenAI
+
+from bank_letters.services.models import RequestAnalysis, EmailGeneration, TextGeneration
+from bank_letters.services.prompts import EMAIL_GENERATION_PROMPTS, RESPONSE_PROMPTS, TEXT_PROMPT, get_analysis_prompt
+from .llm_client import (
+    LLMClient,
+    YAGPT_MODEL_NAME,
+    RESPONSE_INSTRUCTIONS,
+    TEXT_FALLBACK_INSTRUCTIONS,
+    RESPONSE_FALLBACK_INSTRUCTIONS,
+    STREAM_TEXT_ONLY_INSTRUCTIONS,
+    FALLBACK_TIMEOUT_SECONDS,
+)
+from .resilience import CircuitOpenError, DeadlineExceeded
+from .retrievers import merge_chunks
+from .metrics import RAG_SEARCH_SECONDS, LLM_REQUEST_SECONDS, LLM_FALLBACKS, EMERGENCY_RESPONSES, model_label
+from bank_letters.structured_logging import payload
+
+logger = logging.getLogger(__name__)
+
+# Сколько запросов к LLM может одновременно выполняться в одном процессе
+DEFAULT_MAX_CONCURRENCY = 100
+
+
+class AsyncLLMClient(LLMClient):
+    """Асинхронный клиент LLM на AsyncOpenAI.
+
+    Повторяет API LLMClient (analyze_letter, generate_response,
+    generate_all_responses, generate_text, _rag_search), но методы являются корутинами, поэтому ожидание ответа
+    нейросети не занимает поток. Промпты строятся общими методами LLMClient.
+    """
+
+    def __init__(self, max_concurrency=None):
+        super().__init__()
+        self.max_concurrency = max_concurrency or int(
+            os.getenv('LLM_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY)
+        )
+        # AsyncOpenAI и семафор привязаны к циклу событий, поэтому храним их
+        # отдельно для каждого цикла (runserver создает новый цикл на запрос)
+        self._loop_resources = weakref.WeakKeyDictionary()
+
+    def _get_loop_resources(self):
+        loop = asyncio.get_running_loop()
+        resources = self._loop_resources.get(loop)
+        if resources is None:
+            resources = (
+                # Повторами запросов к LLM управляет LLMResilience, встроенные повторы SDK отключены
+                AsyncOpenAI(
+                    base_url=self.api_url,
+                    api_key=self.api_key,
+                    project=self.folder_id,
+                    max_retries=0
+                ),
+                asyncio.Semaphore(self.max_concurrency),
+            )
+            self._loop_resources[loop] = resources
+        return resources
+
+    @property
+    def async_client(self):
+        return self._get_loop_resources()[0]
+
+    async def _call(self, method_name, **kwargs):
+        """Вызов responses.<method_name> с ограничением числа одновременных запросов"""
+        client, semaphore = self._get_loop_resources()
+        async with semaphore:
+            return await getattr(client.responses, method_name)(**kwargs)
+
+    async def analyze_letter(self, text, categories, use_cache=True, use_preclassifier=True):
+        """Анализ письма с преобразованием результата (с кэшем и предклассификатором, как в LLMClient)"""
+        model = self.make_model(model_name=YAGPT_MODEL_NAME)
+
+        cache_key = self._analysis_cache_key(text, categories, model) if use_cache else None
+        if use_cache:
+            cached = await sync_to_async(self._cache_get)(cache_key)
+            if cached is not None:
+                return self._with_source(cached, 'cache')
+
+        if use_preclassifier:
+            # Локальная модель работает миллисекунды - поток для нее не нужен
+            local_result = self.preclassifier.classify(text, categories)
+            if local_result is not None:
+                return local_result
+
+        rag_context = await self._rag_search(self._analysis_rag_query(text))
+        prompt, input_content = self._build_analysis_prompt(categories, rag_context, text)
+
+        try:
+            res = await self.resilience.acall(
+                'analyze',
+                lambda timeout: self._call(
+                    'parse',
+                    model=model,
+                    text_format=RequestAnalysis,
+                    instructions=prompt,
+                    input=input_content,
+                    timeout=timeout
+                ),
+                self.resilience.new_deadline(),
+                model=model
+            )
+            self.token_budget.stats.record_response('analyze', res, get_analysis_prompt(categories).version)
+        except Exception as e:
+            logger.error("Анализ не выполнен (%s), используем ответ по умолчанию", e)
+            return self._with_source(self.processor.process_analysis_response(None, categories), 'default')
+
+        result = self._with_source(self.processor.process_analysis_response(res.output_parsed, categories), 'llm')
+        # По версии промпта видно, какими инструкциями получен сохраненный результат
+        result['prompt_version'] = get_analysis_prompt(categories).version
+        if use_cache:
+            await sync_to_async(self._cache_put)(cache_key, result, model)
+        return result
+
+    async def generate_response(self, old_text_email, user_commentary, style):
+        """Генерация ответа в указанном стиле"""
+        user_commentary = self._ensure_user_commentary(user_commentary)
+
+        # Оба RAG запроса выполняются параллельно
+        rag_context = await self._rag_multi_search(self._response_rag_queries(old_text_email, user_commentary))
+
+        return await self._generate_styled_response(old_text_email, user_commentary, style, rag_context)
+
+    async def generate_all_responses(self, old_text_email, user_commentary, styles=None):
+        """Ответы во всех стилях сразу: один RAG поиск и параллельные генерации"""
+        user_commentary = self._ensure_user_commentary(user_commentary)
+        styles = list(styles or EMAIL_GENERATION_PROMPTS)
+
+        rag_context = await self._rag_multi_search(self._response_rag_queries(old_text_email, user_commentary))
+
+        deadline = self.resilience.new_deadline()
+        texts = await asyncio.gather(*[
+            self._generate_styled_response(old_text_email, user_commentary, style, rag_context, deadline)
+            for style in styles
+        ])
+        return dict(zip(styles, texts))
+
+    async def _generate_styled_response(self, old_text_email, user_commentary, style, rag_context, deadline=None):
+        """Генерация ответа в одном стиле по готовому RAG контексту"""
+        finished_prompt_text = self._build_response_prompt(old_text_email, user_commentary, style, rag_context)
+
+        model = self.make_model(model_name=YAGPT_MODEL_NAME)
+
+        deadline = deadline or self.resilience.new_deadline()
+        try:
+            res = await self.resilience.acall(
+                'generate',
+                lambda timeout: self._call(
+                    'parse',
+                    model=model,
+                    text_format=EmailGeneration,
+                    instructions=RESPONSE_INSTRUCTIONS,
+                    input=finished_prompt_text,
+                    timeout=timeout
+                ),
+                deadline,
+                model=model
+            )
+            self.token_budget.stats.record_response('generate', res, RESPONSE_PROMPTS[style].version)
+            return res.output_parsed.response_email
+
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            logger.error("Генерация ответа не выполнена: %s", e)
+            return self._get_emergency_response(style)
+        except Exception as e:
+            logger.warning("Все попытки не удались (%s), используем fallback", e)
+
+        try:
+            return await self._generate_response_fallback(finished_prompt_text, model, deadline)
+        except Exception as fallback_error:
+            logger.error("Fallback также не сработал: %s", fallback_error)
+            return self._get_emergency_response(style)
+
+    async def generate_text(self, text_email, user_commentary):
+        """Генерация текста для помощи в обработке сообщения"""
+        user_commentary = self._ensure_user_commentary(user_commentary)
+
+        rag_context = await self._rag_multi_search(self._text_rag_queries(text_email, user_commentary))
+
+        instructions, input_content = self._build_text_prompt(text_email, user_commentary, rag_context)
+
+        model = self.make_model(model_name=YAGPT_MODEL_NAME)
+        deadline = self.resilience.new_deadline()
+        try:
+            res = await self.resilience.acall(
+                'text',
+                lambda timeout: self._call(
+                    'parse',
+                    model=model,
+                    text_format=TextGeneration,
+                    instructions=instructions,
+                    input=input_content,
+                    timeout=timeout
+                ),
+                deadline,
+                max_attempts=1,
+                model=model
+            )
+            self.token_budget.stats.record_response('text', res, TEXT_PROMPT.version)
+
+            return res.output_parsed.response
+
+        except Exception as e:
+            logger.warning("Ошибка при генерации ответа: %s", e)
+            return await self._generate_text_fallback(instructions, input_content, model, deadline)
+
+    async def _generate_text_fallback(self, instructions, input_content, model, deadline=None):
+        """Альтернативный способ генерации текста с упрощенным запросом"""
+        try:
+            logger.info("Используем упрощенный fallback метод для генерации текста")
+
+            response = await self.resilience.acall(
+                'fallback',
+                lambda timeout: self._call(
+                    'create',
+                    model=model,
+                    instructions=TEXT_FALLBACK_INSTRUCTIONS,
+                    input=self._simplified_text_prompt(instructions, input_content),
+                    timeout=timeout
+                ),
+                deadline or self.resilience.new_deadline(),
+                max_attempts=1,
+                max_timeout=FALLBACK_TIMEOUT_SECONDS,
+                model=model
+            )
+            self.token_budget.stats.record_response('fallback', response)
+            LLM_FALLBACKS.inc(model=model_label(model), operation='text', outcome='success')
+
+            return self._clean_response_text(response.output_text)
+
+        except Exception as e:
+            logger.error("Ошибка в fallback методе для текста: %s", e)
+            LLM_FALLBACKS.inc(model=model_label(model), operation='text', outcome='error')
+            EMERGENCY_RESPONSES.inc(operation='text')
+            return "Извините, не удалось обработать ваш запрос. Пожалуйста, попробуйте переформулировать вопрос."
+
+    async def _generate_response_fallback(self, prompt, model, deadline=None):
+        """Альтернативный способ генерации ответа с упрощенным запросом"""
+        try:
+            logger.info("Используем упрощенный fallback метод")
+
+            response = await self.resilience.acall(
+                'fallback',
+                lambda timeout: self._call(
+                    'create',
+                    model=model,
+                    instructions=RESPONSE_FALLBACK_INSTRUCTIONS,
+                    input=self._simplified_response_prompt(prompt),
+                    timeout=timeout
+                ),
+                deadline or self.resilience.new_deadline(),
+                max_attempts=1,
+                max_timeout=FALLBACK_TIMEOUT_SECONDS,
+                model=model
+            )
+            self.token_budget.stats.record_response('fallback', response)
+            LLM_FALLBACKS.inc(model=model_label(model), operation='generate', outcome='success')
+
+            return self._clean_response_text(response.output_text)
+
+        except Exception as e:
+            logger.warning("Ошибка в fallback методе: %s", e)
+            LLM_FALLBACKS.inc(model=model_label(model), operation='generate', outcome='error')
+            raise e
+
+    async def stream_response(self, old_text_email, user_commentary, style):
+        """Генерация ответа по частям (асинхронный генератор фрагментов текста)"""
+        user_commentary = self._ensure_user_commentary(user_commentary)
+        rag_context = await self._rag_multi_search(self._response_rag_queries(old_text_email, user_commentary))
+        prompt = self._build_response_prompt(old_text_email, user_commentary, style, rag_context)
+        model = self.make_model(model_name=YAGPT_MODEL_NAME)
+
+        deadline = self.resilience.new_deadline()
+        started = False
+        try:
+            async for delta in self._stream_output_text(
+                'generate', model, f"{RESPONSE_INSTRUCTIONS} {STREAM_TEXT_ONLY_INSTRUCTIONS}", prompt, deadline,
+                prompt_version=RESPONSE_PROMPTS[style].version
+            ):
+                started = True
+                yield delta
+        except Exception as e:
+            if started:
+                raise
+            logger.warning("Не удалось начать потоковую генерацию ответа: %s", e)
+        if started:
+            return
+
+        try:
+            yield await self._generate_response_fallback(prompt, model, deadline)
+        except Exception as fallback_error:
+            logger.error("Fallback также не сработал: %s", fallback_error)
+            yield self._get_emergency_response(style)
+
+    async def stream_text(self, text_email, user_commentary):
+        """Ответ на вопрос о письме по частям (асинхронный генератор фрагментов текста)"""
+        user_commentary = self._ensure_user_commentary(user_commentary)
+        rag_context = await self._rag_multi_search(self._text_rag_queries(text_email, user_commentary))
+        instructions, input_content = self._build_text_prompt(text_email, user_commentary, rag_context)
+        model = self.make_model(model_name=YAGPT_MODEL_NAME)
+
+        deadline = self.resilience.new_deadline()
+        started = False
+        try:
+            async for delta in self._stream_output_text(
+                'text', model, f"{instructions}\n\n{STREAM_TEXT_ONLY_INSTRUCTIONS}", input_content, deadline,
+                prompt_version=TEXT_PROMPT.version
+            ):
+                started = True
+                yield delta
+        except Exception as e:
+            if started:
+                raise
+            logger.warning("Не удалось начать потоковую генерацию текста: %s", e)
+        if not started:
+            yield await self._generate_text_fallback(instructions, input_content, model, deadline)
+
+    async def _stream_output_text(self, operation, model, instructions, input_content, deadline, prompt_version=None):
+        """Потоковый вызов Responses API; место в семафоре занято до конца потока"""
+        timeout = self.resilience.attempt_timeout(operation, deadline)
+        client, semaphore = self._get_loop_resources()
+        started = time.monotonic()
+        labels = {'model': model_label(model), 'operation': f'{operation}_stream'}
+        try:
+            async with semaphore:
+                stream = await client.responses.create(
+                    model=model,
+                    instructions=instructions,
+                    input=input_content,
+                    stream=True,
+                    timeout=timeout
+                )
+                async with stream:
+                    async for event in stream:
+                        if event.type == 'response.completed':
+                            self.token_budget.stats.record_response(operation, event.response, prompt_version)
+                        delta = self._stream_event_delta(event)
+                        if delta:
+                            yield delta
+        except Exception as e:
+            LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome='error', **labels)
+            self.resilience.record_failure(e)
+            raise
+        except GeneratorExit:
+            # Пользователь закрыл страницу посреди ответа - провайдер при этом отвечал
+            LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome='cancelled', **labels)
+            self.resilience.record_success()
+            raise
+        except BaseException:
+            # Отмена задачи или остановка процесса - результат неизвестен
+            LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome='cancelled', **labels)
+            self.resilience.release_probe()
+            raise
+        LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome='success', **labels)
+        self.resilience.record_success()
+
+    async def _retrieve(self, query, max_results=5):
+        """Фрагменты базы знаний по одному запросу. Ошибка или таймаут дают пустой список."""
+        started = time.monotonic()
+        cached = self._cached_chunks(query, max_results)
+        if cached is not None:
+            logger.debug("RAG контекст взят из кэша")
+            RAG_SEARCH_SECONDS.observe(time.monotonic() - started, retriever=self._retriever_label, outcome='cache')
+            return cached
+
+        try:
+            logger.debug("Выполняем RAG поиск", extra=payload(query))
+
+            client, semaphore = self._get_loop_resources()
+            async with semaphore:
+                chunks = await asyncio.wait_for(
+                    self.retriever.asearch(query, max_results, async_client=client, timeout=self.rag_query_timeout),
+                    self.rag_query_timeout
+                )
+        except asyncio.TimeoutError:
+            logger.warning("RAG запрос не уложился в %s с, пропускаем", self.rag_query_timeout)
+            RAG_SEARCH_SECONDS.observe(time.monotonic() - started, retriever=self._retriever_label, outcome='timeout')
+            return []
+        except Exception as e:
+            logger.warning("Ошибка при RAG поиске: %s", e)
+            RAG_SEARCH_SECONDS.observe(time.monotonic() - started, retriever=self._retriever_label, outcome='error')
+            return []
+
+        RAG_SEARCH_SECONDS.observe(time.monotonic() - started, retriever=self._retriever_label, outcome='success')
+        self._store_chunks(query, max_results, chunks)
+        return chunks
+
+    async def _rag_search(self, query, max_results=5):
+        """Поиск релевантной информации в базе знаний"""
+        return await self._rag_multi_search([query], max_results)
+
+    async def _rag_multi_search(self, queries, max_results=5):
+        """Параллельный поиск по нескольким запросам с объединением результатов"""
+        if not self._rag_ready and not self.retriever.local:
+            # Первое определение хранилища может обращаться к API - не блокируем цикл событий
+            await asyncio.to_thread(self.ensure_rag)
+
+        if not self.retriever.is_available():
+            logger.info("RAG поиск недоступен, пропускаем")
+            return ""
+
+        chunk_lists = await asyncio.gather(*[self._retrieve(query, max_results) for query in queries])
+        return self._format_rag_results(merge_chunks(chunk_lists, self.rag_context_budget))
@@ -0,0 +1,119 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+
+from django.db import DatabaseError, transaction
+from django.db.models import F
+
+from bank_letters.models import ClassificationCategory, CategoryRegistryVersion, Letter
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN_CATEGORY_NAME = "Не определен"
+
+
+@dataclass(frozen=True)
+class CategoryRegistry:
+    """Неизменяемый снимок активного набора категорий"""
+    version: int
+    # Кортеж (номер, название, описание) в порядке номеров
+    categories: tuple
+    is_custom: bool
+    names: MappingProxyType = field(init=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'names', MappingProxyType({number: name for number, name, _ in self.categories}))
+
+    @property
+    def choices(self):
+        return tuple((number, name) for number, name, _ in self.categories)
+
+    def get_name(self, number):
+        return self.names.get(number, UNKNOWN_CATEGORY_NAME)
+
+    def for_llm(self):
+        """Категории в формате промпта; каждый вызов возвращает новый список"""
+        return [
+            {"id": number, "name": name, "description": description}
+            for number, name, description in self.categories
+        ]
+
+
+def _base_registry(version):
+    return CategoryRegistry(
+        version=version,
+        categories=tuple((number, name, "") for number, name in Letter.BASE_CLASSIFICATION_CHOICES),
+        is_custom=False,
+    )
+
+
+def _read_version():
+    return CategoryRegistryVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+def _load_registry(version):
+    custom = tuple(
+        (number, name, description or "")
+        for number, name, description in ClassificationCategory.objects.filter(
+            is_active=True
+        ).order_by('number').values_list('number', 'name', 'description')
+    )
+    if custom:
+        return CategoryRegistry(version=version, categories=custom, is_custom=True)
+    return _base_registry(version)
+
+
+_registry = None
+_checked_at = 0.0
+_registry_lock = threading.Lock()
+
+
+def get_category_registry():
+    """Реестр категорий процесса.
+
+    Версия в БД проверяется не чаще раза в CATEGORY_REGISTRY_CHECK_SECONDS,
+    категории перечитываются только при ее изменении. Остальные вызовы
+    обходятся без запросов к БД.
+    """
+    global _registry, _checked_at
+
+    registry = _registry
+    now = time.monotonic()
+    check_interval = float(os.getenv('CATEGORY_REGISTRY_CHECK_SECONDS', 1.0))
+    if registry is not None and now - _checked_at < check_interval:
+        return registry
+
+    with _registry_lock:
+        if _registry is not None and now - _checked_at < check_interval:
+            return _registry
+        try:
+            # Версия читается до категорий: если они изменятся между запросами,
+            # следующая проверка увидит новую версию и перечитает их
+            version = _read_version()
+            if _registry is None or _registry.version != version:
+                _registry = _load_registry(version)
+                logger.info("Загружен реестр категорий версии %s: %s категорий", version, len(_registry.categories))
+            _checked_at = now
+        except DatabaseError as e:
+            logger.error("Ошибка при загрузке реестра категорий: %s", e)
+            # Без БД используем прежний снимок, а если его нет - базовые категории
+            return _registry or _base_registry(version=-1)
+        return _registry
+
+
+def invalidate_category_registry():
+    """Заставляет текущий процесс проверить версию при следующем обращении"""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def bump_category_version():
+    """Увеличивает версию категорий. Вызывается в той же транзакции, что и изменение категорий."""
+    with transaction.atomic():
+        updated = CategoryRegistryVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        if not updated:
+            CategoryRegistryVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+    transaction.on_commit(invalidate_category_registry)
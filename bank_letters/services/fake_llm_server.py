@@ -0,0 +1,493 @@
+"""Локальный OpenAI-совместимый сервер для нагрузочных тестов (без обращения к Yandex Cloud).
+
+Отвечает на запросы, которые делает LLMClient: responses (parse, create и поток),
+vector_stores (список, создание, файлы, поиск) и files. Задержки ответов задаются
+распределениями, часть запросов можно завершать ошибками, результаты анализа
+берутся из заготовленного файла или составляются из категорий промпта.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from bank_letters.services.models import CriticalityLevel, ResponseStyle
+
+# Названия категорий в инструкциях анализа (prompts.make_analyze_email_prompt)
+CATEGORY_NAME_RE = re.compile(r'Категория "([^"\n]+)"')
+WORD_RE = re.compile(r'\w{3,}')
+
+# Размер фрагмента загруженного файла для поиска по хранилищу
+SEARCH_CHUNK_CHARS = 800
+# Частоты уровней критичности в заготовленных результатах анализа
+CRITICALITY_WEIGHTS = ((CriticalityLevel.LOW, 30), (CriticalityLevel.MEDIUM, 45),
+                       (CriticalityLevel.HIGH, 20), (CriticalityLevel.CRITICAL, 5))
+PROCESSING_HOURS = (4, 8, 24, 48, 72, 120)
+
+GENERATED_EMAIL = ("Уважаемый клиент!\n\nБлагодарим за обращение. Ваш запрос принят в работу, "
+                   "ответ по существу будет направлен в установленный срок.\n\nС уважением,\nБанк")
+GENERATED_TEXT = "Письмо содержит запрос клиента; ответ подготовлен по тексту письма и базе знаний."
+
+# Операции с отдельными распределениями задержки
+OPERATIONS = ('analysis', 'generation', 'stream', 'search')
+
+
+class LatencyDistribution:
+    """Распределение задержки в секундах, задается строкой вида name:arg1,arg2:
+
+    fixed:0.5, uniform:0.2,1.5, normal:0.8,0.2 (среднее, отклонение),
+    lognormal:0.8,0.5 (медиана, sigma), exponential:0.5 (среднее).
+    Число без имени - фиксированная задержка.
+    """
+
+    KINDS = {'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2, 'exponential': 1}
+
+    def __init__(self, kind, args):
+        if kind not in self.KINDS:
+            raise ValueError(f"Неизвестное распределение '{kind}', доступны: {', '.join(self.KINDS)}")
+        if len(args) != self.KINDS[kind]:
+            raise ValueError(f"Распределению {kind} нужно параметров: {self.KINDS[kind]}")
+        if any(arg < 0 for arg in args):
+            raise ValueError("Параметры распределения задержки не могут быть отрицательными")
+        self.kind = kind
+        self.args = tuple(args)
+
+    @classmethod
+    def parse(cls, spec):
+        spec = str(spec).strip()
+        kind, _, args = spec.partition(':') if ':' in spec else ('fixed', '', spec)
+        try:
+            values = [float(arg) for arg in args.split(',')] if args else []
+        except ValueError:
+            raise ValueError(f"Некорректные параметры задержки: '{spec}'")
+        return cls(kind.strip().lower(), values)
+
+    def sample(self, rng):
+        if self.kind == 'fixed':
+            return self.args[0]
+        if self.kind == 'uniform':
+            return rng.uniform(*self.args)
+        if self.kind == 'normal':
+            return max(0.0, rng.gauss(*self.args))
+        if self.kind == 'lognormal':
+            median, sigma = self.args
+            return median * rng.lognormvariate(0, sigma) if median else 0.0
+        mean = self.args[0]
+        return rng.expovariate(1 / mean) if mean else 0.0
+
+    def __str__(self):
+        return f"{self.kind}:{','.join(f'{arg:g}' for arg in self.args)}"
+
+
+@dataclass
+class FakeLLMConfig:
+    """Поведение сервера: задержки по операциям и доли неудачных запросов"""
+    latency: dict = field(default_factory=lambda: {op: LatencyDistribution('fixed', [0]) for op in OPERATIONS})
+    # Доля запросов к responses и поиску с ответом 500, 429 и "зависших" на hang_seconds
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    hang_rate: float = 0.0
+    hang_seconds: float = 60.0
+    # Заготовленные результаты анализа (словари с полями RequestAnalysis)
+    analyses: list = field(default_factory=list)
+    stream_chunks: int = 20
+    seed: int = None
+
+
+def load_analyses(path):
+    """Заготовленные результаты анализа из JSON файла (список объектов или объект)"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    analyses = data if isinstance(data, list) else [data]
+    if not analyses or not all(isinstance(item, dict) for item in analyses):
+        raise ValueError("Файл результатов анализа должен содержать объект или список объектов")
+    return analyses
+
+
+def _estimate_tokens(text):
+    # Оценка без токенизатора: для русского текста около 4 символов на токен
+    return max(1, len(text) // 4)
+
+
+def _input_text(body):
+    """Текст запроса: instructions и input (строка или список сообщений)"""
+    parts = [body.get('instructions') or '']
+    items = body.get('input') or ''
+    if isinstance(items, str):
+        parts.append(items)
+    else:
+        for item in items:
+            content = item.get('content', '') if isinstance(item, dict) else ''
+            if isinstance(content, str):
+                parts.append(content)
+            else:
+                parts.extend(part.get('text', '') for part in content if isinstance(part, dict))
+    return '\n'.join(parts)
+
+
+class FakeLLMState:
+    """Векторные хранилища, файлы и генератор случайных чисел сервера"""
+
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.vector_stores = {}
+        self.files = {}
+
+    def random(self):
+        with self.lock:
+            return self.rng.random()
+
+    def choice(self, items, weights=None):
+        with self.lock:
+            return self.rng.choices(items, weights=weights)[0]
+
+    def delay(self, operation):
+        with self.lock:
+            return self.config.latency[operation].sample(self.rng)
+
+    def failure(self):
+        """Код ответа для неудачного запроса (500, 429, 'hang') или None"""
+        value = self.random()
+        config = self.config
+        if value < config.error_rate:
+            return 500
+        if value < config.error_rate + config.rate_limit_rate:
+            return 429
+        if value < config.error_rate + config.rate_limit_rate + config.hang_rate:
+            return 'hang'
+        return None
+
+    # Заготовленные ответы
+
+    def analysis(self, body):
+        if self.config.analyses:
+            return dict(self.choice(self.config.analyses))
+        categories = CATEGORY_NAME_RE.findall(body.get('instructions') or '') or ['1']
+        # Краткое содержание - начало письма (после контекста RAG, если он есть)
+        letter = _input_text(dict(body, instructions='')).rsplit('Письмо:\n', 1)[-1]
+        return {
+            'topic_category': self.choice(categories),
+            'response_style': self.choice(list(ResponseStyle)).value,
+            'processing_time_hours': self.choice(PROCESSING_HOURS),
+            'criticality_level': self.choice(
+                [level for level, _ in CRITICALITY_WEIGHTS], [weight for _, weight in CRITICALITY_WEIGHTS]
+            ).value,
+            'summary': re.sub(r'\s+', ' ', letter).strip()[:200],
+        }
+
+    def output_text(self, body):
+        """Текст ответа модели; для структурированного запроса - JSON по имени схемы"""
+        text_format = (body.get('text') or {}).get('format') or {}
+        name = text_format.get('name')
+        if text_format.get('type') != 'json_schema':
+            return GENERATED_EMAIL
+        if name == 'RequestAnalysis':
+            return json.dumps(self.analysis(body), ensure_ascii=False)
+        if name == 'EmailGeneration':
+            return json.dumps({'response_email': GENERATED_EMAIL}, ensure_ascii=False)
+        if name == 'TextGeneration':
+            return json.dumps({'response': GENERATED_TEXT}, ensure_ascii=False)
+        # Неизвестная схема: строковые поля заполняются текстом, остальные - нулем
+        properties = (text_format.get('schema') or {}).get('properties') or {}
+        return json.dumps({
+            key: GENERATED_TEXT if prop.get('type') == 'string' else 0 for key, prop in properties.items()
+        }, ensure_ascii=False)
+
+    # Векторные хранилища
+
+    def create_vector_store(self, name):
+        store = {
+            'id': f"vs_{uuid.uuid4().hex[:12]}",
+            'object': 'vector_store',
+            'created_at': int(time.time()),
+            'name': name,
+            'status': 'completed',
+            'usage_bytes': 0,
+            'file_counts': {'cancelled': 0, 'completed': 0, 'failed': 0, 'in_progress': 0, 'total': 0},
+            'last_active_at': None,
+            'metadata': None,
+            'files': {},
+        }
+        with self.lock:
+            self.vector_stores[store['id']] = store
+        return store
+
+    def search(self, store, query, max_results):
+        """Фрагменты файлов хранилища с наибольшим числом общих с запросом слов"""
+        words = set(WORD_RE.findall(query.lower()))
+        results = []
+        for file_id in store['files']:
+            file = self.files.get(file_id)
+            if file is None:
+                continue
+            text = file['text']
+            for start in range(0, len(text), SEARCH_CHUNK_CHARS):
+                chunk = text[start:start + SEARCH_CHUNK_CHARS]
+                score = len(words & set(WORD_RE.findall(chunk.lower())))
+                if score:
+                    results.append((score, file, chunk))
+        results.sort(key=lambda item: item[0], reverse=True)
+        best = results[0][0] if results else 1
+        return [{
+            'file_id': file['id'],
+            'filename': file['filename'],
+            'score': score / best,
+            'attributes': {},
+            'content': [{'type': 'text', 'text': chunk}],
+        } for score, file, chunk in results[:max_results]]
+
+
+def _store_view(store):
+    return {key: value for key, value in store.items() if key != 'files'}
+
+
+def _page(data):
+    return {
+        'object': 'list',
+        'data': data,
+        'first_id': data[0]['id'] if data and 'id' in data[0] else None,
+        'last_id': data[-1]['id'] if data and 'id' in data[-1] else None,
+        'has_more': False,
+    }
+
+
+def _response_object(body, text, status='completed'):
+    input_tokens = _estimate_tokens(_input_text(body))
+    output_tokens = _estimate_tokens(text)
+    return {
+        'id': f"resp_{uuid.uuid4().hex}",
+        'object': 'response',
+        'created_at': int(time.time()),
+        'model': body.get('model') or '',
+        'status': status,
+        'output': [{
+            'type': 'message',
+            'id': f"msg_{uuid.uuid4().hex}",
+            'role': 'assistant',
+            'status': status,
+            'content': [{'type': 'output_text', 'text': text, 'annotations': []}],
+        }],
+        'parallel_tool_calls': False,
+        'tool_choice': 'auto',
+        'tools': [],
+        'usage': {
+            'input_tokens': input_tokens,
+            'input_tokens_details': {'cached_tokens': 0},
+            'output_tokens': output_tokens,
+            'output_tokens_details': {'reasoning_tokens': 0},
+            'total_tokens': input_tokens + output_tokens,
+        },
+    }
+
+
+def _multipart_file(content_type, data):
+    """Имя и текст файла из multipart/form-data запроса files.create"""
+    boundary = re.search(r'boundary="?([^";]+)"?', content_type or '')
+    if not boundary:
+        return 'file.txt', data.decode('utf-8', 'replace')
+    for part in data.split(b'--' + boundary.group(1).encode()):
+        headers, _, content = part.partition(b'\r\n\r\n')
+        filename = re.search(rb'filename="([^"]*)"', headers)
+        if filename:
+            return filename.group(1).decode('utf-8', 'replace'), content.rstrip(b'\r\n').decode('utf-8', 'replace')
+    return 'file.txt', ''
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeLLM/1.0'
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def log_message(self, format, *args):
+        # Журнал каждого запроса замедляет сервер под нагрузкой
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _path(self):
+        """Путь без префикса версии API: /v1/responses -> ['responses']"""
+        parts = [part for part in urlsplit(self.path).path.split('/') if part]
+        if parts and parts[0] == 'v1':
+            parts = parts[1:]
+        return parts
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _json_body(self):
+        data = self._body()
+        try:
+            return json.loads(data) if data else {}
+        except ValueError:
+            return {}
+
+    def _send_json(self, data, status=200, headers=None):
+        encoded = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def _send_error(self, status, message):
+        self._send_json({'error': {'message': message, 'type': 'server_error', 'code': status}}, status=status)
+
+    def _simulate_failure(self):
+        """Ошибка или зависание по долям из настроек; True - ответ уже отправлен"""
+        failure = self.state.failure()
+        if failure is None:
+            return False
+        if failure == 'hang':
+            # Клиент должен прервать запрос по своему таймауту
+            time.sleep(self.state.config.hang_seconds)
+            self._send_error(504, 'Имитация зависшего запроса')
+        elif failure == 429:
+            self._send_json({'error': {'message': 'Имитация превышения лимита', 'type': 'rate_limit_error'}},
+                            status=429, headers={'Retry-After': '1'})
+        else:
+            self._send_error(500, 'Имитация ошибки сервера')
+        return True
+
+    def do_GET(self):
+        path = self._path()
+        stores = self.state.vector_stores
+        if path == ['vector_stores']:
+            self._send_json(_page([_store_view(store) for store in list(stores.values())]))
+        elif len(path) == 3 and path[0] == 'vector_stores' and path[2] == 'files' and path[1] in stores:
+            store = stores[path[1]]
+            self._send_json(_page([
+                {'id': file_id, 'object': 'vector_store.file', 'created_at': int(time.time()), 'status': 'completed',
+                 'usage_bytes': 0, 'vector_store_id': store['id'], 'last_error': None}
+                for file_id in list(store['files'])
+            ]))
+        elif path == ['health']:
+            self._send_json({'status': 'ok'})
+        else:
+            self._send_error(404, f"Неизвестный путь {self.path}")
+
+    def do_POST(self):
+        path = self._path()
+        if path == ['responses']:
+            self._responses(self._json_body())
+        elif path == ['files']:
+            filename, text = _multipart_file(self.headers.get('Content-Type'), self._body())
+            file = {'id': f"file_{uuid.uuid4().hex[:12]}", 'object': 'file', 'bytes': len(text.encode('utf-8')),
+                    'created_at': int(time.time()), 'filename': filename, 'purpose': 'batch', 'status': 'processed'}
+            self.state.files[file['id']] = dict(file, text=text)
+            self._send_json(file)
+        elif path == ['vector_stores']:
+            store = self.state.create_vector_store(self._json_body().get('name'))
+            self._send_json(_store_view(store))
+        elif len(path) == 3 and path[0] == 'vector_stores' and path[1] in self.state.vector_stores:
+            store = self.state.vector_stores[path[1]]
+            body = self._json_body()
+            if path[2] == 'files':
+                store['files'][body.get('file_id')] = True
+                self._send_json({'id': body.get('file_id'), 'object': 'vector_store.file',
+                                 'created_at': int(time.time()), 'status': 'completed', 'usage_bytes': 0,
+                                 'vector_store_id': store['id'], 'last_error': None})
+            elif path[2] == 'search':
+                self._search(store, body)
+            else:
+                self._send_error(404, f"Неизвестный путь {self.path}")
+        else:
+            self._body()
+            self._send_error(404, f"Неизвестный путь {self.path}")
+
+    def do_DELETE(self):
+        path = self._path()
+        if len(path) == 2 and path[0] == 'files':
+            self.state.files.pop(path[1], None)
+            self._send_json({'id': path[1], 'object': 'file', 'deleted': True})
+        elif len(path) == 4 and path[0] == 'vector_stores' and path[2] == 'files':
+            store = self.state.vector_stores.get(path[1])
+            if store is not None:
+                store['files'].pop(path[3], None)
+            self._send_json({'id': path[3], 'object': 'vector_store.file.deleted', 'deleted': True})
+        else:
+            self._send_error(404, f"Неизвестный путь {self.path}")
+
+    def _search(self, store, body):
+        if self._simulate_failure():
+            return
+        time.sleep(self.state.delay('search'))
+        results = self.state.search(store, str(body.get('query') or ''), int(body.get('max_num_results') or 10))
+        self._send_json({'object': 'vector_store.search_results.page', 'search_query': body.get('query'),
+                         'data': results, 'has_more': False, 'next_page': None})
+
+    def _responses(self, body):
+        if self._simulate_failure():
+            return
+        text = self.state.output_text(body)
+        if body.get('stream'):
+            self._stream(body, text)
+            return
+        name = ((body.get('text') or {}).get('format') or {}).get('name')
+        time.sleep(self.state.delay('analysis' if name == 'RequestAnalysis' else 'generation'))
+        self._send_json(_response_object(body, text))
+
+    def _stream(self, body, text):
+        """Ответ потоком Server-Sent Events: задержка распределяется между фрагментами текста"""
+        total = self.state.delay('stream')
+        chunks = max(1, self.state.config.stream_chunks)
+        size = max(1, -(-len(text) // chunks))
+        response = _response_object(body, text)
+        item_id = response['output'][0]['id']
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        # Длина потока заранее неизвестна - соединение закрывается после ответа
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        sequence = 0
+
+        def send(event):
+            nonlocal sequence
+            event['sequence_number'] = sequence
+            sequence += 1
+            self.wfile.write(f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+                             .encode('utf-8'))
+            self.wfile.flush()
+
+        in_progress = dict(response, status='in_progress', output=[])
+        send({'type': 'response.created', 'response': in_progress})
+        # Около пятой части задержки - ожидание первого фрагмента
+        time.sleep(total * 0.2)
+        pieces = [text[start:start + size] for start in range(0, len(text), size)]
+        for piece in pieces:
+            send({'type': 'response.output_text.delta', 'item_id': item_id, 'output_index': 0,
+                  'content_index': 0, 'delta': piece, 'logprobs': []})
+            time.sleep(total * 0.8 / len(pieces))
+        send({'type': 'response.output_text.done', 'item_id': item_id, 'output_index': 0,
+              'content_index': 0, 'text': text, 'logprobs': []})
+        send({'type': 'response.completed', 'response': response})
+
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Очередь соединений под нагрузку бенчмарка
+    request_queue_size = 256
+
+    def __init__(self, address, config=None, verbose=False):
+        super().__init__(address, FakeLLMHandler)
+        self.state = FakeLLMState(config or FakeLLMConfig())
+        self.verbose = verbose
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
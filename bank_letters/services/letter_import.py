@@ -0,0 +1,256 @@
+import csv
+import io
+import re
+import sys
+import zipfile
+from dataclasses import dataclass, field
+from email import policy
+from email.parser import BytesFeedParser, BytesParser
+from html import unescape
+from pathlib import Path
+
+from bank_letters.models import Letter, AnalysisJob
+from bank_letters.services.letter_statistics import add_letters_to_counters
+from bank_letters.services.metrics import DB_SAVE_SECONDS
+from bank_letters.services.near_duplicates import index_letters, near_duplicates_enabled
+
+# Ограничения полей модели Letter
+SENDER_MAX_LENGTH = Letter._meta.get_field('sender').max_length
+SUBJECT_MAX_LENGTH = Letter._meta.get_field('subject').max_length
+
+# Возможные названия колонок в CSV выгрузках почтовых систем
+CSV_SENDER_COLUMNS = ('sender', 'from', 'отправитель')
+CSV_SUBJECT_COLUMNS = ('subject', 'тема')
+CSV_TEXT_COLUMNS = ('original_text', 'text', 'body', 'текст')
+
+SUPPORTED_EXTENSIONS = ('.mbox', '.eml', '.csv', '.zip')
+
+# CSV с длинными письмами не помещаются в стандартный лимит поля
+csv.field_size_limit(min(sys.maxsize, 2 ** 31 - 1))
+
+
+class LetterImportError(Exception):
+    """Ошибка разбора отдельного письма"""
+
+
+@dataclass
+class ImportReport:
+    """Отчет об импорте одного файла"""
+    name: str
+    imported: int = 0
+    skipped: int = 0
+    errors: list = field(default_factory=list)
+
+    def add_error(self, position, message):
+        self.skipped += 1
+        # Храним ограниченное количество ошибок, чтобы отчет не разрастался
+        if len(self.errors) < 100:
+            self.errors.append(f"{position}: {message}")
+
+
+def _clean(value, max_length=None):
+    value = re.sub(r'\s+', ' ', str(value or '')).strip()
+    if max_length and len(value) > max_length:
+        value = value[:max_length - 3] + '...'
+    return value
+
+
+def _html_to_text(html):
+    text = re.sub(r'(?is)<(script|style).*?</\1>', ' ', html)
+    text = re.sub(r'(?i)<br\s*/?>|</p>|</div>', '\n', text)
+    text = re.sub(r'<[^>]+>', ' ', text)
+    return unescape(text)
+
+
+def message_to_letter(message):
+    """Преобразует email.message.EmailMessage в несохраненный Letter"""
+    body_part = message.get_body(preferencelist=('plain', 'html'))
+    if body_part is None:
+        raise LetterImportError("письмо не содержит текстовой части")
+
+    try:
+        body = body_part.get_content()
+    except (LookupError, UnicodeDecodeError):
+        payload = body_part.get_payload(decode=True) or b''
+        body = payload.decode('utf-8', errors='replace')
+
+    if body_part.get_content_subtype() == 'html':
+        body = _html_to_text(body)
+
+    body = body.strip()
+    if not body:
+        raise LetterImportError("пустой текст письма")
+
+    return Letter(
+        sender=_clean(message.get('From'), SENDER_MAX_LENGTH) or 'Неизвестный отправитель',
+        subject=_clean(message.get('Subject'), SUBJECT_MAX_LENGTH) or 'Без темы',
+        original_text=body,
+        status='new',
+    )
+
+
+def row_to_letter(row):
+    """Преобразует строку CSV в несохраненный Letter"""
+    normalized = {(key or '').strip().lower(): value for key, value in row.items()}
+
+    def pick(columns):
+        for column in columns:
+            if normalized.get(column):
+                return normalized[column]
+        return ''
+
+    text = (pick(CSV_TEXT_COLUMNS) or '').strip()
+    if not text:
+        raise LetterImportError("пустой текст письма")
+
+    return Letter(
+        sender=_clean(pick(CSV_SENDER_COLUMNS), SENDER_MAX_LENGTH) or 'Неизвестный отправитель',
+        subject=_clean(pick(CSV_SUBJECT_COLUMNS), SUBJECT_MAX_LENGTH) or 'Без темы',
+        original_text=text,
+        status='new',
+    )
+
+
+def iter_mbox_messages(fileobj):
+    """Потоково разбирает mbox: в памяти находится только текущее письмо"""
+    parser = None
+    previous_blank = True
+
+    for line in fileobj:
+        # Новое письмо начинается со строки "From " после пустой строки
+        if line.startswith(b'From ') and previous_blank:
+            if parser is not None:
+                yield parser.close()
+            parser = BytesFeedParser(policy=policy.default)
+        elif parser is not None:
+            # Снимаем экранирование ">From " внутри писем
+            if line.startswith(b'>') and line.lstrip(b'>').startswith(b'From '):
+                line = line[1:]
+            parser.feed(line)
+
+        previous_blank = line in (b'\n', b'\r\n')
+
+    if parser is not None:
+        yield parser.close()
+
+
+class LetterImporter:
+    """Потоковый импорт писем из mbox, eml, CSV и ZIP с записью пачками"""
+
+    def __init__(self, chunk_size=500, enqueue=True, progress=None):
+        self.chunk_size = chunk_size
+        self.enqueue = enqueue
+        self.progress = progress
+        self._buffer = []
+
+    def import_path(self, path):
+        """Импортирует файл или каталог с .eml файлами. Возвращает список отчетов."""
+        path = Path(path)
+        if path.is_dir():
+            return [self._import_eml_directory(path)]
+
+        with open(path, 'rb') as fileobj:
+            return self.import_file(fileobj, path.name)
+
+    def import_file(self, fileobj, name):
+        """Импортирует открытый бинарный файл. Формат определяется по расширению."""
+        suffix = Path(name).suffix.lower()
+
+        if suffix == '.zip':
+            return self._import_zip(fileobj, name)
+
+        report = ImportReport(name=name)
+        if suffix == '.mbox':
+            self._import_messages(iter_mbox_messages(fileobj), report)
+        elif suffix == '.eml':
+            self._import_messages([BytesParser(policy=policy.default).parse(fileobj)], report)
+        elif suffix == '.csv':
+            self._import_csv(fileobj, report)
+        else:
+            report.add_error(name, f"неподдерживаемый формат (ожидается {', '.join(SUPPORTED_EXTENSIONS)})")
+
+        self._flush(report)
+        return [report]
+
+    def _import_zip(self, fileobj, name):
+        reports = []
+        try:
+            archive = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile as e:
+            report = ImportReport(name=name)
+            report.add_error(name, f"поврежденный архив: {e}")
+            return [report]
+
+        with archive:
+            for member in archive.infolist():
+                if member.is_dir() or Path(member.filename).suffix.lower() not in SUPPORTED_EXTENSIONS:
+                    continue
+                with archive.open(member) as member_file:
+                    reports.extend(self.import_file(member_file, f"{name}/{member.filename}"))
+        return reports
+
+    def _import_eml_directory(self, path):
+        report = ImportReport(name=str(path))
+        parser = BytesParser(policy=policy.default)
+
+        for eml_path in sorted(path.rglob('*.eml')):
+            try:
+                with open(eml_path, 'rb') as eml_file:
+                    self._add(message_to_letter(parser.parse(eml_file)), report)
+            except Exception as e:
+                report.add_error(eml_path.name, e)
+
+        self._flush(report)
+        return report
+
+    def _import_messages(self, messages, report):
+        position = 0
+        try:
+            for position, message in enumerate(messages, 1):
+                try:
+                    self._add(message_to_letter(message), report)
+                except Exception as e:
+                    report.add_error(f"письмо {position}", e)
+        except Exception as e:
+            # Ошибка чтения самого файла - прерываем только этот файл
+            report.add_error(f"после письма {position}", f"ошибка чтения файла: {e}")
+
+    def _import_csv(self, fileobj, report):
+        text_stream = io.TextIOWrapper(fileobj, encoding='utf-8-sig', errors='replace', newline='')
+        try:
+            for position, row in enumerate(csv.DictReader(text_stream), 2):
+                try:
+                    self._add(row_to_letter(row), report)
+                except Exception as e:
+                    report.add_error(f"строка {position}", e)
+        except csv.Error as e:
+            report.add_error(report.name, f"ошибка разбора CSV: {e}")
+        finally:
+            # Не закрываем исходный файл вместе с оберткой
+            text_stream.detach()
+
+    def _add(self, letter, report):
+        self._buffer.append(letter)
+        if len(self._buffer) >= self.chunk_size:
+            self._flush(report)
+
+    def _flush(self, report):
+        if not self._buffer:
+            return
+
+        with DB_SAVE_SECONDS.time(operation='import'):
+            letters = Letter.objects.bulk_create(self._buffer, batch_size=self.chunk_size)
+            add_letters_to_counters(letters)
+        if near_duplicates_enabled():
+            index_letters(letters)
+        if self.enqueue:
+            AnalysisJob.objects.bulk_create(
+                [AnalysisJob(letter=letter) for letter in letters if letter.pk],
+                batch_size=self.chunk_size,
+            )
+
+        report.imported += len(letters)
+        self._buffer = []
+
+        if self.progress:
+            self.progress(report)
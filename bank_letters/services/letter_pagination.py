@@ -0,0 +1,88 @@
+import base64
+import json
+from dataclasses import dataclass
+
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    """Курсор страницы поврежден или устарел"""
+
+
+@dataclass
+class LetterPage:
+    letters: list
+    next_cursor: str = None
+
+
+def encode_cursor(letter):
+    """Курсор следующей страницы: ключ сортировки последнего письма"""
+    payload = [
+        letter.status_group,
+        letter.sla_deadline.isoformat() if letter.sla_deadline else None,
+        letter.uploaded_at.isoformat(),
+        letter.id,
+    ]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        group, deadline, uploaded_at, letter_id = json.loads(base64.urlsafe_b64decode(padded))
+        deadline = parse_datetime(deadline) if deadline else None
+        uploaded_at = parse_datetime(uploaded_at)
+        if uploaded_at is None:
+            raise ValueError("нет даты загрузки")
+        return int(group), deadline, uploaded_at, int(letter_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e))
+
+
+def _after_cursor(cursor, group_fixed):
+    """Условие "после курсора" для порядка (группа, дедлайн NULLS LAST, загрузка DESC, id DESC)"""
+    group, deadline, uploaded_at, letter_id = cursor
+
+    # Внутри одного дедлайна - более ранние загрузки, при равной дате - меньшие id
+    same_deadline_tail = Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=letter_id)
+    if deadline is None:
+        within_group = Q(sla_deadline__isnull=True) & same_deadline_tail
+    else:
+        within_group = (
+            Q(sla_deadline__gt=deadline)
+            | Q(sla_deadline__isnull=True)
+            | (Q(sla_deadline=deadline) & same_deadline_tail)
+        )
+
+    if group_fixed:
+        return within_group
+    return Q(status_group__gt=group) | (Q(status_group=group) & within_group)
+
+
+def paginate_letters(queryset, cursor=None, page_size=DEFAULT_PAGE_SIZE, group_fixed=False):
+    """Страница списка писем по ключу (keyset), без OFFSET и без сортировки всей таблицы.
+
+    Порядок: сначала письма в работе, затем завершенные (status_group); внутри
+    группы - по дедлайну (ближайшие, то есть срочные, первыми, без дедлайна - в конце),
+    затем новые загрузки выше. Срочность зависит от текущего времени и не может
+    храниться в таблице, но сортировка по дедлайну уже ставит срочные письма первыми.
+    group_fixed=True - фильтр оставляет одну группу статусов, и порядок совпадает
+    с индексом (status, sla_deadline, ...).
+    """
+    page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+
+    order = [F('sla_deadline').asc(nulls_last=True), F('uploaded_at').desc(), F('id').desc()]
+    if not group_fixed:
+        order.insert(0, F('status_group').asc())
+    queryset = queryset.order_by(*order)
+
+    if cursor:
+        queryset = queryset.filter(_after_cursor(decode_cursor(cursor), group_fixed))
+
+    letters = list(queryset[:page_size + 1])
+    next_cursor = encode_cursor(letters[page_size - 1]) if len(letters) > page_size else None
+    return LetterPage(letters=letters[:page_size], next_cursor=next_cursor)
@@ -0,0 +1,98 @@
+import logging
+import threading
+
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connection, DatabaseError
+from django.db.models import F, Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from bank_letters.models import Letter
+
+logger = logging.getLogger(__name__)
+
+SEARCH_CONFIG = 'russian'
+
+# Маркеры подсветки: заменяются на <mark> после экранирования фрагмента
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+_trigram_available = None
+_trigram_lock = threading.Lock()
+
+
+def trigram_available():
+    """Установлено ли расширение pg_trgm (проверяется один раз за процесс)"""
+    global _trigram_available
+    if _trigram_available is None:
+        with _trigram_lock:
+            if _trigram_available is None:
+                try:
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                        _trigram_available = cursor.fetchone() is not None
+                except DatabaseError as e:
+                    logger.warning("Не удалось проверить расширение pg_trgm: %s", e)
+                    _trigram_available = False
+    return _trigram_available
+
+
+def make_search_query(text):
+    """Запрос в синтаксисе поисковиков: слова, "фразы в кавычках", -исключения, or"""
+    return SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+
+
+def search_letters(queryset, text):
+    """Письма, найденные по тексту, по убыванию релевантности (аннотация rank).
+
+    Полнотекстовый поиск идет по search_vector (GIN индекс). Если установлен
+    pg_trgm, дополнительно находятся письма с похожим отправителем - это
+    помогает при опечатках в имени или названии организации.
+    """
+    search_query = make_search_query(text)
+    rank = SearchRank(F('search_vector'), search_query)
+    condition = Q(search_vector=search_query)
+
+    if trigram_available():
+        queryset = queryset.annotate(sender_similarity=TrigramWordSimilarity(text, 'sender'))
+        condition |= Q(sender__trigram_word_similar=text)
+        rank = rank + F('sender_similarity')
+
+    return queryset.filter(condition).annotate(rank=rank).order_by('-rank', '-uploaded_at', '-id')
+
+
+def _render_highlight(fragment):
+    escaped = escape(fragment or '')
+    return mark_safe(escaped.replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>'))
+
+
+def attach_snippets(letters, text):
+    """Добавляет письмам атрибут snippet - фрагменты текста с подсвеченными совпадениями.
+
+    Фрагменты строятся отдельным запросом только для писем текущей страницы:
+    ts_headline разбирает весь текст письма и слишком дорог для всей выборки.
+    """
+    letters = list(letters)
+    if not letters:
+        return letters
+
+    search_query = make_search_query(text)
+    highlight = {'config': SEARCH_CONFIG, 'start_sel': HIGHLIGHT_START, 'stop_sel': HIGHLIGHT_STOP}
+    snippets = {
+        letter_id: (snippet, subject_snippet)
+        for letter_id, snippet, subject_snippet in Letter.objects.filter(
+            id__in=[letter.id for letter in letters]
+        ).annotate(
+            snippet=SearchHeadline(
+                'original_text', search_query,
+                max_words=35, min_words=15, max_fragments=2, fragment_delimiter=' … ', **highlight
+            ),
+            subject_snippet=SearchHeadline('subject', search_query, highlight_all=True, **highlight),
+        ).order_by().values_list('id', 'snippet', 'subject_snippet')
+    }
+
+    for letter in letters:
+        snippet, subject_snippet = snippets.get(letter.id, ('', letter.subject))
+        letter.snippet = _render_highlight(snippet)
+        letter.subject_snippet = _render_highlight(subject_snippet)
+    return letters
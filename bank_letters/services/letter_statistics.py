@@ -0,0 +1,163 @@
+import os
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from bank_letters.models import Letter, LetterCounter
+
+# Поля письма, по которым ведутся счетчики
+COUNTED_FIELDS = ('status', 'classification', 'criticality_level')
+TOTAL_DIMENSION = 'total'
+
+# Письма со сроком в ближайшие часы считаются срочными
+URGENT_WINDOW_HOURS = 24
+
+
+def counters_enabled():
+    return os.getenv('LETTER_COUNTERS_ENABLED', 'false').lower() == 'true'
+
+
+def _counter_keys(state):
+    """Счетчики (поле, значение), в которые входит письмо с указанным состоянием"""
+    if state is None:
+        return []
+    keys = [(TOTAL_DIMENSION, '')]
+    for field in COUNTED_FIELDS:
+        if state.get(field) is not None:
+            keys.append((field, str(state[field])))
+    return keys
+
+
+def _apply_deltas(deltas):
+    # Счетчики обновляются в одном порядке, чтобы параллельные транзакции не блокировали друг друга
+    for (dimension, value), delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        counters = LetterCounter.objects.filter(dimension=dimension, value=value)
+        if counters.update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                LetterCounter.objects.create(dimension=dimension, value=value, count=delta)
+        except IntegrityError:
+            # Счетчик только что создала параллельная транзакция
+            counters.update(count=F('count') + delta)
+
+
+def apply_counter_change(previous, current):
+    """Переносит письмо между счетчиками: previous/current - значения COUNTED_FIELDS (None - письма нет)"""
+    deltas = Counter()
+    for key in _counter_keys(previous):
+        deltas[key] -= 1
+    for key in _counter_keys(current):
+        deltas[key] += 1
+    _apply_deltas(deltas)
+
+
+def add_letters_to_counters(letters):
+    """Учитывает письма, созданные через bulk_create (он не вызывает Letter.save)"""
+    if not counters_enabled():
+        return
+    deltas = Counter()
+    for letter in letters:
+        for key in _counter_keys({field: getattr(letter, field) for field in COUNTED_FIELDS}):
+            deltas[key] += 1
+    with transaction.atomic():
+        _apply_deltas(deltas)
+
+
+def rebuild_letter_counters():
+    """Полностью пересчитывает счетчики по таблице писем"""
+    with transaction.atomic():
+        LetterCounter.objects.all().delete()
+
+        counters = [LetterCounter(dimension=TOTAL_DIMENSION, value='', count=Letter.objects.count())]
+        for field in COUNTED_FIELDS:
+            rows = (
+                Letter.objects.filter(**{f'{field}__isnull': False})
+                .order_by()
+                .values_list(field)
+                .annotate(total=Count('id'))
+            )
+            counters.extend(
+                LetterCounter(dimension=field, value=str(value), count=total)
+                for value, total in rows
+            )
+
+        LetterCounter.objects.bulk_create(counters)
+    return len(counters)
+
+
+def _deadline_counts(now):
+    """Срочные и просроченные письма: диапазон по индексу sla_deadline"""
+    return Letter.objects.filter(
+        sla_deadline__lte=now + timedelta(hours=URGENT_WINDOW_HOURS)
+    ).aggregate(
+        urgent=Count('id'),
+        expired=Count('id', filter=Q(sla_deadline__lt=now)),
+    )
+
+
+def _statistics_from_counters(now):
+    counts = {
+        (dimension, value): count
+        for dimension, value, count in LetterCounter.objects.values_list('dimension', 'value', 'count')
+    }
+
+    def by_field(field, values):
+        return {value: counts.get((field, str(value)), 0) for value in values}
+
+    return counts.get((TOTAL_DIMENSION, ''), 0), by_field, _deadline_counts(now)
+
+
+def _statistics_from_aggregate(now, classification_values):
+    """Все счетчики одним запросом с условной агрегацией"""
+    aggregates = {
+        'total': Count('id'),
+        'urgent': Count('id', filter=Q(sla_deadline__lte=now + timedelta(hours=URGENT_WINDOW_HOURS))),
+        'expired': Count('id', filter=Q(sla_deadline__lt=now)),
+    }
+    field_values = {
+        'status': [value for value, _ in Letter.STATUS_CHOICES],
+        'classification': list(classification_values),
+        'criticality_level': [value for value, _ in Letter.CRITICALITY_LEVELS],
+    }
+    for field, values in field_values.items():
+        for value in values:
+            aggregates[f'{field}__{value}'] = Count('id', filter=Q(**{field: value}))
+
+    row = Letter.objects.order_by().aggregate(**aggregates)
+
+    def by_field(field, values):
+        return {value: row[f'{field}__{value}'] for value in values}
+
+    return row['total'], by_field, {'urgent': row['urgent'], 'expired': row['expired']}
+
+
+def collect_letter_statistics(classification_values):
+    """Количество писем: всего, по статусам, классификациям, критичности, срочные и просроченные.
+
+    С LETTER_COUNTERS_ENABLED=true читает таблицу LetterCounter (время не зависит
+    от числа писем), иначе считает все одним агрегирующим запросом.
+    """
+    now = timezone.now()
+    classification_values = list(classification_values)
+    if counters_enabled():
+        total, by_field, deadlines = _statistics_from_counters(now)
+    else:
+        total, by_field, deadlines = _statistics_from_aggregate(now, classification_values)
+
+    by_status = by_field('status', [value for value, _ in Letter.STATUS_CHOICES])
+    return {
+        'total': total,
+        'by_status': by_status,
+        'by_classification': by_field('classification', classification_values),
+        'by_criticality': by_field('criticality_level', [value for value, _ in Letter.CRITICALITY_LEVELS]),
+        'urgent': deadlines['urgent'],
+        'expired': deadlines['expired'],
+        # Письма в обработке - это все письма кроме завершенных и архивных
+        'in_progress': total - by_status['done'] - by_status['archived'],
+    }
@@ -1,243 +1,638 @@
+import json
+import logging
 import os
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import asdict
 from dotenv import load_dotenv
-from pathlib import Path
 from openai import OpenAI
 from bank_letters.services.models import RequestAnalysis, EmailGeneration, TextGeneration
-from bank_letters.services.prompts import EMAIL_ANALYSIS_PROMPT, EMAIL_GENERATION_PROMPTS, make_analyze_email_prompt, make_generate_text_prompt
+from bank_letters.services.prompts import EMAIL_GENERATION_PROMPTS, RESPONSE_PROMPTS, TEXT_PROMPT, get_analysis_prompt
 from .response_processor import ResponseProcessor
+from .rag_cache import get_rag_cache
+from .rag_manifest import RagManifest
+from .rag_sync import KnowledgeBaseSync
+from .retrievers import make_retriever, merge_chunks, RetrievedChunk
+from .resilience import get_llm_resilience, CircuitOpenError, DeadlineExceeded
+from .preclassifier import get_preclassifier
+from .token_budget import TokenBudget, PromptPart
+from .metrics import RAG_SEARCH_SECONDS, LLM_REQUEST_SECONDS, LLM_FALLBACKS, EMERGENCY_RESPONSES, model_label
+from bank_letters.structured_logging import payload
+
+logger = logging.getLogger(__name__)
 
 BASE_LLM_URL = 'https://rest-assistant.api.cloud.yandex.net/v1'
 QWEN3_235B_MODEL_NAME = 'qwen3-235b-a22b-fp8/latest'
 YAGPT_MODEL_NAME = 'yandexgpt/rc'
 
+RESPONSE_INSTRUCTIONS = "Ты электронный помошник для составления писем."
+TEXT_FALLBACK_INSTRUCTIONS = "Ты - AI ассистент для анализа банковских писем. Отвечай на вопросы профессионально и точно."
+RESPONSE_FALLBACK_INSTRUCTIONS = "Ты - AI ассистент для генерации ответов на банковские письма. Генерируй профессиональные ответы."
+# Упрощенный запрос делается одной попыткой с меньшим таймаутом
+FALLBACK_TIMEOUT_SECONDS = 20
+# При потоковой генерации структурированный ответ недоступен - просим только текст
+STREAM_TEXT_ONLY_INSTRUCTIONS = "Верни только итоговый текст, без пояснений и разметки."
+
+# Разделитель фрагментов базы знаний в контексте: по нему контекст сокращается целыми фрагментами
+RAG_DOCUMENT_SEPARATOR = "\n\n"
+
+# Управляющие символы (0x00-0x1F), кроме табуляции и переноса строк
+CONTROL_CHARS_RE = re.compile(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]')
+
+_rag_executor = None
+_rag_executor_lock = threading.Lock()
+
+
+def get_rag_executor():
+    """Пул потоков для параллельных RAG запросов, общий для процесса"""
+    global _rag_executor
+    if _rag_executor is None:
+        with _rag_executor_lock:
+            if _rag_executor is None:
+                _rag_executor = ThreadPoolExecutor(
+                    max_workers=int(os.getenv('RAG_SEARCH_THREADS', 8)),
+                    thread_name_prefix='rag-search'
+                )
+    return _rag_executor
+
 class LLMClient:
+    """Клиент LLM и RAG.
+
+    Создание клиента не обращается к сети: клиент OpenAI создается при первом
+    использовании, а векторное хранилище определяется по локальному манифесту
+    (или запросом к API при первом поиске, если манифеста нет). Заранее
+    подготовить манифест можно командой warmup_llm.
+    """
+
     def __init__(self):
         load_dotenv()
         self.folder_id = os.getenv('folder_id')
         self.api_key = os.getenv('api_key')
-        self.api_url = BASE_LLM_URL
+        # LLM_BASE_URL - другой OpenAI-совместимый сервер, например локальный run_fake_llm_server
+        self.api_url = os.getenv('LLM_BASE_URL') or BASE_LLM_URL
         self.processor = ResponseProcessor()
         self.data_folder = "data_simple"
-        self.vector_store_id = None
         self.vector_store_name = "rag_store_abandoned_2"
+        self.rag_manifest = RagManifest()
+        self._vector_store_id = None
+        self._rag_ready = False
+        self._rag_failed_at = None
+        self._rag_lock = threading.RLock()
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._responses = None
+        self._analysis_cache = None
+        self.rag_cache = get_rag_cache()
+
+        # Повторы, таймауты и предохранитель общие для всех клиентов процесса
+        self.resilience = get_llm_resilience()
+        # Локальный классификатор для очевидных писем (модель обучается командой train_preclassifier)
+        self.preclassifier = get_preclassifier()
+        # Бюджет входных токенов запроса: контекст RAG и длинные письма сокращаются
+        self.token_budget = TokenBudget()
+
+        # Ограничения RAG: время одного поискового запроса и объем контекста в промпте
+        self.rag_query_timeout = float(os.getenv('RAG_QUERY_TIMEOUT_SECONDS', 5))
+        self.rag_context_budget = int(os.getenv('RAG_CONTEXT_BUDGET_CHARS', 3000))
+
+        # Поиск по базе знаний: удаленное векторное хранилище или локальный индекс BM25
+        self.retriever = make_retriever(self)
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = OpenAI(
+                        base_url=self.api_url,
+                        api_key=self.api_key,
+                        project=self.folder_id
+                    )
+        return self._client
+
+    @property
+    def responses(self):
+        """Responses API без встроенных повторов SDK: повторами управляет LLMResilience"""
+        if self._responses is None:
+            self._responses = self.client.with_options(max_retries=0).responses
+        return self._responses
+
+    @property
+    def vector_store_id(self):
+        if not self._rag_ready:
+            self.ensure_rag()
+        return self._vector_store_id
+
+    @property
+    def rag_manifest_key(self):
+        return RagManifest.make_key(self.api_url, self.folder_id, self.vector_store_name)
+
+    def ensure_rag(self, refresh=False):
+        """Определяет векторное хранилище: по манифесту без сети, иначе запросом к API.
+
+        После неудачной попытки следующая делается не раньше чем через
+        RAG_INIT_RETRY_SECONDS, чтобы недоступный API не задерживал каждый запрос.
+        refresh=True игнорирует манифест и заново запрашивает API.
+        """
+        with self._rag_lock:
+            if self._rag_ready and not refresh:
+                return self._vector_store_id
+
+            retry_seconds = float(os.getenv('RAG_INIT_RETRY_SECONDS', 60))
+            if (not refresh and self._rag_failed_at is not None
+                    and time.monotonic() - self._rag_failed_at < retry_seconds):
+                return None
+
+            if not refresh:
+                entry = self.rag_manifest.get_store(self.rag_manifest_key)
+                if entry and entry.get('vector_store_id'):
+                    self._vector_store_id = entry['vector_store_id']
+                    self._rag_ready = True
+                    return self._vector_store_id
+
+            # Флаг ставится до инициализации: загрузка файлов внутри нее читает vector_store_id
+            self._rag_ready = True
+            self._initialize_rag(self.vector_store_name)
+
+            if self._vector_store_id:
+                self._rag_failed_at = None
+            else:
+                self._rag_ready = False
+                self._rag_failed_at = time.monotonic()
+            return self._vector_store_id
 
-        # Настройки таймаутов
-        self.timeout_seconds = 30  # Увеличиваем таймаут
-        self.max_retries = 2  # Количество попыток
+    def make_model(self, model_name):
+        return f"gpt://{self.folder_id}/{model_name}"
 
-        self.client = OpenAI(
-            base_url="https://rest-assistant.api.cloud.yandex.net/v1",
-            api_key=self.api_key,
-            project=self.folder_id
-        )
+    # Построение промптов (общее для синхронного и асинхронного клиентов)
 
-        # Инициализация RAG
-        self._initialize_rag(self.vector_store_name)
+    def _ensure_user_commentary(self, user_commentary):
+        """Всегда гарантируем, что есть какой-то текст"""
+        if not user_commentary or user_commentary.strip() == '':
+            return "Сгенерируй профессиональный ответ на письмо."
+        return user_commentary
 
-    def make_model(self, model_name):
-        return f"gpt://{self.folder_id}/{model_name}"
+    def _analysis_rag_query(self, text):
+        return f"Анализ письма: {text}..."
 
-    def analyze_letter(self, text, categories):
-        """Анализ письма с преобразованием результата"""
-        model = self.make_model(model_name=YAGPT_MODEL_NAME)
+    def _response_rag_queries(self, old_text_email, user_commentary):
+        return [f"Анализ письма: {old_text_email}...", f"Что нужно посмотреть: {user_commentary}..."]
 
-        prompt = make_analyze_email_prompt(categories)
+    def _text_rag_queries(self, text_email, user_commentary):
+        return [f"Анализ письма: {text_email}...", f"Что нужно сделать: {user_commentary}..."]
 
-        # Добавляем RAG контекст для лучшего анализа
-        rag_query = f"Анализ письма: {text}..."
-        rag_context = self._rag_search(rag_query)
+    def _build_analysis_prompt(self, categories, rag_context, text):
+        """Промпт для анализа письма: (инструкции, входные данные) в пределах бюджета токенов.
+
+        Инструкции неизменны для набора категорий; контекст RAG и письмо идут
+        во входных данных после них, чтобы префикс запроса кэшировался провайдером.
+        """
+        prompt = get_analysis_prompt(categories)
+        parts = self.token_budget.fit('analyze', [
+            PromptPart('instructions', prompt.text),
+            PromptPart('rag', rag_context, trim=1, separator=RAG_DOCUMENT_SEPARATOR),
+            PromptPart('letter', text, trim=2, min_tokens=self.token_budget.min_letter_tokens),
+        ], prompt_version=prompt.version)
+        rag_context = parts['rag']
+
+        if rag_context:
+            logger.debug("Контекст от RAG", extra=payload(rag_context))
+            return prompt.text, f"Контекст для анализа:\n{rag_context}\n\nПисьмо:\n{parts['letter']}"
+
+        logger.debug("Контекста от RAG не было")
+        return prompt.text, parts['letter']
+
+    def _build_response_prompt(self, old_text_email, user_commentary, style, rag_context):
+        """Промпт для генерации ответа в указанном стиле (в пределах бюджета токенов).
+
+        Начинается с неизменного описания стиля; письмо, указания и контекст RAG - в конце.
+        """
+        prompt = RESPONSE_PROMPTS[style]
+        parts = self.token_budget.fit('generate', [
+            PromptPart('instructions', f"{RESPONSE_INSTRUCTIONS}\n{prompt.text}"),
+            PromptPart('rag', rag_context, trim=1, separator=RAG_DOCUMENT_SEPARATOR),
+            PromptPart('letter', old_text_email, trim=2, min_tokens=self.token_budget.min_letter_tokens),
+            PromptPart('commentary', user_commentary, trim=3),
+        ], prompt_version=prompt.version)
+        old_text_email, user_commentary, rag_context = parts['letter'], parts['commentary'], parts['rag']
+        finished_prompt_text = f'{prompt.text}\nТекст письма:\n{old_text_email}\n\nДополнительные указания:\n{user_commentary}'
 
         if rag_context:
-            prompt += f"\n\nКонтекст для анализа:\n{rag_context}"
-            print(f'Контекст от RAG: {rag_context}')
+            finished_prompt_text += f"\n\nКонтекст для анализа:\n{rag_context}"
+            logger.debug("Контекст от RAG", extra=payload(rag_context))
         else:
-            print(f'Контекста от RAG не было')
+            logger.debug("Контекста от RAG не было")
+
+        return finished_prompt_text
 
-        for attempt in range(self.max_retries + 1):
-            try:
-                res = self.client.responses.parse(
+    def _build_text_prompt(self, text_email, user_commentary, rag_context):
+        """Инструкции и входные данные для ответа на вопрос о письме (в пределах бюджета токенов).
+
+        Инструкции одинаковы для всех запросов, письмо и вопрос - только во входных данных.
+        """
+        parts = self.token_budget.fit('text', [
+            PromptPart('instructions', TEXT_PROMPT.text),
+            PromptPart('rag', rag_context, trim=1, separator=RAG_DOCUMENT_SEPARATOR),
+            PromptPart('letter', text_email, trim=2, min_tokens=self.token_budget.min_letter_tokens),
+            PromptPart('commentary', user_commentary, trim=3),
+        ], prompt_version=TEXT_PROMPT.version)
+        return TEXT_PROMPT.text, self._build_text_input(parts['letter'], parts['commentary'], parts['rag'])
+
+    def _build_text_input(self, text_email, user_commentary, rag_context):
+        """Входные данные для генерации текста: и текст письма, и вопрос пользователя"""
+        if rag_context:
+            logger.debug("Контекст от RAG", extra=payload(rag_context))
+            return f"Контекст для составления ответа:\n{rag_context}\n\nТекст письма:\n{text_email}\n\nВопрос пользователя:\n{user_commentary}"
+
+        logger.debug("Контекста от RAG не было, используем текст письма и вопрос пользователя")
+        return f"Текст письма:\n{text_email}\n\nВопрос пользователя:\n{user_commentary}"
+
+    def _simplified_text_prompt(self, instructions, input_content):
+        """Упрощаем промпт для fallback генерации текста"""
+        return f"""
+            {instructions}
+
+            {input_content}
+            """
+
+    def _simplified_response_prompt(self, prompt):
+        """Упрощаем промпт для fallback генерации ответа"""
+        return f"""
+            Сгенерируй профессиональный ответ на банковское письмо.
+
+            Текст письма:
+            {prompt.split('Текст письма:')[1].split('Дополнительные указания:')[0] if 'Текст письма:' in prompt else prompt}
+
+            Ответ должен быть вежливым и профессиональным.
+            """
+
+    @property
+    def analysis_cache(self):
+        """Кэш результатов анализа (создается при первом обращении, требует Django)"""
+        if self._analysis_cache is None:
+            from .analysis_cache import AnalysisCache
+            self._analysis_cache = AnalysisCache()
+        return self._analysis_cache
+
+    def _analysis_cache_key(self, text, categories, model):
+        from .analysis_cache import make_cache_key
+        return make_cache_key(text, categories, model, get_analysis_prompt(categories).version)
+
+    def _cache_get(self, cache_key):
+        """Ошибки кэша не должны мешать анализу"""
+        try:
+            cached = self.analysis_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Результат анализа взят из кэша")
+            return cached
+        except Exception as e:
+            logger.warning("Ошибка при чтении кэша анализа: %s", e)
+            return None
+
+    def _cache_put(self, cache_key, result, model):
+        try:
+            self.analysis_cache.put(cache_key, result, model)
+        except Exception as e:
+            logger.warning("Ошибка при записи в кэш анализа: %s", e)
+
+    def _with_source(self, result, source):
+        """Отмечает, кто дал результат анализа: llm, cache, preclassifier или default"""
+        result['source'] = source
+        return result
+
+    def analyze_letter(self, text, categories, use_cache=True, use_preclassifier=True):
+        """Анализ письма с преобразованием результата.
+
+        Повторный анализ того же текста с теми же категориями, моделью и версией
+        промпта берется из кэша без обращения к LLM (use_cache=False - обойти кэш).
+        Очевидные письма классифицирует локальная модель, если она уверена
+        (use_preclassifier=False - всегда спрашивать LLM).
+        """
+        model = self.make_model(model_name=YAGPT_MODEL_NAME)
+
+        cache_key = self._analysis_cache_key(text, categories, model) if use_cache else None
+        if use_cache:
+            cached = self._cache_get(cache_key)
+            if cached is not None:
+                return self._with_source(cached, 'cache')
+
+        if use_preclassifier:
+            local_result = self.preclassifier.classify(text, categories)
+            if local_result is not None:
+                return local_result
+
+        # Добавляем RAG контекст для лучшего анализа
+        rag_context = self._rag_search(self._analysis_rag_query(text))
+        prompt, input_content = self._build_analysis_prompt(categories, rag_context, text)
+
+        try:
+            res = self.resilience.call(
+                'analyze',
+                lambda timeout: self.responses.parse(
                     model=model,
                     text_format=RequestAnalysis,
                     instructions=prompt,
-                    input=text,
-                    timeout=self.timeout_seconds
-                )
-
-                # Обрабатываем ответ через процессор
-                return self.processor.process_analysis_response(res.output_parsed, categories)
+                    input=input_content,
+                    timeout=timeout
+                ),
+                self.resilience.new_deadline(),
+                model=model
+            )
+            self.token_budget.stats.record_response('analyze', res, get_analysis_prompt(categories).version)
+        except Exception as e:
+            logger.error("Анализ не выполнен (%s), используем ответ по умолчанию", e)
+            return self._with_source(self.processor.process_analysis_response(None, categories), 'default')
 
-            except Exception as e:
-                print(f"Попытка {attempt + 1} не удалась: {e}")
-                if attempt < self.max_retries:
-                    print("Повторная попытка через 2 секунды...")
-                    time.sleep(2)
-                else:
-                    print("Все попытки не удались, используем ответ по умолчанию")
-                    return self.processor.process_analysis_response(None, categories)
+        # Обрабатываем ответ через процессор
+        result = self._with_source(self.processor.process_analysis_response(res.output_parsed, categories), 'llm')
+        # По версии промпта видно, какими инструкциями получен сохраненный результат
+        result['prompt_version'] = get_analysis_prompt(categories).version
+        if use_cache:
+            self._cache_put(cache_key, result, model)
+        return result
 
     def generate_response(self, old_text_email, user_commentary, style):
         """Генерация ответа в указанном стиле с улучшенной обработкой ошибок"""
-        basic_prompt = EMAIL_GENERATION_PROMPTS[style]
+        user_commentary = self._ensure_user_commentary(user_commentary)
 
-        # Всегда гарантируем, что есть какой-то текст
-        if not user_commentary or user_commentary.strip() == '':
-            user_commentary = "Сгенерируй профессиональный ответ на письмо."
+        # Добавляем RAG контекст для лучшего анализа (запросы по письму и по указаниям выполняются параллельно)
+        rag_context = self._rag_multi_search(self._response_rag_queries(old_text_email, user_commentary))
 
-        finished_prompt_text = f'{basic_prompt}\nТекст письма:\n{old_text_email}\n\nДополнительные указания:\n{user_commentary}'
+        return self._generate_styled_response(old_text_email, user_commentary, style, rag_context)
 
-        # Добавляем RAG контекст для лучшего анализа
-        rag_query = f"Анализ письма: {old_text_email}..."
-        rag_context = self._rag_search(rag_query)
+    def generate_all_responses(self, old_text_email, user_commentary, styles=None):
+        """Ответы во всех стилях сразу: {стиль: текст}.
 
-        rag_query_2 = f"Что нужно посмотреть: {user_commentary}..."
-        rag_context_2 = self._rag_search(rag_query_2)
+        RAG поиск выполняется один раз, генерации для разных стилей идут
+        параллельно, поэтому общее время близко к времени одной генерации.
+        """
+        user_commentary = self._ensure_user_commentary(user_commentary)
+        styles = list(styles or EMAIL_GENERATION_PROMPTS)
 
-        if rag_context or rag_context_2:
-            finished_prompt_text += f"\n\nКонтекст для анализа:\n{rag_context}\n{rag_context_2}"
-            print(f'Контекст от RAG: {rag_context}\n{rag_context_2}')
-        else:
-            print(f'Контекста от RAG не было')
+        rag_context = self._rag_multi_search(self._response_rag_queries(old_text_email, user_commentary))
+
+        deadline = self.resilience.new_deadline()
+        with ThreadPoolExecutor(max_workers=len(styles), thread_name_prefix='llm-generate') as executor:
+            texts = executor.map(
+                lambda style: self._generate_styled_response(
+                    old_text_email, user_commentary, style, rag_context, deadline
+                ),
+                styles
+            )
+            return dict(zip(styles, texts))
 
+    def _generate_styled_response(self, old_text_email, user_commentary, style, rag_context, deadline=None):
+        """Генерация ответа в одном стиле по готовому RAG контексту"""
+        finished_prompt_text = self._build_response_prompt(old_text_email, user_commentary, style, rag_context)
 
         model = self.make_model(model_name=YAGPT_MODEL_NAME)
 
-        # Пробуем основной метод с повторными попытками
-        for attempt in range(self.max_retries + 1):
-            try:
-                print(f"Попытка генерации ответа #{attempt + 1}")
-                res = self.client.responses.parse(
+        # Основной метод с повторами, затем упрощенный запрос - все в пределах одного срока
+        deadline = deadline or self.resilience.new_deadline()
+        try:
+            res = self.resilience.call(
+                'generate',
+                lambda timeout: self.responses.parse(
                     model=model,
                     text_format=EmailGeneration,
-                    instructions="Ты электронный помошник для составления писем.",
+                    instructions=RESPONSE_INSTRUCTIONS,
                     input=finished_prompt_text,
-                    timeout=self.timeout_seconds
-                )
+                    timeout=timeout
+                ),
+                deadline,
+                model=model
+            )
+            self.token_budget.stats.record_response('generate', res, RESPONSE_PROMPTS[style].version)
+            return res.output_parsed.response_email
 
-                return res.output_parsed.response_email
+        except (CircuitOpenError, DeadlineExceeded) as e:
+            logger.error("Генерация ответа не выполнена: %s", e)
+            return self._get_emergency_response(style)
+        except Exception as e:
+            logger.warning("Все попытки не удались (%s), используем fallback", e)
 
-            except Exception as e:
-                print(f"Попытка {attempt + 1} не удалась: {e}")
-                if attempt < self.max_retries:
-                    wait_time = (attempt + 1) * 3  # Увеличиваем задержку с каждой попыткой
-                    print(f"Повторная попытка через {wait_time} секунд...")
-                    time.sleep(wait_time)
-                else:
-                    print("Все попытки не удались, используем fallback")
-                    # Пробуем альтернативный способ
-                    try:
-                        return self._generate_response_fallback(finished_prompt_text, model)
-                    except Exception as fallback_error:
-                        print(f"Fallback также не сработал: {fallback_error}")
-                        return self._get_emergency_response(style)
+        try:
+            return self._generate_response_fallback(finished_prompt_text, model, deadline)
+        except Exception as fallback_error:
+            logger.error("Fallback также не сработал: %s", fallback_error)
+            return self._get_emergency_response(style)
 
     def generate_text(self, text_email, user_commentary):
         """Генерация текста для помощи в обработке сообщения в указанном стиле"""
 
-        # Всегда гарантируем, что есть какой-то текст
-        if not user_commentary or user_commentary.strip() == '':
-            user_commentary = "Сгенерируй профессиональный ответ на письмо."
-
-        instructions = make_generate_text_prompt(text_email, user_commentary)
+        user_commentary = self._ensure_user_commentary(user_commentary)
 
         # Добавляем RAG контекст для лучшего анализа
-        rag_query = f"Анализ письма: {text_email}..."
-        rag_context = self._rag_search(rag_query)
+        rag_context = self._rag_multi_search(self._text_rag_queries(text_email, user_commentary))
 
-        rag_query_2 = f"Что нужно сделать: {user_commentary}..."
-        rag_context_2 = self._rag_search(rag_query_2)
-
-        # ИСПРАВЛЕНИЕ: Включаем и текст письма И вопрос пользователя
-        input_content = f"Текст письма:\n{text_email}\n\nВопрос пользователя:\n{user_commentary}"
-
-        if rag_context or rag_context_2:
-            input_content = f"Контекст для составления ответа:\n{rag_context}\n{rag_context_2}\n\nТекст письма:\n{text_email}\n\nВопрос пользователя:\n{user_commentary}"
-            print(f'Контекст от RAG: {rag_context}\n{rag_context_2}')
-        else:
-            print(f'Контекста от RAG не было, используем текст письма и вопрос пользователя')
+        instructions, input_content = self._build_text_prompt(text_email, user_commentary, rag_context)
 
         model = self.make_model(model_name=YAGPT_MODEL_NAME)
+        deadline = self.resilience.new_deadline()
         try:
-            res = self.client.responses.parse(
-                model=model,
-                text_format=TextGeneration,
-                instructions=instructions,
-                input=input_content  # Теперь содержит и письмо и вопрос
+            res = self.resilience.call(
+                'text',
+                lambda timeout: self.responses.parse(
+                    model=model,
+                    text_format=TextGeneration,
+                    instructions=instructions,
+                    input=input_content,  # Теперь содержит и письмо и вопрос
+                    timeout=timeout
+                ),
+                deadline,
+                max_attempts=1,
+                model=model
             )
+            self.token_budget.stats.record_response('text', res, TEXT_PROMPT.version)
 
             return res.output_parsed.response
 
         except Exception as e:
-            print(f"Ошибка при генерации ответа: {e}")
+            logger.warning("Ошибка при генерации ответа: %s", e)
 
             # Пробуем альтернативный способ - прямой вызов без парсинга
-            try:
-                return self._generate_text_fallback(instructions, input_content, model)
-            except Exception as fallback_error:
-                print(f"Fallback также не сработал: {fallback_error}")
-                return f"Не удалось получить ответ. Пожалуйста, попробуйте еще раз."
+            return self._generate_text_fallback(instructions, input_content, model, deadline)
 
-    def _generate_text_fallback(self, instructions, input_content, model):
+    def _generate_text_fallback(self, instructions, input_content, model, deadline=None):
         """Альтернативный способ генерации текста с упрощенным запросом"""
         try:
-            print("Используем упрощенный fallback метод для генерации текста")
-
-            # Упрощаем промпт для fallback
-            simplified_prompt = f"""
-            {instructions}
-
-            {input_content}
-            """
+            logger.info("Используем упрощенный fallback метод для генерации текста")
 
             # Используем обычный completion вместо parse
-            response = self.client.responses.create(
-                model=model,
-                instructions="Ты - AI ассистент для анализа банковских писем. Отвечай на вопросы профессионально и точно.",
-                input=simplified_prompt,
-                timeout=20
+            response = self.resilience.call(
+                'fallback',
+                lambda timeout: self.responses.create(
+                    model=model,
+                    instructions=TEXT_FALLBACK_INSTRUCTIONS,
+                    input=self._simplified_text_prompt(instructions, input_content),
+                    timeout=timeout
+                ),
+                deadline or self.resilience.new_deadline(),
+                max_attempts=1,
+                max_timeout=FALLBACK_TIMEOUT_SECONDS,
+                model=model
             )
+            self.token_budget.stats.record_response('fallback', response)
+            LLM_FALLBACKS.inc(model=model_label(model), operation='text', outcome='success')
 
             # Очищаем ответ от управляющих символов
             clean_text = self._clean_response_text(response.output_text)
             return clean_text
 
         except Exception as e:
-            print(f"Ошибка в fallback методе для текста: {e}")
+            logger.error("Ошибка в fallback методе для текста: %s", e)
+            LLM_FALLBACKS.inc(model=model_label(model), operation='text', outcome='error')
+            EMERGENCY_RESPONSES.inc(operation='text')
             return "Извините, не удалось обработать ваш запрос. Пожалуйста, попробуйте переформулировать вопрос."
 
 
-    def _generate_response_fallback(self, prompt, model):
+    def _generate_response_fallback(self, prompt, model, deadline=None):
         """Альтернативный способ генерации ответа с упрощенным запросом"""
         try:
-            print("Используем упрощенный fallback метод")
-
-            # Упрощаем промпт для fallback
-            simplified_prompt = f"""
-            Сгенерируй профессиональный ответ на банковское письмо.
-
-            Текст письма:
-            {prompt.split('Текст письма:')[1].split('Дополнительные указания:')[0] if 'Текст письма:' in prompt else prompt}
-
-            Ответ должен быть вежливым и профессиональным.
-            """
+            logger.info("Используем упрощенный fallback метод")
 
             # Используем обычный completion вместо parse с меньшим таймаутом
-            response = self.client.responses.create(
-                model=model,
-                instructions="Ты - AI ассистент для генерации ответов на банковские письма. Генерируй профессиональные ответы.",
-                input=simplified_prompt,
-                timeout=20  # Меньший таймаут для fallback
+            response = self.resilience.call(
+                'fallback',
+                lambda timeout: self.responses.create(
+                    model=model,
+                    instructions=RESPONSE_FALLBACK_INSTRUCTIONS,
+                    input=self._simplified_response_prompt(prompt),
+                    timeout=timeout
+                ),
+                deadline or self.resilience.new_deadline(),
+                max_attempts=1,
+                max_timeout=FALLBACK_TIMEOUT_SECONDS,
+                model=model
             )
+            self.token_budget.stats.record_response('fallback', response)
+            LLM_FALLBACKS.inc(model=model_label(model), operation='generate', outcome='success')
 
             # Очищаем ответ от управляющих символов
             clean_text = self._clean_response_text(response.output_text)
             return clean_text
 
         except Exception as e:
-            print(f"Ошибка в fallback методе: {e}")
+            logger.warning("Ошибка в fallback методе: %s", e)
+            LLM_FALLBACKS.inc(model=model_label(model), operation='generate', outcome='error')
             raise e
 
+    # Потоковая генерация (SSE): текст отдается по мере генерации
+
+    def stream_response(self, old_text_email, user_commentary, style):
+        """Генерация ответа по частям: генератор фрагментов текста.
+
+        Если поток не удалось начать, одним фрагментом выдается ответ
+        упрощенного метода или аварийный ответ. Ошибка после начала потока
+        пробрасывается - часть текста уже показана пользователю.
+        """
+        user_commentary = self._ensure_user_commentary(user_commentary)
+        rag_context = self._rag_multi_search(self._response_rag_queries(old_text_email, user_commentary))
+        prompt = self._build_response_prompt(old_text_email, user_commentary, style, rag_context)
+        model = self.make_model(model_name=YAGPT_MODEL_NAME)
+
+        deadline = self.resilience.new_deadline()
+        started = False
+        try:
+            for delta in self._stream_output_text(
+                'generate', model, f"{RESPONSE_INSTRUCTIONS} {STREAM_TEXT_ONLY_INSTRUCTIONS}", prompt, deadline,
+                prompt_version=RESPONSE_PROMPTS[style].version
+            ):
+                started = True
+                yield delta
+        except Exception as e:
+            if started:
+                raise
+            logger.warning("Не удалось начать потоковую генерацию ответа: %s", e)
+        if started:
+            return
+
+        try:
+            yield self._generate_response_fallback(prompt, model, deadline)
+        except Exception as fallback_error:
+            logger.error("Fallback также не сработал: %s", fallback_error)
+            yield self._get_emergency_response(style)
+
+    def stream_text(self, text_email, user_commentary):
+        """Ответ на вопрос о письме по частям (генератор фрагментов текста)"""
+        user_commentary = self._ensure_user_commentary(user_commentary)
+        rag_context = self._rag_multi_search(self._text_rag_queries(text_email, user_commentary))
+        instructions, input_content = self._build_text_prompt(text_email, user_commentary, rag_context)
+        model = self.make_model(model_name=YAGPT_MODEL_NAME)
+
+        deadline = self.resilience.new_deadline()
+        started = False
+        try:
+            for delta in self._stream_output_text(
+                'text', model, f"{instructions}\n\n{STREAM_TEXT_ONLY_INSTRUCTIONS}", input_content, deadline,
+                prompt_version=TEXT_PROMPT.version
+            ):
+                started = True
+                yield delta
+        except Exception as e:
+            if started:
+                raise
+            logger.warning("Не удалось начать потоковую генерацию текста: %s", e)
+        if not started:
+            yield self._generate_text_fallback(instructions, input_content, model, deadline)
+
+    def _stream_output_text(self, operation, model, instructions, input_content, deadline, prompt_version=None):
+        """Потоковый вызов Responses API: фрагменты текста по мере генерации.
+
+        Поток не повторяется (текст уже мог уйти пользователю), но учитывается
+        предохранителем; таймаут ограничивает ожидание каждого фрагмента.
+        """
+        timeout = self.resilience.attempt_timeout(operation, deadline)
+        started = time.monotonic()
+        labels = {'model': model_label(model), 'operation': f'{operation}_stream'}
+        try:
+            with self.responses.create(
+                model=model,
+                instructions=instructions,
+                input=input_content,
+                stream=True,
+                timeout=timeout
+            ) as stream:
+                for event in stream:
+                    if event.type == 'response.completed':
+                        self.token_budget.stats.record_response(operation, event.response, prompt_version)
+                    delta = self._stream_event_delta(event)
+                    if delta:
+                        yield delta
+        except Exception as e:
+            LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome='error', **labels)
+            self.resilience.record_failure(e)
+            raise
+        except GeneratorExit:
+            # Пользователь закрыл страницу посреди ответа - провайдер при этом отвечал
+            LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome='cancelled', **labels)
+            self.resilience.record_success()
+            raise
+        except BaseException:
+            # Отмена задачи или остановка процесса - результат неизвестен
+            LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome='cancelled', **labels)
+            self.resilience.release_probe()
+            raise
+        LLM_REQUEST_SECONDS.observe(time.monotonic() - started, outcome='success', **labels)
+        self.resilience.record_success()
+
+    def _stream_event_delta(self, event):
+        """Текст из события потока; события ошибок превращаются в исключения"""
+        if event.type == 'response.output_text.delta':
+            return event.delta
+        if event.type == 'response.failed':
+            raise RuntimeError(f"Генерация прервана: {event.response.error}")
+        if event.type == 'error':
+            raise RuntimeError(f"Ошибка потока: {event.message}")
+        return None
+
+    def finalize_streamed_text(self, text):
+        """Текст, собранный из фрагментов потока, для сохранения (переносы строк сохраняются)"""
+        clean_text = CONTROL_CHARS_RE.sub('', text or '').strip()
+        return clean_text or "Не удалось сгенерировать ответ."
+
     def _get_emergency_response(self, style):
         """Аварийный ответ когда все методы не сработали"""
         emergency_responses = {
@@ -271,7 +666,8 @@ class LLMClient:
         }
 
         response = emergency_responses.get(style, emergency_responses[2])
-        print("Используем аварийный заготовленный ответ")
+        logger.warning("Используем аварийный заготовленный ответ")
+        EMERGENCY_RESPONSES.inc(operation='generate')
         return response
 
     def _clean_response_text(self, text):
@@ -280,7 +676,7 @@ class LLMClient:
             return "Не удалось сгенерировать ответ."
 
         # Удаляем управляющие символы (0x00-0x1F), кроме табуляции и переноса строк
-        clean_text = re.sub(r'[\x00-\x08\x0B\x0C\x0E-\x1F\x7F]', '', text)
+        clean_text = CONTROL_CHARS_RE.sub('', text)
 
         # Удаляем лишние пробелы
         clean_text = re.sub(r'\s+', ' ', clean_text).strip()
@@ -295,124 +691,134 @@ class LLMClient:
             existing_store = next((vs for vs in vector_stores.data if vs.name == vector_store_name), None)
 
             if existing_store:
-                self.vector_store_id = existing_store.id
-                print(
-                    f"Используется существующее векторное хранилище: {vector_store_name} (ID: {self.vector_store_id})")
+                self._vector_store_id = existing_store.id
+                logger.info("Используется существующее векторное хранилище: %s (ID: %s)",
+                            vector_store_name, self._vector_store_id)
 
                 # Проверяем, есть ли файлы в хранилище
-                files = self.client.vector_stores.files.list(vector_store_id=self.vector_store_id)
-                print(f"Количество файлов в хранилище: {len(files.data)}")
+                files = self.client.vector_stores.files.list(vector_store_id=self._vector_store_id)
+                logger.info("Количество файлов в хранилище: %s", len(files.data))
 
                 if len(files.data) == 0:
-                    print("Хранилище пустое, загружаем файлы...")
+                    # В пустом хранилище нет и файлов из манифеста - загружаем все заново
+                    self.rag_manifest.save_store(self.rag_manifest_key, self._vector_store_id, files={})
+                    logger.info("Хранилище пустое, загружаем файлы")
                     self.load_txt_files_to_vector_store()
+                else:
+                    # Запоминаем хранилище, чтобы следующие процессы не обращались к API
+                    self.rag_manifest.save_store(self.rag_manifest_key, self._vector_store_id)
             else:
                 vector_store = self.client.vector_stores.create(name=vector_store_name)
-                self.vector_store_id = vector_store.id
-                print(f"Создано новое векторное хранилище: {vector_store_name} (ID: {self.vector_store_id})")
+                self._vector_store_id = vector_store.id
+                logger.info("Создано новое векторное хранилище: %s (ID: %s)", vector_store_name, self._vector_store_id)
+                self.rag_manifest.save_store(self.rag_manifest_key, self._vector_store_id, files={})
 
                 # Загружаем файлы в новое хранилище
                 self.load_txt_files_to_vector_store()
 
         except Exception as e:
-            print(f"Ошибка при инициализации RAG: {e}")
-            self.vector_store_id = None
-
-    # Загружаем txt файлы из папки data
-    def load_txt_files_to_vector_store(self):
-        """Загружает все txt файлы из папки data в векторное хранилище"""
-        if not self.vector_store_id:
-            print("Vector store не инициализирован, пропускаем загрузку файлов")
-            return
-
-        data_path = Path(self.data_folder)
-        if not data_path.exists():
-            print(f"Папка {self.data_folder} не существует, создаем...")
-            data_path.mkdir(parents=True, exist_ok=True)
-            print(f"Пожалуйста, добавьте txt файлы в папку {self.data_folder} для работы RAG")
-            return
-
-        # Ищем все txt файлы
-        txt_files = list(data_path.glob("**/*.txt"))
-
-        if not txt_files:
-            print(f"В папке {self.data_folder} не найдено txt файлов")
-            print(f"Абсолютный путь к папке: {data_path.absolute()}")
-            return
-
-        print(f"Найдено {len(txt_files)} txt файлов для загрузки")
-
-        # Загружаем файлы по одному
-        successful_uploads = 0
-        for file_path in txt_files:
-            try:
-                print(f"Загружаем файл: {file_path.name}")
-
-                # Проверяем размер файла
-                file_size = file_path.stat().st_size
-                if file_size == 0:
-                    print(f"Файл {file_path.name} пустой, пропускаем")
-                    continue
-
-                # Загружаем файл напрямую
-                with open(file_path, 'rb') as file:
-                    # Создаем файл в OpenAI
-                    oai_file = self.client.files.create(
-                        file=file,
-                        purpose="batch"
-                    )
-
-                    # Добавляем файл в векторное хранилище
-                    vector_store_file = self.client.vector_stores.files.create(
-                        vector_store_id=self.vector_store_id,
-                        file_id=oai_file.id
-                    )
-
-                    print(f"Успешно загружен: {file_path.name} (ID файла: {oai_file.id}, размер: {file_size} байт)")
-                    successful_uploads += 1
+            logger.error("Ошибка при инициализации RAG: %s", e)
+            self._vector_store_id = None
+
+    # Синхронизируем txt файлы из папки data
+    def load_txt_files_to_vector_store(self, dry_run=False, prune_untracked=False):
+        """Синхронизирует txt файлы из папки data с векторным хранилищем.
+
+        Загружаются только новые и измененные файлы, устаревшие версии и
+        удаленные файлы убираются из хранилища (см. KnowledgeBaseSync).
+        """
+        report = KnowledgeBaseSync(self).sync(dry_run=dry_run, prune_untracked=prune_untracked)
+        logger.info(report.summary())
+        return report
+
+    def _cached_chunks(self, query, max_results):
+        """Фрагменты из кэша RAG или None"""
+        retriever = self.retriever
+        if not retriever.cacheable:
+            return None
+
+        cached = self.rag_cache.get(retriever.namespace, query, max_results)
+        if cached is None:
+            return None
+        try:
+            return [RetrievedChunk(**item) for item in json.loads(cached)]
+        except (ValueError, TypeError):
+            return None
+
+    def _store_chunks(self, query, max_results, chunks):
+        retriever = self.retriever
+        if retriever.cacheable:
+            payload = json.dumps([asdict(chunk) for chunk in chunks], ensure_ascii=False)
+            self.rag_cache.set(retriever.namespace, query, max_results, payload)
+
+    @property
+    def _retriever_label(self):
+        return 'local' if self.retriever.local else 'remote'
+
+    def _retrieve(self, query, max_results=5):
+        """Фрагменты базы знаний по одному запросу. Ошибка поиска дает пустой список."""
+        started = time.monotonic()
+        # Одинаковые запросы (повторная генерация, несколько вопросов к письму) берем из кэша
+        cached = self._cached_chunks(query, max_results)
+        if cached is not None:
+            logger.debug("RAG контекст взят из кэша")
+            RAG_SEARCH_SECONDS.observe(time.monotonic() - started, retriever=self._retriever_label, outcome='cache')
+            return cached
 
-            except Exception as e:
-                print(f"Ошибка при загрузке файла {file_path}: {e}")
+        try:
+            logger.debug("Выполняем RAG поиск", extra=payload(query))
+            chunks = self.retriever.search(query, max_results, timeout=self.rag_query_timeout)
+        except Exception as e:
+            logger.warning("Ошибка при RAG поиске: %s", e)
+            RAG_SEARCH_SECONDS.observe(time.monotonic() - started, retriever=self._retriever_label, outcome='error')
+            return []
 
-        print(f"Успешно загружено {successful_uploads} из {len(txt_files)} файлов")
+        RAG_SEARCH_SECONDS.observe(time.monotonic() - started, retriever=self._retriever_label, outcome='success')
+        self._store_chunks(query, max_results, chunks)
+        return chunks
 
     def _rag_search(self, query, max_results=5):
-        """Поиск релевантной информации в векторном хранилище"""
-        if not self.vector_store_id:
-            print("Vector store не доступен, пропускаем RAG поиск")
-            return ""
-
-        try:
-            print(f"Выполняем RAG поиск по запросу: '{query}'")
+        """Поиск релевантной информации в базе знаний"""
+        return self._rag_multi_search([query], max_results)
 
-            # Используем поиск по векторному хранилищу
-            search_results = self.client.vector_stores.search(
-                vector_store_id=self.vector_store_id,
-                query=query,
-                max_num_results=max_results
-            )
+    def _rag_multi_search(self, queries, max_results=5):
+        """Поиск по нескольким запросам сразу: один общий контекст без повторов в пределах бюджета.
 
-            if not search_results.data:
-                print("RAG поиск не вернул результатов")
-                return ""
+        Удаленные запросы выполняются параллельно, поэтому задержка равна самому
+        долгому из них; запросы, не уложившиеся в rag_query_timeout, пропускаются.
+        """
+        if not self.retriever.is_available():
+            logger.info("RAG поиск недоступен, пропускаем")
+            return ""
 
-            print(f"RAG поиск вернул {len(search_results.data)} результатов")
+        if self.retriever.local or len(queries) == 1:
+            chunk_lists = [self._retrieve(query, max_results) for query in queries]
+        else:
+            futures = [get_rag_executor().submit(self._retrieve, query, max_results) for query in queries]
+            done, not_done = wait(futures, timeout=self.rag_query_timeout)
+            if not_done:
+                logger.warning("RAG поиск: %s из %s запросов не уложились в %s с", len(not_done), len(futures), self.rag_query_timeout)
+            chunk_lists = [future.result() for future in futures if future in done]
+
+        return self._format_rag_results(merge_chunks(chunk_lists, self.rag_context_budget))
+
+    def _format_rag_results(self, chunks):
+        """Форматирует найденные фрагменты в контекст для промпта"""
+        if not chunks:
+            logger.debug("RAG поиск не вернул результатов")
+            return ""
 
-            # Форматируем результаты
-            context_parts = []
-            for i, result in enumerate(search_results.data, 1):
-                context_text = getattr(result, 'text', getattr(result, 'content', ''))
-                if context_text:
-                    # Обрезаем слишком длинные тексты
-                    if len(context_text) > 1000:
-                        context_text = context_text[:1000] + "..."
-                    context_parts.append(f"[Документ {i}]: {context_text}")
-                    print(f"Найден релевантный документ {i}")
+        logger.debug("RAG поиск вернул %s результатов", len(chunks))
 
-            result = "\n\n".join(context_parts)
-            print(f"Общий размер контекста RAG: {len(result)} символов")
-            return result
+        context_parts = []
+        for i, chunk in enumerate(chunks, 1):
+            context_text = chunk.text
+            if context_text:
+                # Обрезаем слишком длинные тексты
+                if len(context_text) > 1000:
+                    context_text = context_text[:1000] + "..."
+                context_parts.append(f"[Документ {i}]: {context_text}")
 
-        except Exception as e:
-            print(f"Ошибка при RAG поиске: {e}")
-            return ""
\ No newline at end of file
+        result = RAG_DOCUMENT_SEPARATOR.join(context_parts)
+        logger.debug("Общий размер контекста RAG: %s символов", len(result))
+        return result
\ No newline at end of file
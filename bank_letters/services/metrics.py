@@ -0,0 +1,261 @@
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм времени (секунды): от запросов к БД до ответа нейросети
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Как часто процесс сбрасывает свои значения в файл
+DEFAULT_FLUSH_SECONDS = 5
+
+
+def metrics_enabled():
+    return os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+
+
+def metrics_dir():
+    """Каталог файлов метрик процессов (METRICS_DIR); пустая строка - только метрики текущего процесса"""
+    return os.getenv('METRICS_DIR', '.metrics')
+
+
+def model_label(model):
+    """Имя модели без схемы и каталога: gpt://<folder>/yandexgpt/rc -> yandexgpt/rc"""
+    if not model:
+        return ''
+    return model.split('://', 1)[1].split('/', 1)[-1] if '://' in model else model
+
+
+class ProcessMetrics:
+    """Значения метрик процесса.
+
+    Каждый процесс (воркер gunicorn, обработчик очереди) пишет свои значения
+    в отдельный файл METRICS_DIR/<pid>-<id>.json фоновым потоком; /metrics
+    складывает файлы всех процессов. Файлы завершившихся процессов остаются,
+    поэтому счетчики не уменьшаются при перезапуске воркеров; каталог очищается
+    при развертывании.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.values = {}
+        self.dirty = False
+        self.path = None
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def add(self, key, size, index, amount, total=None):
+        """Прибавляет amount к values[index] (и total к последнему значению гистограммы)"""
+        if self.pid != os.getpid():
+            # Дочерний процесс после fork начинает со своих значений и своего файла
+            self._reset()
+        with self._lock:
+            values = self.values.get(key)
+            if values is None:
+                values = self.values[key] = [0] * size
+            values[index] += amount
+            if total is not None:
+                values[-1] += total
+            self.dirty = True
+            if self._flusher is None and metrics_dir():
+                self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+                self._flusher.start()
+
+    def snapshot(self):
+        with self._lock:
+            return [[name, list(labels), list(values)] for (name, labels), values in self.values.items()]
+
+    def flush(self):
+        directory = metrics_dir()
+        if not directory or self.pid != os.getpid():
+            return
+        with self._lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+        try:
+            if self.path is None:
+                os.makedirs(directory, exist_ok=True)
+                self.path = os.path.join(directory, f"{self.pid}-{uuid.uuid4().hex[:8]}.json")
+            # Запись через временный файл: читатель не увидит половину файла
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            self.dirty = True
+            logger.warning("Не удалось сохранить метрики процесса: %s", e)
+
+    def _flush_loop(self):
+        interval = float(os.getenv('METRICS_FLUSH_SECONDS', DEFAULT_FLUSH_SECONDS))
+        while True:
+            time.sleep(interval)
+            self.flush()
+
+
+_process_metrics = ProcessMetrics()
+atexit.register(_process_metrics.flush)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        METRICS.append(self)
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if metrics_enabled():
+            _process_metrics.add(self._key(self.name, labels), 1, 0, amount)
+
+
+class Histogram(Metric):
+    """Гистограмма: число наблюдений по корзинам (последняя - +Inf) и их сумма"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if metrics_enabled():
+            index = bisect.bisect_left(self.buckets, value)
+            _process_metrics.add(self._key(self.name, labels), len(self.buckets) + 2, index, 1, total=value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время блока. Метки можно дополнить внутри блока; при исключении outcome=error."""
+        started = time.perf_counter()
+        try:
+            yield labels
+        except BaseException:
+            if 'outcome' in labels:
+                labels['outcome'] = 'error'
+            raise
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+METRICS = []
+
+RAG_SEARCH_SECONDS = Histogram(
+    'bank_letters_rag_search_seconds',
+    "Время одного запроса к базе знаний (retriever, outcome: success, cache, timeout, error)"
+)
+LLM_REQUEST_SECONDS = Histogram(
+    'bank_letters_llm_request_seconds',
+    "Время попытки запроса к LLM (model, operation, outcome: success, error, cancelled)"
+)
+LLM_REJECTED_REQUESTS = Counter(
+    'bank_letters_llm_rejected_requests_total', "Запросы к LLM, не отправленные из-за предохранителя или срока"
+)
+LLM_FALLBACKS = Counter(
+    'bank_letters_llm_fallbacks_total', "Упрощенные запросы после неудачи основного (model, operation, outcome)"
+)
+EMERGENCY_RESPONSES = Counter(
+    'bank_letters_emergency_responses_total', "Заготовленные ответы вместо сгенерированных"
+)
+LLM_TOKENS = Counter(
+    'bank_letters_llm_tokens_total',
+    "Токены запросов к LLM (operation, prompt_version, kind: estimated_input, input, output)"
+)
+ANALYSIS_RESULTS = Counter(
+    'bank_letters_analysis_results_total', "Сохраненные результаты анализа по источнику (llm, cache, preclassifier, ...)"
+)
+DB_SAVE_SECONDS = Histogram(
+    'bank_letters_db_save_seconds', "Время сохранения результатов в БД (operation)"
+)
+VIEW_SECONDS = Histogram(
+    'bank_letters_view_seconds', "Время обработки запроса представлением (view, method, status)"
+)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def collect():
+    """Значения всех процессов: {(метрика, метки): значения}"""
+    _process_metrics.flush()
+    directory = metrics_dir()
+    sources = []
+    if directory and os.path.isdir(directory):
+        for path in glob.glob(os.path.join(directory, '*.json')):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    sources.append(json.load(f))
+            except (OSError, ValueError):
+                # Файл удален или пишется в этот момент - его значения будут в следующий раз
+                continue
+    if not sources:
+        sources.append(_process_metrics.snapshot())
+
+    merged = {}
+    for entries in sources:
+        for name, labels, values in entries:
+            key = (name, tuple(tuple(label) for label in labels))
+            current = merged.get(key)
+            if current is None:
+                merged[key] = list(values)
+            elif len(current) == len(values):
+                merged[key] = [a + b for a, b in zip(current, values)]
+    return merged
+
+
+def render_metrics():
+    """Метрики в текстовом формате Prometheus"""
+    merged = collect()
+    by_name = {}
+    for (name, labels), values in merged.items():
+        by_name.setdefault(name, []).append((labels, values))
+
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels, values in sorted(by_name.get(metric.name, [])):
+            if metric.kind == 'counter':
+                lines.append(f"{metric.name}{_format_labels(labels)} {_format_value(values[0])}")
+                continue
+            if len(values) != len(metric.buckets) + 2:
+                # Файл записан с другими границами корзин
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), values[:-1]):
+                cumulative += count
+                le = bound if bound == '+Inf' else _format_value(float(bound))
+                lines.append(f"{metric.name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{metric.name}_sum{_format_labels(labels)} {_format_value(values[-1])}")
+            lines.append(f"{metric.name}_count{_format_labels(labels)} {cumulative}")
+    return '\n'.join(lines) + '\n'
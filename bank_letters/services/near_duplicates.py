@@ -0,0 +1,219 @@
+import hashlib
+import logging
+import os
+import random
+import struct
+import zlib
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from bank_letters.models import Letter, LetterLshBucket, AnalysisResult
+from bank_letters.services.analysis_cache import normalize_letter_text, SLA_DEADLINE_FORMAT
+from bank_letters.services.text_utils import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Сигнатура MinHash: NUM_PERMUTATIONS минимумов хешей шинглов (по 8 байт)
+NUM_PERMUTATIONS = 128
+# LSH: сигнатура делится на полосы; письма с совпавшей полосой - кандидаты в дубликаты.
+# 16 полос по 8 строк: письмо с похожестью 0.85 становится кандидатом с вероятностью
+# 99%, с похожестью 0.5 - примерно в 6% случаев
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+# Шингл - последовательность из SHINGLE_SIZE слов
+SHINGLE_SIZE = 3
+
+# Простое число Мерсенна для универсального хеширования (a * x + b) mod P
+MERSENNE_PRIME = (1 << 61) - 1
+_permutation_rng = random.Random(20240601)
+PERMUTATIONS = tuple(
+    (_permutation_rng.randrange(1, MERSENNE_PRIME), _permutation_rng.randrange(0, MERSENNE_PRIME))
+    for _ in range(NUM_PERMUTATIONS)
+)
+SIGNATURE_FORMAT = f'<{NUM_PERMUTATIONS}Q'
+
+
+def near_duplicates_enabled():
+    return os.getenv('NEAR_DUPLICATES_ENABLED', 'true').lower() == 'true'
+
+
+def near_duplicate_threshold():
+    """Минимальная оценка сходства (коэффициент Жаккара), при которой письмо считается дубликатом"""
+    return float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.85))
+
+
+def letter_shingles(letter):
+    """Хеши шинглов темы и текста письма (обращение к получателю не учитывается)"""
+    words = tokenize(normalize_letter_text(f"{letter.subject}\n{letter.original_text}"))
+    if not words:
+        return set()
+    if len(words) < SHINGLE_SIZE:
+        return {zlib.crc32(' '.join(words).encode('utf-8'))}
+    return {
+        zlib.crc32(' '.join(words[i:i + SHINGLE_SIZE]).encode('utf-8'))
+        for i in range(len(words) - SHINGLE_SIZE + 1)
+    }
+
+
+def minhash_signature(shingles):
+    """Сигнатура MinHash набора шинглов или None для пустого письма"""
+    if not shingles:
+        return None
+    return tuple(
+        min((a * shingle + b) % MERSENNE_PRIME for shingle in shingles)
+        for a, b in PERMUTATIONS
+    )
+
+
+def pack_signature(signature):
+    return struct.pack(SIGNATURE_FORMAT, *signature)
+
+
+def unpack_signature(data):
+    return struct.unpack(SIGNATURE_FORMAT, bytes(data))
+
+
+def estimate_similarity(left, right):
+    """Оценка коэффициента Жаккара: доля совпавших позиций сигнатур"""
+    return sum(a == b for a, b in zip(left, right)) / NUM_PERMUTATIONS
+
+
+def lsh_buckets(signature):
+    """Корзины LSH сигнатуры: [(полоса, корзина)].
+
+    Номер полосы входит в хеш, поэтому корзины разных полос не пересекаются
+    и поиск кандидатов идет по одному индексу корзины.
+    """
+    buckets = []
+    for band in range(LSH_BANDS):
+        rows = signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]
+        digest = hashlib.blake2b(struct.pack(f'<H{LSH_ROWS}Q', band, *rows), digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, 'little', signed=True)))
+    return buckets
+
+
+def index_letters(letters):
+    """Строит сигнатуры писем и связывает почти дубликаты с представителем группы.
+
+    Представитель - самое раннее письмо группы: письмо ссылается на него напрямую
+    (duplicate_of), даже если больше похоже на другой дубликат. Кандидаты ищутся
+    одним запросом по корзинам LSH для всей пачки; письма внутри пачки тоже
+    сравниваются друг с другом. Возвращает письма, для которых нашелся дубликат.
+    """
+    letters = sorted((letter for letter in letters if letter.pk), key=lambda letter: letter.pk)
+    if not letters:
+        return []
+
+    signatures = {}
+    buckets = []
+    for letter in letters:
+        signature = minhash_signature(letter_shingles(letter))
+        letter.minhash_signature = pack_signature(signature) if signature else None
+        if signature is None:
+            continue
+        signatures[letter.pk] = signature
+        buckets.extend(
+            LetterLshBucket(letter=letter, band=band, bucket=bucket)
+            for band, bucket in lsh_buckets(signature)
+        )
+
+    # Кандидаты: письма с общими корзинами, загруженные раньше
+    bucket_values = {bucket.bucket for bucket in buckets}
+    candidates = {}
+    for letter_id, bucket in (
+        LetterLshBucket.objects.filter(bucket__in=bucket_values, letter_id__lt=letters[-1].pk)
+        .values_list('letter_id', 'bucket')
+    ):
+        candidates.setdefault(bucket, set()).add(letter_id)
+    for bucket in buckets:
+        candidates.setdefault(bucket.bucket, set()).add(bucket.letter_id)
+
+    candidate_ids = set().union(*candidates.values()) - set(signatures)
+    known = {
+        letter_id: (unpack_signature(signature), duplicate_of_id)
+        for letter_id, signature, duplicate_of_id in Letter.objects.filter(
+            id__in=candidate_ids, minhash_signature__isnull=False
+        ).values_list('id', 'minhash_signature', 'duplicate_of_id')
+    }
+
+    threshold = near_duplicate_threshold()
+    duplicates = []
+    for letter in letters:
+        letter.duplicate_of_id = None
+        letter.duplicate_similarity = None
+        signature = signatures.get(letter.pk)
+        if signature is None:
+            continue
+
+        letter_candidates = set()
+        for _, bucket in lsh_buckets(signature):
+            letter_candidates |= {candidate for candidate in candidates.get(bucket, ()) if candidate < letter.pk}
+
+        best_id, best_similarity = None, 0.0
+        for candidate_id in sorted(letter_candidates):
+            candidate_signature, _ = known.get(candidate_id, (None, None))
+            if candidate_signature is None:
+                continue
+            similarity = estimate_similarity(signature, candidate_signature)
+            if similarity >= threshold and similarity > best_similarity:
+                best_id, best_similarity = candidate_id, similarity
+
+        # Письмо пачки становится кандидатом для следующих писем той же пачки
+        known[letter.pk] = (signature, None)
+        if best_id is None:
+            continue
+
+        representative_id = known[best_id][1] or best_id
+        letter.duplicate_of_id = representative_id
+        letter.duplicate_similarity = round(best_similarity, 3)
+        known[letter.pk] = (signature, representative_id)
+        duplicates.append(letter)
+
+    with transaction.atomic():
+        LetterLshBucket.objects.filter(letter__in=letters).delete()
+        LetterLshBucket.objects.bulk_create(buckets)
+        Letter.objects.bulk_update(letters, ['minhash_signature', 'duplicate_of', 'duplicate_similarity'])
+
+    if duplicates:
+        logger.info("Найдено почти дубликатов: %s из %s", len(duplicates), len(letters))
+    return duplicates
+
+
+def index_letter(letter):
+    """Индексирует одно письмо; возвращает представителя группы дубликатов или None"""
+    if not near_duplicates_enabled():
+        return None
+    index_letters([letter])
+    return letter.duplicate_of
+
+
+def reuse_duplicate_analysis(letter):
+    """Анализ представителя группы для почти дубликата или None - тогда нужен анализ.
+
+    Берется только анализ нейросетью (или из кэша) по текущему набору категорий;
+    дедлайн пересчитывается от текущего момента.
+    """
+    from bank_letters.services.category_registry import get_category_registry
+
+    if not letter.duplicate_of_id or not near_duplicates_enabled():
+        return None
+
+    registry = get_category_registry()
+    analysis = AnalysisResult.objects.filter(
+        letter_id=letter.duplicate_of_id, letter__classification_version=registry.version
+    ).values_list('analysis_data', flat=True).first()
+    if not analysis or analysis.get('source') in ('default', 'duplicate'):
+        return None
+    if analysis.get('classification') not in registry.names:
+        return None
+
+    result = dict(analysis)
+    hours = result.get('processing_time_hours')
+    if hours:
+        result['sla_deadline'] = (timezone.now() + timedelta(hours=hours)).strftime(SLA_DEADLINE_FORMAT)
+    result['source'] = 'duplicate'
+    result['duplicate_of'] = letter.duplicate_of_id
+    logger.info("Письмо #%s: использован анализ похожего письма #%s", letter.pk, letter.duplicate_of_id)
+    return result
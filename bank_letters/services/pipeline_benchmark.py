@@ -0,0 +1,246 @@
+"""Сквозной нагрузочный тест: загрузка письма, анализ, генерация ответа и вопрос к письму.
+
+Запросы выполняются тестовым клиентом Django в нескольких потоках (через все
+middleware и представления), анализ - обработчиками очереди в отдельных процессах.
+LLM - локальный run_fake_llm_server (LLM_BASE_URL) или настоящий API.
+"""
+import multiprocessing
+import random
+import signal
+import threading
+import time
+from dataclasses import dataclass, field
+
+from django.db import connections
+from django.test import Client
+from django.urls import resolve, reverse
+
+from bank_letters.models import Letter
+from bank_letters.services.synthetic_data import QUESTIONS, make_letter_fields
+
+# Этапы сценария в порядке выполнения; pipeline - весь сценарий целиком
+STAGES = ('upload', 'analyze', 'analysis_wait', 'generate_responses', 'ask_question', 'pipeline')
+BENCHMARK_SUBJECT_PREFIX = '[benchmark] '
+
+
+class StageError(Exception):
+    """Этап сценария завершился неожиданным ответом"""
+
+
+def percentile(values, percent):
+    """Процентиль по методу ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+@dataclass
+class BenchmarkReport:
+    concurrency: int
+    letters: int
+    elapsed: float = 0.0
+    latencies: dict = field(default_factory=lambda: {stage: [] for stage in STAGES})
+    errors: dict = field(default_factory=lambda: {stage: 0 for stage in STAGES})
+    error_samples: list = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self.latencies[stage].append(seconds)
+
+    def record_error(self, stage, message):
+        with self._lock:
+            self.errors[stage] += 1
+            # Храним несколько примеров ошибок, чтобы отчет не разрастался
+            if len(self.error_samples) < 10:
+                self.error_samples.append(f"{stage}: {message}")
+
+    @property
+    def completed(self):
+        return len(self.latencies['pipeline'])
+
+    @property
+    def throughput(self):
+        """Завершенных сценариев в секунду"""
+        return self.completed / self.elapsed if self.elapsed else 0.0
+
+    def rows(self):
+        """Строки отчета по этапам: число, ошибки, запросов в секунду и процентили (секунды)"""
+        rows = []
+        for stage in STAGES:
+            values = self.latencies[stage]
+            rows.append({
+                'stage': stage,
+                'count': len(values),
+                'errors': self.errors[stage],
+                'rps': len(values) / self.elapsed if self.elapsed else 0.0,
+                'p50': percentile(values, 50),
+                'p95': percentile(values, 95),
+                'p99': percentile(values, 99),
+                'max': max(values) if values else None,
+            })
+        return rows
+
+
+def _analysis_worker(stop_event, poll_interval):
+    """Точка входа процесса-обработчика очереди анализа"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from bank_letters.services.analysis_queue import run_worker
+    from bank_letters.services.llm_client import LLMClient
+
+    try:
+        run_worker(LLMClient(), stop_event=stop_event, poll_interval=poll_interval)
+    finally:
+        connections.close_all()
+
+
+class PipelineBenchmark:
+    """Выполняет letters сценариев в concurrency потоках и собирает задержки этапов"""
+
+    def __init__(self, letters, concurrency, workers=2, response_style=1, analysis_timeout=120.0,
+                 poll_interval=0.2, seed=None, progress=None):
+        self.letters = letters
+        self.concurrency = concurrency
+        self.workers = workers
+        self.response_style = response_style
+        self.analysis_timeout = analysis_timeout
+        self.poll_interval = poll_interval
+        self.rng = random.Random(seed)
+        self.progress = progress
+        self.report = BenchmarkReport(concurrency=concurrency, letters=letters)
+        self._next_index = 0
+        self._finished = 0
+        self._index_lock = threading.Lock()
+        # Тексты готовятся заранее: генерация не входит в замеры
+        self._letters = [make_letter_fields(self.rng) for _ in range(letters)]
+
+    def run(self):
+        stop_event, processes = self._start_workers()
+        started = time.perf_counter()
+        try:
+            threads = [
+                threading.Thread(target=self._client_loop, name=f'benchmark-client-{i + 1}', daemon=True)
+                for i in range(self.concurrency)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            self.report.elapsed = time.perf_counter() - started
+            stop_event.set()
+            for process in processes:
+                process.join(timeout=30)
+                if process.is_alive():
+                    process.terminate()
+        return self.report
+
+    def _start_workers(self):
+        ctx = multiprocessing.get_context('fork')
+        stop_event = ctx.Event()
+        if not self.workers:
+            # Письма анализируют уже запущенные run_analysis_workers
+            return stop_event, []
+        # Дочерние процессы не должны наследовать открытые соединения с БД
+        connections.close_all()
+        processes = [
+            ctx.Process(target=_analysis_worker, args=(stop_event, min(self.poll_interval, 1.0)),
+                        name=f'benchmark-analysis-worker-{i + 1}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+        return stop_event, processes
+
+    def _take_index(self):
+        with self._index_lock:
+            if self._next_index >= self.letters:
+                return None
+            index = self._next_index
+            self._next_index += 1
+            return index
+
+    def _client_loop(self):
+        client = Client()
+        try:
+            while True:
+                index = self._take_index()
+                if index is None:
+                    break
+                self._run_pipeline(client, index)
+                with self._index_lock:
+                    self._finished += 1
+                    finished = self._finished
+                if self.progress:
+                    self.progress(finished)
+        finally:
+            connections.close_all()
+
+    def _run_pipeline(self, client, index):
+        started = time.perf_counter()
+        try:
+            letter_id = self._upload(client, index)
+            self._stage(client.get, 'analyze', reverse('analyze_letter', args=[letter_id]), (200, 302))
+            self._wait_analysis(client, letter_id)
+            self._stage(client.post, 'generate_responses', reverse('generate_responses', args=[letter_id]), (302,),
+                        {'generate_responses': '1', 'response_style': str(self.response_style)})
+            self._stage(client.post, 'ask_question', reverse('ask_question', args=[letter_id]), (302,),
+                        {'question': self.rng.choice(QUESTIONS)})
+        except StageError:
+            # Ошибка учтена на своем этапе, сценарий для письма прерывается
+            return
+        except Exception as e:
+            self.report.record_error('pipeline', repr(e))
+            return
+        self.report.record('pipeline', time.perf_counter() - started)
+
+    def _stage(self, method, stage, url, expected_statuses, data=None):
+        started = time.perf_counter()
+        try:
+            response = method(url, data) if data is not None else method(url)
+        except Exception as e:
+            self.report.record_error(stage, repr(e))
+            raise StageError(stage)
+        elapsed = time.perf_counter() - started
+        if response.status_code not in expected_statuses:
+            # Представления показывают ошибку LLM на той же странице (код 200 вместо перенаправления)
+            self.report.record_error(stage, f"HTTP {response.status_code} {url}")
+            raise StageError(stage)
+        self.report.record(stage, elapsed)
+        return response
+
+    def _upload(self, client, index):
+        fields = dict(self._letters[index])
+        fields['subject'] = BENCHMARK_SUBJECT_PREFIX + fields['subject']
+        response = self._stage(client.post, 'upload', reverse('upload_letter'), (302,), fields)
+        return resolve(response.url).kwargs['letter_id']
+
+    def _wait_analysis(self, client, letter_id):
+        """Опрашивает статус письма, как страница ожидания анализа"""
+        url = reverse('letter_status', args=[letter_id])
+        started = time.perf_counter()
+        while True:
+            data = client.get(url).json()
+            if data.get('analyzed'):
+                self.report.record('analysis_wait', time.perf_counter() - started)
+                return
+            if data.get('job_status') == 'failed':
+                self.report.record_error('analysis_wait', data.get('job_error') or 'анализ завершился ошибкой')
+                raise StageError('analysis_wait')
+            if time.perf_counter() - started > self.analysis_timeout:
+                self.report.record_error('analysis_wait', f"письмо {letter_id} не проанализировано за "
+                                                          f"{self.analysis_timeout:g} с")
+                raise StageError('analysis_wait')
+            time.sleep(self.poll_interval)
+
+
+def delete_benchmark_letters():
+    """Удаляет письма, созданные бенчмарком (с результатами, ответами и вопросами)"""
+    deleted = 0
+    for letter in Letter.objects.filter(subject__startswith=BENCHMARK_SUBJECT_PREFIX).iterator():
+        letter.delete()
+        deleted += 1
+    return deleted
@@ -0,0 +1,334 @@
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import zlib
+from collections import Counter
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
+
+from .response_processor import ResponseProcessor
+from .text_utils import analyze_terms
+
+logger = logging.getLogger(__name__)
+
+# Признаки - хешированные основы слов и пары соседних основ
+HASHED_FEATURES = 1 << 18
+# Сглаживание Лапласа для наивного байесовского классификатора
+SMOOTHING = 0.5
+# Поля анализа, которые предсказывает модель
+TARGET_FIELDS = ('classification', 'criticality_level', 'response_style')
+# Температуры, среди которых выбирается калибровка уверенности
+CALIBRATION_TEMPERATURES = (1, 2, 4, 8, 16, 32, 64, 128)
+MODEL_FORMAT = 1
+
+# Правила для очевидных писем: автоуведомления и рассылки не требуют срочного ответа.
+# Правило задает критичность и стиль; категорию по-прежнему определяет модель.
+KEYWORD_RULES = (
+    (re.compile(r'не\s+отвечайте\s+на\s+(это|данное)\s+(письмо|сообщение)', re.IGNORECASE),
+     {'criticality_level': 1, 'response_style': 4}),
+    (re.compile(r'\bno-?reply\b|\bdo\s+not\s+reply\b', re.IGNORECASE),
+     {'criticality_level': 1, 'response_style': 4}),
+    (re.compile(r'сообщение\s+(сформировано|отправлено)\s+автоматически|автоматическ\w+\s+уведомлени', re.IGNORECASE),
+     {'criticality_level': 1, 'response_style': 4}),
+    (re.compile(r'отписаться\s+от\s+рассылки|\bunsubscribe\b', re.IGNORECASE),
+     {'criticality_level': 1, 'response_style': 4}),
+)
+
+SUMMARY_MAX_CHARS = 300
+
+
+def _feature_id(term):
+    return zlib.crc32(term.encode('utf-8')) % HASHED_FEATURES
+
+
+def extract_features(text):
+    """Разреженный вектор признаков {номер признака: вес}"""
+    terms = analyze_terms(text)
+    counts = Counter(_feature_id(term) for term in terms)
+    counts.update(_feature_id(f"{left} {right}") for left, right in zip(terms, terms[1:]))
+    # Логарифм частоты: повторы одного слова не должны перевешивать весь текст
+    return {feature: 1.0 + math.log(count) for feature, count in counts.items()}
+
+
+def _softmax(scores, temperature):
+    top = max(scores)
+    exps = [math.exp((score - top) / temperature) for score in scores]
+    total = sum(exps)
+    return [value / total for value in exps]
+
+
+class NaiveBayesHead:
+    """Мультиномиальный наивный Байес для одного поля анализа.
+
+    Хранятся только признаки, встретившиеся при обучении: для остальных
+    используется сглаженная вероятность по умолчанию (default) каждого класса.
+    """
+
+    def __init__(self, classes, log_prior, default, weights, temperature=1.0):
+        self.classes = classes
+        self.log_prior = log_prior
+        self.default = default
+        self.weights = weights
+        self.temperature = temperature
+
+    @classmethod
+    def train(cls, vectors, labels):
+        classes = sorted(set(labels))
+        index = {label: i for i, label in enumerate(classes)}
+        class_counts = Counter(labels)
+        feature_counts = [Counter() for _ in classes]
+        for vector, label in zip(vectors, labels):
+            feature_counts[index[label]].update(vector)
+
+        vocabulary = set().union(*feature_counts) if feature_counts else set()
+        totals = [sum(counts.values()) + SMOOTHING * len(vocabulary) for counts in feature_counts]
+        default = [math.log(SMOOTHING / total) for total in totals]
+        weights = {
+            feature: [math.log((counts.get(feature, 0) + SMOOTHING) / total)
+                      for counts, total in zip(feature_counts, totals)]
+            for feature in vocabulary
+        }
+        log_prior = [math.log(class_counts[label] / len(labels)) for label in classes]
+        return cls(classes, log_prior, default, weights)
+
+    def scores(self, vector):
+        scores = list(self.log_prior)
+        for feature, value in vector.items():
+            feature_weights = self.weights.get(feature, self.default)
+            for i, weight in enumerate(feature_weights):
+                scores[i] += value * weight
+        return scores
+
+    def predict(self, vector):
+        """(класс, уверенность) - уверенность после калибровки температурой"""
+        probabilities = _softmax(self.scores(vector), self.temperature)
+        best = max(range(len(self.classes)), key=probabilities.__getitem__)
+        return self.classes[best], probabilities[best]
+
+    def calibrate(self, vectors, labels):
+        """Подбирает температуру по отложенной выборке (минимум логарифмической ошибки).
+
+        Наивный Байес сильно переоценивает уверенность; без калибровки порог
+        уверенности не имел бы смысла.
+        """
+        index = {label: i for i, label in enumerate(self.classes)}
+        scored = [(self.scores(vector), index.get(label)) for vector, label in zip(vectors, labels)]
+
+        def log_loss(temperature):
+            loss = 0.0
+            for scores, target in scored:
+                probability = _softmax(scores, temperature)[target] if target is not None else 0.0
+                loss -= math.log(max(probability, 1e-12))
+            return loss
+
+        self.temperature = min(CALIBRATION_TEMPERATURES, key=log_loss)
+        return self.temperature
+
+    def to_dict(self):
+        return {
+            'classes': self.classes,
+            'log_prior': self.log_prior,
+            'default': self.default,
+            'temperature': self.temperature,
+            # Ключи JSON - строки; веса округляются, чтобы файл модели был компактнее
+            'weights': {str(feature): [round(w, 4) for w in values] for feature, values in self.weights.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            classes=data['classes'],
+            log_prior=data['log_prior'],
+            default=data['default'],
+            weights={int(feature): values for feature, values in data['weights'].items()},
+            temperature=data['temperature'],
+        )
+
+
+@dataclass
+class Prediction:
+    """Предсказание предклассификатора: значения полей и уверенность по каждому"""
+    values: dict
+    confidence: dict
+    rule_matched: bool = False
+
+    @property
+    def min_confidence(self):
+        return min(self.confidence.values())
+
+
+class PreClassifier:
+    """Локальный классификатор перед LLM.
+
+    Обучается командой train_preclassifier на результатах анализа нейросетью
+    (AnalysisResult.analysis_data). Если уверенность по категории, критичности
+    и стилю не ниже порога PRECLASSIFIER_THRESHOLD, анализ выполняется без LLM.
+    """
+
+    def __init__(self, model_path=None, threshold=None):
+        self.model_path = Path(model_path or os.getenv('PRECLASSIFIER_MODEL_PATH', '.preclassifier/model.json'))
+        self.threshold = float(threshold or os.getenv('PRECLASSIFIER_THRESHOLD', 0.95))
+        self.enabled = os.getenv('PRECLASSIFIER_ENABLED', 'true').lower() == 'true'
+        self.processor = ResponseProcessor()
+        self._model = None
+        self._model_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        """Модель с диска; перечитывается, если файл переобучили"""
+        try:
+            mtime = self.model_path.stat().st_mtime
+        except OSError:
+            return None
+        if self._model is None or mtime != self._model_mtime:
+            with self._lock:
+                if self._model is None or mtime != self._model_mtime:
+                    try:
+                        self._model = self._load()
+                        logger.info("Загружена модель предклассификатора %s", self.model_path)
+                    except (ValueError, KeyError, OSError) as e:
+                        logger.warning("Не удалось загрузить модель предклассификатора %s: %s", self.model_path, e)
+                        self._model = None
+                    self._model_mtime = mtime
+        return self._model
+
+    def _load(self):
+        with open(self.model_path, encoding='utf-8') as file:
+            data = json.load(file)
+        if data.get('format') != MODEL_FORMAT:
+            raise ValueError(f"неизвестный формат модели {data.get('format')}")
+        return {
+            'category_ids': set(data['category_ids']),
+            'heads': {field: NaiveBayesHead.from_dict(head) for field, head in data['heads'].items()},
+        }
+
+    def predict(self, text):
+        """Prediction для текста письма или None, если модели нет"""
+        model = self.model
+        if model is None:
+            return None
+
+        vector = extract_features(text)
+        values, confidence = {}, {}
+        for field, head in model['heads'].items():
+            values[field], confidence[field] = head.predict(vector)
+
+        rule_matched = False
+        for pattern, overrides in KEYWORD_RULES:
+            if pattern.search(text):
+                for field, value in overrides.items():
+                    values[field], confidence[field] = value, 1.0
+                rule_matched = True
+                break
+
+        return Prediction(values=values, confidence=confidence, rule_matched=rule_matched)
+
+    def classify(self, text, categories):
+        """Результат анализа в формате ResponseProcessor или None - тогда нужен LLM"""
+        if not self.enabled:
+            return None
+
+        prediction = self.predict(text)
+        if prediction is None or prediction.min_confidence < self.threshold:
+            return None
+
+        # Модель обучена на другом наборе категорий - ее категориям доверять нельзя
+        category_ids = {category['id'] for category in categories}
+        if prediction.values['classification'] not in category_ids or category_ids != self.model['category_ids']:
+            return None
+
+        parsed = SimpleNamespace(
+            topic_category=prediction.values['classification'],
+            criticality_level=prediction.values['criticality_level'],
+            response_style=prediction.values['response_style'],
+            summary=summarize_text(text),
+        )
+        result = self.processor.process_analysis_response(parsed, categories)
+        result['source'] = 'preclassifier'
+        result['confidence'] = round(prediction.min_confidence, 4)
+        logger.info("Письмо классифицировано локально (уверенность %s%s)",
+                    result['confidence'], ', сработало правило' if prediction.rule_matched else '')
+        return result
+
+
+def summarize_text(text):
+    """Краткое содержание без LLM: начало текста письма"""
+    body = text.split('ТЕКСТ ПИСЬМА:', 1)[-1]
+    body = re.sub(r'\s+', ' ', body).strip()
+    if len(body) > SUMMARY_MAX_CHARS:
+        body = body[:SUMMARY_MAX_CHARS].rsplit(' ', 1)[0] + '…'
+    return body or 'Письмо классифицировано автоматически.'
+
+
+def train_model(examples, category_ids, holdout=0.2, threshold=0.95, seed=42):
+    """Обучает модель на примерах [(текст, {поле: значение})] и возвращает (модель, отчет).
+
+    Температура каждого поля подбирается на отложенной части, затем модель
+    переобучается на всех примерах с найденной температурой.
+    """
+    examples = list(examples)
+    random.Random(seed).shuffle(examples)
+    vectors = [extract_features(text) for text, _ in examples]
+
+    split = int(len(examples) * (1 - holdout))
+    report = {'examples': len(examples), 'holdout': len(examples) - split, 'fields': {}}
+
+    heads = {}
+    for field in TARGET_FIELDS:
+        labels = [values[field] for _, values in examples]
+        head = NaiveBayesHead.train(vectors[:split], labels[:split])
+        temperature = head.calibrate(vectors[split:], labels[split:]) if split < len(examples) else 1.0
+        accuracy = (
+            sum(head.predict(vector)[0] == label for vector, label in zip(vectors[split:], labels[split:]))
+            / max(1, len(examples) - split)
+        )
+        report['fields'][field] = {'accuracy': accuracy, 'temperature': temperature}
+
+        final = NaiveBayesHead.train(vectors, labels)
+        final.temperature = temperature
+        heads[field] = (head, final)
+
+    # Доля писем, которые модель берет на себя при пороге, и точность на них
+    covered = correct = 0
+    for vector, (_, values) in zip(vectors[split:], examples[split:]):
+        predictions = {field: heads[field][0].predict(vector) for field in TARGET_FIELDS}
+        if min(confidence for _, confidence in predictions.values()) >= threshold:
+            covered += 1
+            correct += all(predictions[field][0] == values[field] for field in TARGET_FIELDS)
+    report['coverage'] = covered / max(1, len(examples) - split)
+    report['precision'] = correct / covered if covered else None
+
+    model = {
+        'format': MODEL_FORMAT,
+        'category_ids': sorted(category_ids),
+        'heads': {field: final.to_dict() for field, (_, final) in heads.items()},
+    }
+    return model, report
+
+
+def save_model(model, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(model, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+_preclassifier = None
+_preclassifier_lock = threading.Lock()
+
+
+def get_preclassifier():
+    global _preclassifier
+    if _preclassifier is None:
+        with _preclassifier_lock:
+            if _preclassifier is None:
+                _preclassifier = PreClassifier()
+    return _preclassifier
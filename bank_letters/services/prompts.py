@@ -1,3 +1,12 @@
+import hashlib
+from dataclasses import dataclass
+from functools import lru_cache
+
+# Версия раскладки промптов: как к неизменным инструкциям добавляются контекст RAG,
+# письмо и указания. Увеличивается при изменении этой раскладки; изменения текста
+# инструкций учитываются в версии промпта автоматически (по хешу текста)
+PROMPT_LAYOUT_VERSION = '2'
+
 EMAIL_ANALYSIS_PROMPT = '''Ты - аналитик службы поддержки банка. Проанализируй электронного письма пользователя и верни структурированные данные.
 - Классификация темы по категориям.
 1. ЗАПРОС ИНФОРМАЦИИ/ДОКУМЕНТОВ.
@@ -172,6 +181,48 @@ EMAIL_GENERATION_PROMPTS = {
 '''
 }
 
+# Инструкции ответа на вопрос о письме. Письмо и вопрос передаются во входных данных,
+# поэтому инструкции одинаковы для всех запросов
+TEXT_GENERATION_PROMPT = '''Тебе нужно сгенерировать ответ, чтобы помочь пользователю. Тебе нужно отвечать кратко и лаконично, но при этому упоминать все важные детали. Во входных данных приведены вопрос пользователя (что он хочет сделать) и текст письма, полученного по электронной почте: пользователь хочет сделать это, чтобы ответить на письмо.'''
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    """Неизменный текст инструкций и его версия (для ключей кэша и метрик)"""
+    name: str
+    text: str
+    version: str
+
+
+def compile_prompt(name, text):
+    """Версия - имя и хеш текста: одинаковый текст дает одинаковую версию во всех процессах"""
+    digest = hashlib.sha256(f"{PROMPT_LAYOUT_VERSION}\x1f{text}".encode('utf-8')).hexdigest()[:12]
+    return CompiledPrompt(name=name, text=text, version=f"{name}-{digest}")
+
+
+@lru_cache(maxsize=32)
+def _compile_analysis_prompt(categories_key):
+    categories = [{'id': number, 'name': name, 'description': description} for number, name, description in categories_key]
+    return compile_prompt('analyze', make_analyze_email_prompt(categories))
+
+
+def get_analysis_prompt(categories):
+    """Инструкции анализа для набора категорий: строятся один раз на набор.
+
+    Контекст RAG и письмо в инструкции не входят, поэтому длинный префикс
+    запроса побайтно совпадает у всех писем и кэшируется провайдером.
+    """
+    return _compile_analysis_prompt(tuple(
+        (category.get('id'), category.get('name'), category.get('description')) for category in categories
+    ))
+
+
+RESPONSE_PROMPTS = {
+    style: compile_prompt(f'generate-{style}', text) for style, text in EMAIL_GENERATION_PROMPTS.items()
+}
+TEXT_PROMPT = compile_prompt('text', TEXT_GENERATION_PROMPT)
+
+
 def make_analyze_email_prompt(categories):
     strs = []
     strs.append('''Ты - электронный помошник. Проанализируй текст электронного письма пользователя и верни структурированные данные.
@@ -210,10 +261,3 @@ def make_analyze_email_prompt(categories):
     написать краткое содерждание письма, со всеми ключевыми моментами, не больше 300 символов.
 В ответе не используй длинные тире и служебные символы!''')
     return ''.join(strs)
-
-def make_generate_text_prompt(email, user_action):
-    return f'''Тебе нужно сгенерировать ответ, чтобы помочь пользователю. Тебе нужно отвечать кратко и лаконично, но при этому упоминать все важные детали. Пользователь хочет сделать следующее: {user_action}.
-Для контекста он хочет сделать это, чтобы ответить на сообщение по электронной почте: {email}.'''
-
-
-
@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд можно не перечитывать поколение кэша (маркер или общий кэш)
+GENERATION_CHECK_INTERVAL = 1.0
+
+
+def normalize_query(query):
+    return re.sub(r'\s+', ' ', query or '').strip().casefold()
+
+
+class RagSearchCache:
+    """LRU кэш результатов RAG поиска с ограничением по записям, байтам и времени жизни.
+
+    Значение - строка JSON со списком найденных фрагментов (RetrievedChunk: текст, оценка,
+    источник), ее пишет и разбирает LLMClient (_store_chunks / _cached_chunks); контекст для
+    промпта собирается из фрагментов после чтения, поэтому кэш не зависит от его бюджета.
+
+    Кэшируется только поиск по удаленному векторному хранилищу (локальный BM25 быстрее кэша).
+    Ключ: (ID векторного хранилища, нормализованный запрос, max_results) и поколение содержимого
+    хранилища. Поколение меняется при загрузке файлов (invalidate) и хранится в файле-маркере,
+    а при наличии общего кэша Django (RAG_CACHE_ALIAS) - еще и в нем, поэтому сброс видят
+    все процессы и узлы.
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None, ttl_seconds=None,
+                 shared_alias=None, marker_path=None, enabled=None):
+        if enabled is None:
+            enabled = os.getenv('RAG_CACHE_ENABLED', 'true').lower() == 'true'
+        self.enabled = enabled
+        self.max_entries = max_entries or int(os.getenv('RAG_CACHE_MAX_ENTRIES', 1000))
+        self.max_bytes = max_bytes or int(os.getenv('RAG_CACHE_MAX_BYTES', 20 * 1024 * 1024))
+        self.ttl_seconds = ttl_seconds or int(os.getenv('RAG_CACHE_TTL_SECONDS', 3600))
+        self.shared_alias = shared_alias if shared_alias is not None else os.getenv('RAG_CACHE_ALIAS')
+        self.marker_path = Path(marker_path or os.getenv('RAG_CACHE_MARKER', '.rag_cache_generation'))
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size_bytes = 0
+        self._generation = None
+        self._generation_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    # Поколение содержимого хранилища
+
+    def _shared_cache(self):
+        if not self.shared_alias:
+            return None
+        try:
+            from django.core.cache import caches
+            return caches[self.shared_alias]
+        except Exception as e:
+            logger.warning("Общий кэш RAG недоступен: %s", e)
+            return None
+
+    def _read_generation(self):
+        shared = self._shared_cache()
+        if shared is not None:
+            generation = shared.get('rag_cache:generation')
+            if generation:
+                return generation
+        try:
+            return self.marker_path.read_text().strip() or 'initial'
+        except OSError:
+            return 'initial'
+
+    def _current_generation(self):
+        now = time.monotonic()
+        if self._generation is None or now - self._generation_checked_at > GENERATION_CHECK_INTERVAL:
+            generation = self._read_generation()
+            with self._lock:
+                if generation != self._generation:
+                    # Содержимое хранилища изменилось - локальные записи больше не нужны
+                    self._entries.clear()
+                    self._size_bytes = 0
+                self._generation = generation
+                self._generation_checked_at = now
+        return self._generation
+
+    def invalidate(self):
+        """Сбрасывает кэш во всех процессах: вызывается при изменении содержимого хранилища"""
+        generation = uuid.uuid4().hex
+        try:
+            self.marker_path.write_text(generation)
+        except OSError as e:
+            logger.warning("Не удалось записать маркер кэша RAG %s: %s", self.marker_path, e)
+
+        shared = self._shared_cache()
+        if shared is not None:
+            shared.set('rag_cache:generation', generation, timeout=None)
+
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+            self._generation = generation
+            self._generation_checked_at = time.monotonic()
+
+    # Чтение и запись
+
+    def _make_key(self, vector_store_id, query, max_results):
+        query_hash = hashlib.sha256(normalize_query(query).encode('utf-8')).hexdigest()
+        return f"rag_cache:{self._current_generation()}:{vector_store_id}:{max_results}:{query_hash}"
+
+    def get(self, vector_store_id, query, max_results):
+        """Возвращает JSON найденных фрагментов или None, если его нет в кэше"""
+        if not self.enabled:
+            return None
+
+        key = self._make_key(vector_store_id, query, max_results)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value, size = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+                self._size_bytes -= size
+
+        shared = self._shared_cache()
+        if shared is not None:
+            value = shared.get(key)
+            if value is not None:
+                self._store_local(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, vector_store_id, query, max_results, value):
+        if not self.enabled:
+            return
+
+        key = self._make_key(vector_store_id, query, max_results)
+        self._store_local(key, value)
+
+        shared = self._shared_cache()
+        if shared is not None:
+            shared.set(key, value, timeout=self.ttl_seconds)
+
+    def _store_local(self, key, value):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size_bytes -= previous[2]
+
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value, size)
+            self._size_bytes += size
+
+            # Вытесняем самые давно использованные записи
+            while len(self._entries) > self.max_entries or self._size_bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._size_bytes -= evicted_size
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'size_bytes': self._size_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_rag_cache = None
+_rag_cache_lock = threading.Lock()
+
+
+def get_rag_cache():
+    """Кэш RAG поиска, общий для всех клиентов LLM в процессе"""
+    global _rag_cache
+    if _rag_cache is None:
+        with _rag_cache_lock:
+            if _rag_cache is None:
+                _rag_cache = RagSearchCache()
+    return _rag_cache
@@ -0,0 +1,63 @@
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class RagManifest:
+    """Локальный манифест векторных хранилищ: ID хранилища и загруженные в него файлы.
+
+    Позволяет не запрашивать список хранилищ у API при каждом запуске процесса.
+    Записи различаются адресом API, каталогом (folder_id) и именем хранилища.
+    """
+
+    def __init__(self, path=None):
+        self.path = Path(path or os.getenv('RAG_MANIFEST_PATH', '.rag_manifest.json'))
+
+    @staticmethod
+    def make_key(api_url, folder_id, vector_store_name):
+        return f"{api_url}|{folder_id}|{vector_store_name}"
+
+    def load(self):
+        try:
+            data = json.loads(self.path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return {'stores': {}}
+        except (OSError, ValueError) as e:
+            logger.warning("Не удалось прочитать манифест RAG %s: %s", self.path, e)
+            return {'stores': {}}
+        data.setdefault('stores', {})
+        return data
+
+    def get_store(self, key):
+        return self.load()['stores'].get(key)
+
+    def save_store(self, key, vector_store_id, files=None):
+        """Записывает (или обновляет) запись хранилища; files - {имя файла: сведения}"""
+        data = self.load()
+        entry = data['stores'].get(key) or {}
+        if entry.get('vector_store_id') != vector_store_id:
+            entry = {}
+        entry['vector_store_id'] = vector_store_id
+        if files is not None:
+            entry['files'] = files
+        entry.setdefault('files', {})
+        entry['updated_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        data['stores'][key] = entry
+        self._write(data)
+        return entry
+
+    def forget_store(self, key):
+        data = self.load()
+        if data['stores'].pop(key, None) is not None:
+            self._write(data)
+
+    def _write(self, data):
+        # Запись через временный файл, чтобы параллельно стартующие процессы не прочитали половину
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, self.path)
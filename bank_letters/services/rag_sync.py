@@ -0,0 +1,219 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при хешировании файлов базы знаний
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass
+class SyncPlan:
+    """Что нужно сделать, чтобы хранилище совпало с папкой данных"""
+    added: list = field(default_factory=list)
+    changed: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    unchanged: list = field(default_factory=list)
+    # Текущее состояние локальных файлов: {путь: {'sha256', 'size'}}
+    local: dict = field(default_factory=dict)
+
+    @property
+    def has_changes(self):
+        return bool(self.added or self.changed or self.removed)
+
+
+@dataclass
+class SyncReport:
+    """Итог синхронизации базы знаний"""
+    added: list = field(default_factory=list)
+    updated: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    unchanged: int = 0
+    untracked_removed: int = 0
+    errors: list = field(default_factory=list)
+    dry_run: bool = False
+
+    def summary(self):
+        prefix = "План синхронизации" if self.dry_run else "Синхронизация базы знаний"
+        lines = [
+            f"{prefix}: добавлено {len(self.added)}, обновлено {len(self.updated)}, "
+            f"удалено {len(self.removed)}, без изменений {self.unchanged}, ошибок {len(self.errors)}"
+        ]
+        for sign, names in (('+', self.added), ('~', self.updated), ('-', self.removed)):
+            lines.extend(f"  {sign} {name}" for name in names)
+        if self.untracked_removed:
+            lines.append(f"  Удалено файлов хранилища, отсутствующих в манифесте: {self.untracked_removed}")
+        lines.extend(f"  ! {error}" for error in self.errors)
+        return "\n".join(lines)
+
+
+class KnowledgeBaseSync:
+    """Инкрементальная синхронизация txt файлов базы знаний с векторным хранилищем.
+
+    Манифест (RagManifest) хранит для каждого файла хеш содержимого и ID
+    загруженного файла. Загружаются только новые и измененные файлы, старые
+    версии и удаленные файлы отсоединяются от хранилища и удаляются. Загрузка
+    и удаление выполняются в ограниченном пуле потоков.
+    """
+
+    def __init__(self, llm_client, max_workers=None):
+        self.llm_client = llm_client
+        self.data_path = Path(llm_client.data_folder)
+        self.max_workers = max_workers or int(os.getenv('RAG_SYNC_THREADS', 8))
+
+    def _manifest_files(self):
+        entry = self.llm_client.rag_manifest.get_store(self.llm_client.rag_manifest_key) or {}
+        return dict(entry.get('files', {}))
+
+    def _local_files(self, executor):
+        paths = sorted(self.data_path.glob('**/*.txt'))
+        names = [path.relative_to(self.data_path).as_posix() for path in paths]
+        sizes = [path.stat().st_size for path in paths]
+        hashes = executor.map(file_sha256, paths)
+        return {
+            name: {'path': path, 'size': size, 'sha256': sha256}
+            for name, path, size, sha256 in zip(names, paths, sizes, hashes)
+            if size > 0
+        }
+
+    def plan(self, executor=None):
+        """Сравнивает папку данных с манифестом"""
+        if executor is None:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as own_executor:
+                return self.plan(own_executor)
+
+        local = self._local_files(executor)
+        tracked = self._manifest_files()
+
+        plan = SyncPlan(local=local)
+        for name, info in local.items():
+            previous = tracked.get(name)
+            if previous is None:
+                plan.added.append(name)
+            elif previous.get('sha256') != info['sha256']:
+                plan.changed.append(name)
+            else:
+                plan.unchanged.append(name)
+        plan.removed = sorted(set(tracked) - set(local))
+        return plan
+
+    def sync(self, dry_run=False, prune_untracked=False):
+        """Приводит хранилище в соответствие с папкой данных и возвращает SyncReport"""
+        vector_store_id = self.llm_client.vector_store_id
+        report = SyncReport(dry_run=dry_run)
+        if not vector_store_id:
+            report.errors.append("векторное хранилище недоступно")
+            return report
+
+        if not self.data_path.exists():
+            logger.warning("Папка %s не существует, создаем...", self.data_path)
+            self.data_path.mkdir(parents=True, exist_ok=True)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='rag-sync') as executor:
+            plan = self.plan(executor)
+            report.unchanged = len(plan.unchanged)
+
+            if dry_run:
+                report.added, report.updated, report.removed = plan.added, plan.changed, plan.removed
+                return report
+
+            tracked = self._manifest_files()
+
+            # Новые версии загружаются до удаления старых, чтобы поиск не оставался без документа
+            to_upload = plan.added + plan.changed
+            uploads = executor.map(lambda name: self._upload(vector_store_id, name, plan.local[name]), to_upload)
+            for name, (entry, error) in zip(to_upload, uploads):
+                if error:
+                    report.errors.append(f"{name}: {error}")
+                    continue
+                previous = tracked.get(name)
+                tracked[name] = entry
+                if previous is None:
+                    report.added.append(name)
+                else:
+                    report.updated.append(name)
+                    stale = previous.get('file_id')
+                    if stale:
+                        executor.submit(self._delete_remote, vector_store_id, stale, report)
+
+            removals = executor.map(
+                lambda name: self._delete_remote(vector_store_id, tracked[name].get('file_id'), report),
+                plan.removed
+            )
+            for name, deleted in zip(plan.removed, removals):
+                if deleted:
+                    tracked.pop(name, None)
+                    report.removed.append(name)
+
+            if prune_untracked:
+                report.untracked_removed = self._prune_untracked(vector_store_id, tracked, executor, report)
+
+        self.llm_client.rag_manifest.save_store(self.llm_client.rag_manifest_key, vector_store_id, files=tracked)
+
+        if report.added or report.updated or report.removed or report.untracked_removed:
+            # Содержимое хранилища изменилось - старые результаты поиска неактуальны
+            self.llm_client.rag_cache.invalidate()
+
+        return report
+
+    def _upload(self, vector_store_id, name, info):
+        """Загружает файл и добавляет его в хранилище; возвращает (запись манифеста, ошибка)"""
+        client = self.llm_client.client
+        try:
+            with open(info['path'], 'rb') as file:
+                oai_file = client.files.create(file=file, purpose="batch")
+            client.vector_stores.files.create(vector_store_id=vector_store_id, file_id=oai_file.id)
+        except Exception as e:
+            return None, str(e)
+
+        logger.info("Загружен: %s (ID файла: %s, размер: %s байт)", name, oai_file.id, info['size'])
+        return {
+            'file_id': oai_file.id,
+            'sha256': info['sha256'],
+            'size': info['size'],
+            'uploaded_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        }, None
+
+    def _delete_remote(self, vector_store_id, file_id, report):
+        """Отсоединяет файл от хранилища и удаляет его; уже удаленный файл не считается ошибкой"""
+        if not file_id:
+            return True
+
+        client = self.llm_client.client
+        for action in (
+            lambda: client.vector_stores.files.delete(file_id, vector_store_id=vector_store_id),
+            lambda: client.files.delete(file_id),
+        ):
+            try:
+                action()
+            except Exception as e:
+                if getattr(e, 'status_code', None) != 404:
+                    report.errors.append(f"удаление {file_id}: {e}")
+                    return False
+        return True
+
+    def _prune_untracked(self, vector_store_id, tracked, executor, report):
+        """Удаляет из хранилища файлы, которых нет в манифесте (дубли прежних загрузок)"""
+        known_ids = {entry.get('file_id') for entry in tracked.values()}
+        try:
+            remote_ids = [f.id for f in self.llm_client.client.vector_stores.files.list(vector_store_id=vector_store_id)]
+        except Exception as e:
+            report.errors.append(f"список файлов хранилища: {e}")
+            return 0
+
+        untracked = [file_id for file_id in remote_ids if file_id not in known_ids]
+        results = executor.map(lambda file_id: self._delete_remote(vector_store_id, file_id, report), untracked)
+        return sum(1 for deleted in results if deleted)
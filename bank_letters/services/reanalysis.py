@@ -0,0 +1,105 @@
+import logging
+import os
+
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from bank_letters.models import Letter, AnalysisJob, CategoryRegistryVersion
+
+logger = logging.getLogger(__name__)
+
+# Сколько задач повторного анализа держать в очереди одновременно: следующая порция
+# ставится, когда обработчики разобрали предыдущую, и новые письма не ждут весь переанализ
+REANALYSIS_CHUNK_SIZE = int(os.getenv('REANALYSIS_CHUNK_SIZE', 20))
+
+
+def _state():
+    return CategoryRegistryVersion.objects.filter(pk=1).first()
+
+
+def stale_letters(version):
+    """Проанализированные письма, версия категорий которых меньше version (Letter.stale_classification_q)"""
+    return Letter.objects.filter(Letter.stale_classification_q(version))
+
+
+def start_reanalysis():
+    """Запускает фоновый повторный анализ. Вызывается в транзакции смены категорий."""
+    CategoryRegistryVersion.objects.filter(pk=1).update(
+        reanalysis_active=True, reanalysis_started_at=timezone.now(), reanalysis_finished_at=None
+    )
+
+
+def stop_reanalysis():
+    """Останавливает постановку новых порций; поставленные задачи доработают"""
+    CategoryRegistryVersion.objects.filter(pk=1).update(reanalysis_active=False)
+
+
+def schedule_reanalysis(chunk_size=None):
+    """Ставит в очередь следующую порцию устаревших писем - первыми с ближайшим дедлайном.
+
+    Порция ставится, только если в очереди меньше chunk_size задач повторного анализа,
+    поэтому прерванный переанализ продолжается с того же места. Письма с активной
+    задачей и письма, анализ которых для этой версии завершился ошибкой, пропускаются.
+    Когда устаревших писем не осталось, переанализ отмечается завершенным.
+    Возвращает число поставленных задач.
+    """
+    chunk_size = chunk_size or REANALYSIS_CHUNK_SIZE
+    state = _state()
+    if state is None or not state.reanalysis_active:
+        return 0
+    version = state.version
+
+    queued = AnalysisJob.objects.filter(
+        status__in=AnalysisJob.ACTIVE_STATUSES, category_version__isnull=False
+    ).count()
+    if queued >= chunk_size:
+        return 0
+
+    blocked = AnalysisJob.objects.filter(letter=OuterRef('pk')).filter(
+        Q(status__in=AnalysisJob.ACTIVE_STATUSES) | Q(status='failed', category_version=version)
+    )
+    letter_ids = list(
+        stale_letters(version)
+        .filter(~Exists(blocked))
+        .order_by(F('sla_deadline').asc(nulls_last=True), 'id')
+        .values_list('id', flat=True)[:chunk_size - queued]
+    )
+
+    if not letter_ids:
+        if not queued:
+            finished = CategoryRegistryVersion.objects.filter(
+                pk=1, version=version, reanalysis_active=True
+            ).update(reanalysis_active=False, reanalysis_finished_at=timezone.now())
+            if finished:
+                logger.info("Повторный анализ писем для версии категорий %s завершен", version)
+        return 0
+
+    # Задачу того же письма мог параллельно поставить другой обработчик
+    AnalysisJob.objects.bulk_create(
+        [AnalysisJob(letter_id=letter_id, category_version=version) for letter_id in letter_ids],
+        ignore_conflicts=True,
+    )
+    logger.info("Поставлено на повторный анализ писем: %s (версия категорий %s)", len(letter_ids), version)
+    return len(letter_ids)
+
+
+def reanalysis_progress():
+    """Состояние повторного анализа для страницы настроек и команды reanalyze_letters"""
+    state = _state()
+    version = state.version if state else 0
+    analyzed = Letter.objects.exclude(status='new').count()
+    stale = stale_letters(version).count() if state and state.reanalysis_started_at else 0
+    return {
+        'version': version,
+        'active': bool(state and state.reanalysis_active),
+        'started_at': state.reanalysis_started_at if state else None,
+        'finished_at': state.reanalysis_finished_at if state else None,
+        'analyzed': analyzed,
+        'stale': stale,
+        'done': analyzed - stale,
+        'percent': round(100 * (analyzed - stale) / analyzed) if analyzed else 100,
+        'queued': AnalysisJob.objects.filter(
+            status__in=AnalysisJob.ACTIVE_STATUSES, category_version__isnull=False
+        ).count(),
+        'failed': AnalysisJob.objects.filter(status='failed', category_version=version).count(),
+    }
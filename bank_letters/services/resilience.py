@@ -0,0 +1,296 @@
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import openai
+
+from .metrics import LLM_REQUEST_SECONDS, LLM_REJECTED_REQUESTS, model_label
+
+logger = logging.getLogger(__name__)
+
+# Пробный запрос полуоткрытого предохранителя, выданный текущему потоку или задаче asyncio
+_probe_token = contextvars.ContextVar('llm_breaker_probe', default=None)
+
+
+class CircuitOpenError(Exception):
+    """Провайдер LLM недавно отказывал подряд - запрос не отправляется"""
+
+
+class DeadlineExceeded(Exception):
+    """Время, отведенное на запрос, исчерпано"""
+
+
+class Deadline:
+    """Общий срок запроса: все попытки и ожидания между ними должны в него уложиться"""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+
+def is_provider_failure(error):
+    """Ошибка говорит о недоступности провайдера (сеть, таймаут, 5xx, 429).
+
+    Ошибки запроса (4xx) и разбора ответа могут повторяться, но предохранитель
+    не открывают: провайдер при этом отвечает.
+    """
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500 or error.status_code == 408
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+def is_retryable(error):
+    if isinstance(error, openai.APIStatusError) and not is_provider_failure(error):
+        # Неверный запрос, ключ или модель - повтор даст тот же ответ
+        return error.status_code not in (400, 401, 403, 404, 422)
+    return True
+
+
+class LatencyTracker:
+    """Время последних успешных ответов; таймаут подстраивается под их процентиль"""
+
+    def __init__(self, window=200, min_samples=20):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, q):
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class CircuitBreaker:
+    """Предохранитель: после failure_threshold отказов подряд запросы отклоняются
+    reset_seconds, затем пропускается один пробный запрос (полуоткрытое состояние)."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # Пробный запрос в полуоткрытом состоянии и время его выдачи
+        self._probe = None
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probe = None
+            if (self.state == self.HALF_OPEN and self._probe is not None
+                    and now - self._probe_started_at >= self.reset_seconds):
+                # Результат пробного запроса так и не записан - пропускаем новый
+                self._probe = None
+            if self.state == self.HALF_OPEN and self._probe is None:
+                self._probe = object()
+                self._probe_started_at = now
+                _probe_token.set(self._probe)
+                return True
+            return False
+
+    def release_probe(self):
+        """Освобождает пробный запрос, завершившийся без результата (отмена, прерывание процесса).
+
+        Действует, только если пробный запрос выдан текущему потоку или задаче.
+        """
+        with self._lock:
+            if self._probe is not None and _probe_token.get() is self._probe:
+                self._probe = None
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Провайдер LLM снова отвечает, предохранитель закрыт")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.error("Провайдер LLM недоступен (%s отказов подряд), запросы отклоняются %s с",
+                                 self.failures, self.reset_seconds)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._probe = None
+
+
+class LLMResilience:
+    """Повторы, сроки и предохранитель для всех запросов к LLM в процессе.
+
+    Каждая операция (analyze, generate, text, ...) получает таймаут попытки из
+    процентиля наблюдаемого времени ответа, но не больше оставшегося срока
+    запроса. Между попытками - экспоненциальная задержка со случайным
+    разбросом (full jitter), чтобы процессы не повторяли запросы синхронно.
+    """
+
+    def __init__(self):
+        self.max_attempts = int(os.getenv('LLM_MAX_ATTEMPTS', 3))
+        self.deadline_seconds = float(os.getenv('LLM_REQUEST_DEADLINE_SECONDS', 45))
+        self.backoff_base = float(os.getenv('LLM_BACKOFF_BASE_SECONDS', 0.5))
+        self.backoff_max = float(os.getenv('LLM_BACKOFF_MAX_SECONDS', 8))
+        self.min_timeout = float(os.getenv('LLM_MIN_TIMEOUT_SECONDS', 3))
+        self.max_timeout = float(os.getenv('LLM_MAX_TIMEOUT_SECONDS', 30))
+        # Таймаут попытки - p95 времени ответа с запасом
+        self.timeout_factor = float(os.getenv('LLM_TIMEOUT_FACTOR', 2.0))
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv('LLM_BREAKER_FAILURES', 5)),
+            reset_seconds=float(os.getenv('LLM_BREAKER_RESET_SECONDS', 30)),
+        )
+        self._latency = {}
+        self._latency_lock = threading.Lock()
+
+    def new_deadline(self):
+        return Deadline(self.deadline_seconds)
+
+    def latency(self, operation):
+        with self._latency_lock:
+            return self._latency.setdefault(operation, LatencyTracker())
+
+    def attempt_timeout(self, operation, deadline, max_timeout=None):
+        """Таймаут очередной попытки; исключение, если запрос отправлять нельзя"""
+        remaining = deadline.remaining()
+        if remaining < self.min_timeout:
+            LLM_REJECTED_REQUESTS.inc(operation=operation, reason='deadline')
+            raise DeadlineExceeded(f"на запрос осталось {remaining:.1f} с")
+        if not self.breaker.allow():
+            LLM_REJECTED_REQUESTS.inc(operation=operation, reason='circuit_open')
+            raise CircuitOpenError("провайдер LLM временно недоступен")
+
+        timeout = max_timeout or self.max_timeout
+        p95 = self.latency(operation).percentile(0.95)
+        if p95 is not None:
+            timeout = min(timeout, max(self.min_timeout, p95 * self.timeout_factor))
+        return min(timeout, remaining)
+
+    def record_success(self, operation=None, seconds=None):
+        self.breaker.record_success()
+        if operation and seconds is not None:
+            self.latency(operation).record(seconds)
+
+    def record_failure(self, error):
+        if is_provider_failure(error):
+            self.breaker.record_failure()
+        else:
+            # Провайдер ответил (ошибка в запросе или в разборе ответа) - он доступен
+            self.breaker.record_success()
+
+    def release_probe(self):
+        self.breaker.release_probe()
+
+    def _backoff(self, attempt, deadline):
+        """Пауза перед следующей попыткой или None, если она не уложится в срок"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if deadline.remaining() - delay < self.min_timeout:
+            return None
+        return delay
+
+    def call(self, operation, request, deadline, max_attempts=None, max_timeout=None, model=None):
+        """Вызывает request(timeout) с повторами; возвращает результат или бросает последнюю ошибку.
+
+        model - для метки метрики времени запросов.
+        """
+        attempts = max_attempts or self.max_attempts
+        for attempt in range(attempts):
+            timeout = self.attempt_timeout(operation, deadline, max_timeout)
+            started = time.monotonic()
+            try:
+                result = request(timeout)
+            except Exception as e:
+                LLM_REQUEST_SECONDS.observe(
+                    time.monotonic() - started, model=model_label(model), operation=operation, outcome='error'
+                )
+                self.record_failure(e)
+                logger.warning("%s: попытка %s из %s не удалась: %s", operation, attempt + 1, attempts, e)
+                delay = self._backoff(attempt, deadline) if attempt + 1 < attempts and is_retryable(e) else None
+                if delay is None:
+                    raise
+                logger.info("%s: повтор через %.1f с", operation, delay)
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # Отмена (CancelledError, отключение клиента) или остановка процесса:
+                # ответ провайдера неизвестен, пробный запрос предохранителя освобождается
+                LLM_REQUEST_SECONDS.observe(
+                    time.monotonic() - started, model=model_label(model), operation=operation, outcome='cancelled'
+                )
+                self.release_probe()
+                raise
+            elapsed = time.monotonic() - started
+            LLM_REQUEST_SECONDS.observe(elapsed, model=model_label(model), operation=operation, outcome='success')
+            self.record_success(operation, elapsed)
+            return result
+
+    async def acall(self, operation, request, deadline, max_attempts=None, max_timeout=None, model=None):
+        """Асинхронный вариант call: request(timeout) возвращает корутину"""
+        attempts = max_attempts or self.max_attempts
+        for attempt in range(attempts):
+            timeout = self.attempt_timeout(operation, deadline, max_timeout)
+            started = time.monotonic()
+            try:
+                result = await request(timeout)
+            except Exception as e:
+                LLM_REQUEST_SECONDS.observe(
+                    time.monotonic() - started, model=model_label(model), operation=operation, outcome='error'
+                )
+                self.record_failure(e)
+                logger.warning("%s: попытка %s из %s не удалась: %s", operation, attempt + 1, attempts, e)
+                delay = self._backoff(attempt, deadline) if attempt + 1 < attempts and is_retryable(e) else None
+                if delay is None:
+                    raise
+                logger.info("%s: повтор через %.1f с", operation, delay)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Отмена (CancelledError, отключение клиента) или остановка процесса:
+                # ответ провайдера неизвестен, пробный запрос предохранителя освобождается
+                LLM_REQUEST_SECONDS.observe(
+                    time.monotonic() - started, model=model_label(model), operation=operation, outcome='cancelled'
+                )
+                self.release_probe()
+                raise
+            elapsed = time.monotonic() - started
+            LLM_REQUEST_SECONDS.observe(elapsed, model=model_label(model), operation=operation, outcome='success')
+            self.record_success(operation, elapsed)
+            return result
+
+
+_resilience = None
+_resilience_lock = threading.Lock()
+
+
+def get_llm_resilience():
+    """Общее для процесса состояние: предохранитель и статистика задержек"""
+    global _resilience
+    if _resilience is None:
+        with _resilience_lock:
+            if _resilience is None:
+                _resilience = LLMResilience()
+    return _resilience
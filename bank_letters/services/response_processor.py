@@ -1,4 +1,12 @@
 # response_processor.py - исправляем для работы с Pydantic моделью
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Краткое содержание ответа по умолчанию (анализ не выполнен)
+DEFAULT_SUMMARY = 'Автоматический анализ не выполнен. Требуется ручная обработка.'
+
+
 class ResponseProcessor:
     def process_analysis_response(self, parsed_response, categories):
         """Обрабатывает ответ анализа с учетом категорий"""
@@ -8,7 +16,7 @@ class ResponseProcessor:
         # print(f"Доступные категории: {categories}")
 
         if parsed_response is None:
-            print("ОШИБКА: parsed_response is None, используем ответ по умолчанию")
+            logger.warning("Ответ анализа не получен, используем ответ по умолчанию")
             return self._get_default_response(categories)
 
         try:
@@ -35,7 +43,7 @@ class ResponseProcessor:
             return result
 
         except Exception as e:
-            print(f"ОШИБКА при обработке ответа анализа: {e}")
+            logger.error("Ошибка при обработке ответа анализа: %s", e)
             import traceback
             traceback.print_exc()
             return self._get_default_response(categories)
@@ -96,7 +104,7 @@ class ResponseProcessor:
             return default_classification
 
         except Exception as e:
-            print(f"Ошибка при извлечении classification: {e}")
+            logger.warning("Ошибка при извлечении classification: %s", e)
             return categories[0]['id'] if categories else 1
 
     def _extract_criticality_level(self, parsed_response):
@@ -158,7 +166,7 @@ class ResponseProcessor:
             return 2  # По умолчанию деловой стиль
 
         except Exception as e:
-            print(f"Ошибка при извлечении response_style: {e}")
+            logger.warning("Ошибка при извлечении response_style: %s", e)
             return 2
 
 
@@ -171,7 +179,7 @@ class ResponseProcessor:
                 return str(summary) if summary else 'Не удалось сгенерировать краткое содержание.'
             return 'Не удалось сгенерировать краткое содержание.'
         except Exception as e:
-            print(f"Ошибка при извлечении summary: {e}")
+            logger.warning("Ошибка при извлечении summary: %s", e)
             return 'Не удалось сгенерировать краткое содержание.'
 
     def _get_default_response(self, categories):
@@ -190,7 +198,7 @@ class ResponseProcessor:
             'response_style': 2,
             'processing_time_hours': 24,
             'sla_deadline': default_deadline.strftime('%Y-%m-%d %H:%M:%S'),
-            'summary': 'Автоматический анализ не выполнен. Требуется ручная обработка.',
+            'summary': DEFAULT_SUMMARY,
         }
 
     def _extract_sla_deadline(self, parsed_response):
@@ -198,7 +206,7 @@ class ResponseProcessor:
         try:
             if hasattr(parsed_response, 'sla_deadline'):
                 deadline = parsed_response.sla_deadline
-                print(f"Найдено поле sla_deadline: {deadline}")
+                logger.debug("Найдено поле sla_deadline: %s", deadline)
                 if deadline and str(deadline).strip():
                     return str(deadline)
 
@@ -206,7 +214,7 @@ class ResponseProcessor:
             return self._calculate_sla_deadline(parsed_response)
 
         except Exception as e:
-            print(f"Ошибка при извлечении sla_deadline: {e}")
+            logger.warning("Ошибка при извлечении sla_deadline: %s", e)
             return self._calculate_sla_deadline(parsed_response)
 
     def _calculate_sla_deadline(self, parsed_response):
@@ -231,13 +239,13 @@ class ResponseProcessor:
             deadline = timezone.now() + timedelta(hours=hours_to_add)
             formatted_deadline = deadline.strftime('%Y-%m-%d %H:%M:%S')
 
-            print(
-                f"Рассчитан автоматический дедлайн: {formatted_deadline} (критичность: {criticality_level}, +{hours_to_add} часов)")
+            logger.debug("Рассчитан автоматический дедлайн: %s (критичность: %s, +%s часов)",
+                         formatted_deadline, criticality_level, hours_to_add)
 
             return formatted_deadline
 
         except Exception as e:
-            print(f"Ошибка при расчете дедлайна: {e}")
+            logger.warning("Ошибка при расчете дедлайна: %s", e)
             from django.utils import timezone
             from datetime import timedelta
             default_deadline = timezone.now() + timedelta(hours=24)
@@ -250,7 +258,7 @@ class ResponseProcessor:
 
             if hasattr(parsed_response, 'processing_time_hours'):
                 processing_time = parsed_response.processing_time_hours
-                print(f"Найдено поле processing_time_hours: {processing_time}")
+                logger.debug("Найдено поле processing_time_hours: %s", processing_time)
 
             # Если время обработки не указано или всегда 24, рассчитываем автоматически
             if not processing_time or processing_time == 24:
@@ -259,7 +267,7 @@ class ResponseProcessor:
             return int(processing_time)
 
         except Exception as e:
-            print(f"Ошибка при извлечении processing_time_hours: {e}")
+            logger.warning("Ошибка при извлечении processing_time_hours: %s", e)
             return self._calculate_processing_time(parsed_response)
 
     def _calculate_processing_time(self, parsed_response):
@@ -277,11 +285,11 @@ class ResponseProcessor:
             else:  # Критический (4)
                 processing_time = 4
 
-            print(
-                f"Рассчитано автоматическое время обработки: {processing_time} часов (критичность: {criticality_level})")
+            logger.debug("Рассчитано автоматическое время обработки: %s часов (критичность: %s)",
+                         processing_time, criticality_level)
 
             return processing_time
 
         except Exception as e:
-            print(f"Ошибка при расчете времени обработки: {e}")
+            logger.warning("Ошибка при расчете времени обработки: %s", e)
             return 24  # По умолчанию
\ No newline at end of file
@@ -0,0 +1,449 @@
+import hashlib
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+from array import array
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from operator import itemgetter
+from pathlib import Path
+
+from .text_utils import analyze_terms, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Начало раздела: "1. НАЗВАНИЕ" (подпункты вида "1.1." остаются внутри раздела)
+SECTION_RE = re.compile(r'^\s*\d+\.\s+\S')
+# Заголовок группы разделов: "ДЕБЕТОВЫЕ КАРТЫ:"
+GROUP_RE = re.compile(r'^[^a-zа-яё]+:\s*$')
+
+# Длинные разделы дробятся по абзацам, чтобы фрагмент помещался в контекст
+MAX_CHUNK_CHARS = 1500
+
+# Фрагмент в контексте промпта обрезается до этой длины
+MAX_CONTEXT_CHUNK_CHARS = 1000
+# Доля общих слов, начиная с которой фрагменты считаются пересекающимися
+OVERLAP_THRESHOLD = 0.8
+# Остаток бюджета, меньше которого фрагмент уже не обрезается, а отбрасывается
+MIN_CHUNK_REMAINDER = 200
+
+INDEX_MAGIC = b'BLBM25\x01\x00'
+INDEX_FORMAT_VERSION = 1
+
+
+@dataclass
+class RetrievedChunk:
+    """Найденный фрагмент базы знаний"""
+    text: str
+    score: float
+    source: str = ''
+
+
+class Retriever:
+    """Интерфейс поиска по базе знаний для RAG"""
+
+    # Имя источника, входит в ключ кэша RAG
+    namespace = ''
+    # Есть ли смысл кэшировать результаты (для локального индекса кэш медленнее поиска)
+    cacheable = True
+    # Поиск в процессе без сети: параллелить запросы по потокам нет смысла
+    local = False
+
+    def is_available(self):
+        return True
+
+    def search(self, query, max_results=5, timeout=None):
+        """Возвращает список RetrievedChunk, самые релевантные первыми"""
+        raise NotImplementedError
+
+    async def asearch(self, query, max_results=5, async_client=None, timeout=None):
+        """Асинхронный поиск; по умолчанию выполняется синхронно в текущем потоке"""
+        return self.search(query, max_results)
+
+
+class VectorStoreRetriever(Retriever):
+    """Поиск по удаленному векторному хранилищу клиента LLM"""
+
+    def __init__(self, llm_client):
+        self.llm_client = llm_client
+
+    @property
+    def namespace(self):
+        return self.llm_client.vector_store_id
+
+    def is_available(self):
+        return bool(self.llm_client.vector_store_id)
+
+    def search(self, query, max_results=5, timeout=None):
+        search_results = self.llm_client.client.vector_stores.search(
+            **self._search_params(query, max_results, timeout)
+        )
+        return self._to_chunks(search_results)
+
+    async def asearch(self, query, max_results=5, async_client=None, timeout=None):
+        search_results = await async_client.vector_stores.search(
+            **self._search_params(query, max_results, timeout)
+        )
+        return self._to_chunks(search_results)
+
+    def _search_params(self, query, max_results, timeout):
+        params = {
+            'vector_store_id': self.llm_client.vector_store_id,
+            'query': query,
+            'max_num_results': max_results,
+        }
+        # timeout=None в SDK означает "без ограничения", поэтому передаем только заданный
+        if timeout is not None:
+            params['timeout'] = timeout
+        return params
+
+    def _to_chunks(self, search_results):
+        chunks = []
+        for result in search_results.data:
+            # content - список частей {type, text}; текст фрагмента - их объединение
+            text = ''.join(part.text for part in result.content if part.type == 'text')
+            chunks.append(RetrievedChunk(text=text, score=result.score, source=result.filename))
+        return chunks
+
+
+def merge_chunks(chunk_lists, budget_chars):
+    """Объединяет результаты нескольких поисковых запросов в один контекст.
+
+    Оценки нормируются на лучшую оценку своего запроса (у разных запросов разный
+    масштаб), фрагменты сортируются по нормированной оценке, повторы и
+    фрагменты, почти целиком содержащиеся в уже выбранных, отбрасываются.
+    Набор заканчивается, когда исчерпан бюджет в символах.
+    """
+    candidates = []
+    for rank_list in chunk_lists:
+        best = max((chunk.score for chunk in rank_list), default=0) or 1
+        for position, chunk in enumerate(rank_list):
+            if chunk.text:
+                candidates.append((chunk.score / best, -position, chunk))
+    candidates.sort(key=lambda item: (item[0], item[1]), reverse=True)
+
+    selected = []
+    selected_words = []
+    remaining = budget_chars
+    for _, _, chunk in candidates:
+        words = set(tokenize(chunk.text))
+        if any(_overlaps(words, other) for other in selected_words):
+            continue
+
+        text = chunk.text
+        if len(text) > MAX_CONTEXT_CHUNK_CHARS:
+            text = text[:MAX_CONTEXT_CHUNK_CHARS] + "..."
+        if len(text) > remaining:
+            if remaining < MIN_CHUNK_REMAINDER:
+                break
+            text = text[:remaining] + "..."
+
+        selected.append(RetrievedChunk(text=text, score=chunk.score, source=chunk.source))
+        selected_words.append(words)
+        remaining -= len(text)
+        if remaining <= 0:
+            break
+
+    return selected
+
+
+def _overlaps(words, other):
+    """Один фрагмент почти целиком входит в другой (или они совпадают)"""
+    smaller = min(len(words), len(other))
+    if not smaller:
+        return not words and not other
+    return len(words & other) / smaller >= OVERLAP_THRESHOLD
+
+
+def split_into_chunks(text):
+    """Разбивает текстовый файл базы знаний на фрагменты по нумерованным разделам.
+
+    К каждому фрагменту добавляются заголовок файла и заголовок группы, чтобы
+    фрагмент был понятен без остального файла.
+    """
+    lines = text.splitlines()
+    title = next((line.strip() for line in lines if line.strip()), '')
+
+    chunks = []
+    group = ''
+    section = []
+
+    def flush():
+        body = '\n'.join(section).strip()
+        section.clear()
+        if not body or body == title:
+            return
+        header = '\n'.join(part for part in (title, group) if part)
+        for piece in _split_long(body):
+            chunks.append(f"{header}\n{piece}" if header else piece)
+
+    for line in lines:
+        stripped = line.strip()
+        if stripped == title and not chunks and not section:
+            continue
+        if GROUP_RE.match(stripped):
+            flush()
+            group = stripped
+            continue
+        if SECTION_RE.match(line):
+            flush()
+        section.append(line.rstrip())
+    flush()
+
+    return chunks
+
+
+def _split_long(body):
+    if len(body) <= MAX_CHUNK_CHARS:
+        return [body]
+
+    heading, _, rest = body.partition('\n')
+    pieces = []
+    current = heading
+    for paragraph in re.split(r'\n\s*\n', rest):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(current) + len(paragraph) > MAX_CHUNK_CHARS and current != heading:
+            pieces.append(current)
+            current = heading
+        current = f"{current}\n{paragraph}"
+    pieces.append(current)
+    return pieces
+
+
+def corpus_fingerprint(files):
+    """Отпечаток содержимого файлов базы знаний"""
+    digest = hashlib.sha256()
+    for file_path in files:
+        digest.update(file_path.name.encode('utf-8'))
+        digest.update(file_path.read_bytes())
+    return digest.hexdigest()
+
+
+class BM25Index:
+    """Инвертированный индекс BM25, загружаемый с диска через mmap.
+
+    Формат файла: магическая строка, длина заголовка, JSON заголовок (словарь
+    термов, длины документов, параметры), затем списки вхождений (пары
+    uint32 номер документа / частота) и тексты фрагментов в UTF-8.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, header_len = struct.unpack_from('<8sQ', self._mmap, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"Файл {self.path} не является индексом BM25")
+
+        header_start = struct.calcsize('<8sQ')
+        header = json.loads(self._mmap[header_start:header_start + header_len].decode('utf-8'))
+        if header['version'] != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемая версия индекса BM25: {header['version']}")
+
+        self.fingerprint = header['fingerprint']
+        self.k1 = header['k1']
+        self.b = header['b']
+        self.docs = header['docs']
+        self.terms = header['terms']
+
+        self._postings = memoryview(self._mmap)[header['postings_offset']:header['texts_offset']].cast('I')
+        self._texts_offset = header['texts_offset']
+
+        # Постоянная часть знаменателя BM25 для каждого документа
+        avgdl = header['avgdl'] or 1
+        self._norms = [self.k1 * (1 - self.b + self.b * doc[3] / avgdl) for doc in self.docs]
+        doc_count = len(self.docs)
+        self._idf = {
+            term: math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for term, (_, df) in self.terms.items()
+        }
+
+    def __len__(self):
+        return len(self.docs)
+
+    def text(self, doc_id):
+        _, offset, length, _ = self.docs[doc_id]
+        start = self._texts_offset + offset
+        return self._mmap[start:start + length].decode('utf-8')
+
+    def source(self, doc_id):
+        return self.docs[doc_id][0]
+
+    def search(self, query, max_results=5):
+        """Возвращает [(номер документа, оценка)] по убыванию оценки"""
+        k1 = self.k1
+        postings = self._postings
+        norms = self._norms
+        scores = defaultdict(float)
+
+        for term in set(analyze_terms(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            start, df = entry
+            weight = self._idf[term] * (k1 + 1)
+            for i in range(start * 2, (start + df) * 2, 2):
+                doc_id = postings[i]
+                tf = postings[i + 1]
+                scores[doc_id] += weight * tf / (tf + norms[doc_id])
+
+        return heapq.nlargest(max_results, scores.items(), key=itemgetter(1))
+
+    @classmethod
+    def build(cls, files, path, k1=1.5, b=0.75):
+        """Строит индекс по txt файлам и атомарно записывает его на диск"""
+        files = sorted(files)
+        docs = []
+        texts = bytearray()
+        term_postings = defaultdict(list)
+
+        for file_path in files:
+            content = file_path.read_text(encoding='utf-8')
+            for chunk in split_into_chunks(content):
+                doc_id = len(docs)
+                terms = analyze_terms(chunk)
+                for term, tf in Counter(terms).items():
+                    term_postings[term].append((doc_id, tf))
+
+                encoded = chunk.encode('utf-8')
+                docs.append([file_path.name, len(texts), len(encoded), len(terms)])
+                texts.extend(encoded)
+
+        postings = array('I')
+        term_entries = {}
+        for term in sorted(term_postings):
+            term_entries[term] = [len(postings) // 2, len(term_postings[term])]
+            for doc_id, tf in term_postings[term]:
+                postings.extend((doc_id, tf))
+
+        header = {
+            'version': INDEX_FORMAT_VERSION,
+            'fingerprint': corpus_fingerprint(files),
+            'k1': k1,
+            'b': b,
+            'avgdl': sum(doc[3] for doc in docs) / len(docs) if docs else 0,
+            'docs': docs,
+            'terms': term_entries,
+            'postings_offset': 0,
+            'texts_offset': 0,
+        }
+
+        # Смещения зависят от длины заголовка, поэтому он сериализуется до сходимости
+        prefix_len = struct.calcsize('<8sQ')
+        while True:
+            header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+            padding = (-(prefix_len + len(header_bytes))) % 4
+            postings_offset = prefix_len + len(header_bytes) + padding
+            texts_offset = postings_offset + len(postings) * postings.itemsize
+            if header['postings_offset'] == postings_offset and header['texts_offset'] == texts_offset:
+                break
+            header['postings_offset'] = postings_offset
+            header['texts_offset'] = texts_offset
+
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'wb') as file:
+            file.write(struct.pack('<8sQ', INDEX_MAGIC, len(header_bytes)))
+            file.write(header_bytes)
+            file.write(b'\x00' * padding)
+            file.write(postings.tobytes())
+            file.write(texts)
+        os.replace(tmp_path, path)
+
+        return len(docs), len(term_entries)
+
+
+class BM25Retriever(Retriever):
+    """Локальный поиск BM25 по txt файлам базы знаний без обращений к сети.
+
+    Индекс строится при первом использовании (или командой build_rag_index)
+    и перестраивается, если содержимое папки с данными изменилось.
+    """
+
+    cacheable = False
+    local = True
+
+    def __init__(self, data_folder='data_simple', index_path=None):
+        self.data_folder = Path(data_folder)
+        self.index_path = Path(index_path or os.getenv('RAG_INDEX_PATH', '.rag_index/bm25.idx'))
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _files(self):
+        if not self.data_folder.exists():
+            return []
+        return sorted(self.data_folder.glob('**/*.txt'))
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._load()
+        return self._index
+
+    def _load(self):
+        files = self._files()
+        fingerprint = corpus_fingerprint(files)
+
+        if self.index_path.exists():
+            try:
+                index = BM25Index(self.index_path)
+                if index.fingerprint == fingerprint:
+                    return index
+                logger.info("Содержимое %s изменилось, перестраиваем индекс BM25", self.data_folder)
+            except (ValueError, KeyError, OSError) as e:
+                logger.warning("Не удалось загрузить индекс BM25 %s: %s", self.index_path, e)
+
+        self.rebuild(files)
+        return BM25Index(self.index_path)
+
+    def rebuild(self, files=None):
+        """Перестраивает индекс на диске; загруженный индекс будет перечитан при следующем поиске"""
+        files = self._files() if files is None else files
+        doc_count, term_count = BM25Index.build(files, self.index_path)
+        logger.info("Индекс BM25 построен: %s фрагментов, %s термов (%s)", doc_count, term_count, self.index_path)
+        self._index = None
+        return doc_count, term_count
+
+    @property
+    def namespace(self):
+        return f"bm25:{self.index.fingerprint[:16]}"
+
+    def is_available(self):
+        try:
+            return len(self.index) > 0
+        except Exception as e:
+            logger.warning("Индекс BM25 недоступен: %s", e)
+            return False
+
+    def search(self, query, max_results=5, timeout=None):
+        index = self.index
+        return [
+            RetrievedChunk(text=index.text(doc_id), score=score, source=index.source(doc_id))
+            for doc_id, score in index.search(query, max_results)
+        ]
+
+
+RAG_BACKENDS = ('vector_store', 'bm25')
+
+
+def make_retriever(llm_client, backend=None):
+    """Создает поисковик по имени из RAG_BACKEND: vector_store (по умолчанию) или bm25"""
+    backend = backend or os.getenv('RAG_BACKEND', 'vector_store')
+    if backend not in RAG_BACKENDS:
+        logger.warning("Неизвестный RAG_BACKEND '%s', используем vector_store", backend)
+        backend = 'vector_store'
+    if backend == 'bm25':
+        return BM25Retriever(data_folder=llm_client.data_folder)
+    return VectorStoreRetriever(llm_client)
@@ -0,0 +1,273 @@
+"""Синтетические письма для нагрузочных тестов: правдоподобные отправители, темы и тексты,
+а также массовое создание писем с результатами анализа, ответами и вопросами"""
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from bank_letters.models import AnalysisResult, GeneratedResponse, Letter, LetterQuestion
+from bank_letters.services.category_registry import get_category_registry
+from bank_letters.services.letter_statistics import add_letters_to_counters, rebuild_letter_counters
+
+SENDER_NAMES = (
+    'Иванов Иван Иванович', 'Петрова Анна Сергеевна', 'Смирнов Алексей Викторович', 'Кузнецова Мария Олеговна',
+    'Попов Дмитрий Андреевич', 'Соколова Елена Павловна', 'Морозов Сергей Николаевич', 'Волкова Ольга Игоревна',
+)
+SENDER_COMPANIES = ('ООО "Ромашка"', 'АО "Северный порт"', 'ООО "ТехноСтрой"', 'ИП Сидоров', 'ПАО "Энергия"',
+                    'ООО "Агроинвест"', 'АО "Логистик-Центр"', 'ООО "Меридиан"')
+
+# Темы писем: тема, суть обращения, подробности
+TOPICS = (
+    ('Жалоба на списание комиссии', 'С моего счета №{account} списана комиссия {amount} руб., о которой меня не '
+     'предупреждали.', 'Прошу разобраться и вернуть списанные средства.'),
+    ('Запрос выписки по счету', 'Прошу предоставить выписку по счету №{account} за период с {date} по текущую дату.',
+     'Выписка нужна для предоставления в налоговую инспекцию.'),
+    ('Реструктуризация кредита', 'В связи с изменением финансового положения прошу рассмотреть реструктуризацию '
+     'кредитного договора №{contract}.', 'Остаток задолженности составляет {amount} руб.'),
+    ('Блокировка карты', 'Карта, привязанная к счету №{account}, заблокирована {date} без объяснения причин.',
+     'Прошу разблокировать карту или сообщить причину блокировки.'),
+    ('Запрос ЦБ о проверке операций', 'В рамках надзорной проверки прошу представить сведения по операциям клиента '
+     'по договору №{contract} на сумму {amount} руб.', 'Срок представления информации - 5 рабочих дней.'),
+    ('Открытие расчетного счета', 'Просим открыть расчетный счет для нашей организации и сообщить перечень '
+     'необходимых документов.', 'Планируемый оборот - около {amount} руб. в месяц.'),
+    ('Ошибочный перевод', 'Платеж на сумму {amount} руб. от {date} был отправлен по неверным реквизитам.',
+     'Прошу отозвать платеж по договору №{contract}.'),
+    ('Предложение о партнерстве', 'Предлагаем рассмотреть совместную программу для клиентов банка.',
+     'Готовы обсудить условия на встрече, ориентировочный бюджет {amount} руб.'),
+)
+GREETINGS = ('Добрый день!', 'Здравствуйте!', 'Уважаемые коллеги!', 'Уважаемый банк!')
+DETAILS = (
+    'Ранее я уже обращался в отделение, но вопрос не решен.',
+    'Копии документов прилагаю к письму.',
+    'Прошу ответить в письменной форме на адрес электронной почты отправителя.',
+    'Если потребуется дополнительная информация, готов ее предоставить.',
+    'Вопрос срочный, так как от него зависит исполнение обязательств перед контрагентами.',
+    'Обращение направлено повторно, первое осталось без ответа.',
+)
+CLOSINGS = ('С уважением,', 'Заранее благодарю,', 'С наилучшими пожеланиями,')
+QUESTIONS = (
+    'Какие документы нужно запросить у клиента?',
+    'В какой срок нужно ответить на письмо?',
+    'Какие риски для банка есть в этом обращении?',
+)
+
+
+def make_letter_fields(rng=None):
+    """Поля письма (sender, subject, original_text) со случайными реквизитами"""
+    rng = rng or random
+    subject, request, detail = rng.choice(TOPICS)
+    values = {
+        'account': ''.join(rng.choice('0123456789') for _ in range(20)),
+        'contract': f"{rng.randint(10, 99)}-{rng.randint(10000, 99999)}",
+        'amount': f"{rng.randint(1, 5000) * 100:,}".replace(',', ' '),
+        'date': f"{rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.{rng.randint(2023, 2025)}",
+    }
+    sender = rng.choice(SENDER_NAMES if rng.random() < 0.6 else SENDER_COMPANIES)
+    paragraphs = [rng.choice(GREETINGS), request.format(**values), detail.format(**values)]
+    paragraphs += rng.sample(DETAILS, rng.randint(0, 3))
+    paragraphs.append(f"{rng.choice(CLOSINGS)}\n{sender}")
+    return {
+        'sender': sender,
+        'subject': subject,
+        'original_text': '\n\n'.join(paragraphs),
+    }
+
+
+# Синтетические письма помечаются темой, чтобы их можно было удалить
+SYNTHETIC_SUBJECT_PREFIX = '[synthetic] '
+
+# Распределения значений: большинство писем уже закрыто, в работе - меньшая часть
+STATUS_WEIGHTS = (('new', 8), ('analyzed', 22), ('response_generated', 15), ('done', 40), ('archived', 15))
+CRITICALITY_WEIGHTS = ((1, 30), (2, 45), (3, 20), (4, 5))
+PROCESSING_HOURS_WEIGHTS = ((4, 10), (8, 15), (24, 35), (48, 20), (72, 15), (120, 5))
+# Письма в работе загружены недавно, закрытые - за весь период
+IN_WORK_MAX_AGE_DAYS = 14
+# Доля проанализированных писем с вопросами и с вариантами ответа без выбранного
+QUESTION_SHARE = 0.25
+DRAFT_RESPONSE_SHARE = 0.2
+
+RESPONSE_TEMPLATE = ("Уважаемый(ая) {sender}!\n\nБлагодарим за обращение по вопросу \"{subject}\". "
+                     "Ваше обращение рассмотрено, ответ подготовлен в соответствии с регламентом банка.\n\n"
+                     "С уважением,\nСлужба по работе с обращениями")
+
+
+def _weighted(rng, weights):
+    return rng.choices([value for value, _ in weights], weights=[weight for _, weight in weights])[0]
+
+
+@contextmanager
+def _explicit_dates(*fields):
+    """Отключает auto_now_add на время вставки: даты писем задает генератор"""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def synthetic_letter_count():
+    return Letter.objects.filter(subject__startswith=SYNTHETIC_SUBJECT_PREFIX).count()
+
+
+def delete_synthetic_letters():
+    """Удаляет синтетические письма со связанными данными и пересчитывает счетчики статистики"""
+    deleted, _ = Letter.objects.filter(subject__startswith=SYNTHETIC_SUBJECT_PREFIX).delete()
+    rebuild_letter_counters()
+    return deleted
+
+
+def analyze_tables():
+    """Обновляет статистику планировщика PostgreSQL после массовой вставки"""
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        for model in (Letter, AnalysisResult, GeneratedResponse, LetterQuestion):
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+
+
+class SyntheticDataGenerator:
+    """Массово создает письма с результатами анализа, вариантами ответов и вопросами.
+
+    Распределения статусов, критичности и сроков заданы константами модуля,
+    классификации распределены по закону Ципфа (первые категории встречаются
+    чаще). Письма создаются через bulk_create пачками по batch_size в отдельных
+    транзакциях; счетчики статистики обновляются, индекс почти дубликатов - нет.
+    """
+
+    def __init__(self, seed=None, days=365, batch_size=2000, progress=None):
+        self.rng = random.Random(seed)
+        self.days = days
+        self.batch_size = batch_size
+        self.progress = progress
+
+    def generate(self, count):
+        """Создает count писем; возвращает число созданных объектов по типам"""
+        registry = get_category_registry()
+        self._classification_weights = [
+            (number, 1 / rank) for rank, (number, _) in enumerate(registry.choices, start=1)
+        ]
+        self._version = registry.version
+        totals = {'letters': 0, 'analyses': 0, 'responses': 0, 'questions': 0}
+
+        uploaded_at = Letter._meta.get_field('uploaded_at')
+        created_at = AnalysisResult._meta.get_field('created_at')
+        generated_at = GeneratedResponse._meta.get_field('generated_at')
+        asked_at = LetterQuestion._meta.get_field('asked_at')
+        with _explicit_dates(uploaded_at, created_at, generated_at, asked_at):
+            while totals['letters'] < count:
+                batch = self._create_batch(min(self.batch_size, count - totals['letters']))
+                for key, value in batch.items():
+                    totals[key] += value
+                if self.progress:
+                    self.progress(totals['letters'], count)
+
+        analyze_tables()
+        return totals
+
+    def _create_batch(self, size):
+        now = self._now = timezone.now()
+        letters = [self._make_letter(now) for _ in range(size)]
+
+        # Связанные объекты готовятся до вставки: выбранный ответ становится финальным ответом письма
+        analyses, responses, questions = [], [], []
+        for letter in letters:
+            if letter.status == 'new':
+                continue
+            analyses.append(self._make_analysis(letter))
+            responses.extend(self._make_responses(letter))
+            questions.extend(self._make_questions(letter))
+
+        with transaction.atomic():
+            Letter.objects.bulk_create(letters)
+            add_letters_to_counters(letters)
+            AnalysisResult.objects.bulk_create(analyses)
+            GeneratedResponse.objects.bulk_create(responses)
+            LetterQuestion.objects.bulk_create(questions)
+
+        return {'letters': len(letters), 'analyses': len(analyses),
+                'responses': len(responses), 'questions': len(questions)}
+
+    def _make_letter(self, now):
+        rng = self.rng
+        fields = make_letter_fields(rng)
+        status = _weighted(rng, STATUS_WEIGHTS)
+        max_age = min(self.days, IN_WORK_MAX_AGE_DAYS) if status in Letter.IN_WORK_STATUSES else self.days
+        # Больше писем за последнее время: поток обращений растет
+        uploaded = now - timedelta(days=max_age * rng.random() ** 1.5)
+        letter = Letter(
+            sender=fields['sender'],
+            subject=SYNTHETIC_SUBJECT_PREFIX + fields['subject'],
+            original_text=fields['original_text'],
+            uploaded_at=uploaded,
+            status=status,
+        )
+        if status != 'new':
+            letter.classification = _weighted(rng, self._classification_weights)
+            letter.criticality_level = _weighted(rng, CRITICALITY_WEIGHTS)
+            letter.response_style = rng.randint(1, 4)
+            letter.processing_time_hours = _weighted(rng, PROCESSING_HOURS_WEIGHTS)
+            letter.sla_deadline = uploaded + timedelta(hours=letter.processing_time_hours)
+            letter.summary = fields['original_text'].split('\n\n')[1][:300]
+            letter.classification_version = self._version
+        return letter
+
+    def _after(self, letter, delta):
+        """Дата события после загрузки письма, но не позже текущего момента"""
+        return min(letter.uploaded_at + delta, self._now)
+
+    def _make_analysis(self, letter):
+        return AnalysisResult(
+            letter=letter,
+            created_at=self._after(letter, timedelta(seconds=self.rng.randint(5, 600))),
+            analysis_data={
+                'classification': letter.classification,
+                'criticality_level': letter.criticality_level,
+                'response_style': letter.response_style,
+                'processing_time_hours': letter.processing_time_hours,
+                'sla_deadline': letter.sla_deadline.strftime('%Y-%m-%d %H:%M:%S'),
+                'summary': letter.summary,
+            },
+        )
+
+    def _make_responses(self, letter):
+        rng = self.rng
+        if letter.status == 'analyzed':
+            count = 1 if rng.random() < DRAFT_RESPONSE_SHARE else 0
+        else:
+            count = rng.randint(1, 3)
+        styles = rng.sample(range(1, 5), count)
+        text = RESPONSE_TEMPLATE.format(sender=letter.sender, subject=letter.subject[len(SYNTHETIC_SUBJECT_PREFIX):])
+        responses = [
+            GeneratedResponse(
+                letter=letter,
+                response_style=style,
+                response_text=text,
+                generated_at=self._after(letter, timedelta(minutes=rng.randint(10, 24 * 60))),
+            )
+            for style in styles
+        ]
+        if responses and letter.status != 'analyzed':
+            # У письма с ответом один из вариантов выбран финальным
+            selected = rng.choice(responses)
+            selected.is_selected = True
+            letter.final_response = selected.response_text
+            letter.response_style = selected.response_style
+        return responses
+
+    def _make_questions(self, letter):
+        rng = self.rng
+        if rng.random() >= QUESTION_SHARE:
+            return []
+        return [
+            LetterQuestion(
+                letter=letter,
+                question=rng.choice(QUESTIONS),
+                answer="Ответ подготовлен по тексту письма: " + letter.summary[:200],
+                asked_at=self._after(letter, timedelta(minutes=rng.randint(1, 24 * 60))),
+            )
+            for _ in range(rng.randint(1, 3))
+        ]
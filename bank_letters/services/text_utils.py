@@ -0,0 +1,130 @@
+import re
+from functools import lru_cache
+
+# Стеммер Портера для русского языка (алгоритм Snowball)
+
+VOWELS = 'аеиоуыэюя'
+
+PERFECTIVE_GERUND_1 = ('вшись', 'вши', 'в')
+PERFECTIVE_GERUND_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+ADJECTIVE = (
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой',
+    'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+)
+PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')
+PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+REFLEXIVE = ('ся', 'сь')
+VERB_1 = ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н')
+VERB_2 = (
+    'ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют',
+    'ены', 'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю',
+)
+NOUN = (
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей', 'ой',
+    'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у',
+    'ы', 'ь', 'ю', 'я',
+)
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+STOP_WORDS = frozenset('''
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне
+было вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до
+вас нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя
+их чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого
+какой совсем ним здесь этом один почти мой тем чтобы нее сейчас были куда зачем всех никогда
+можно при наконец два об другой хоть после над больше тот через эти нас про всего них какая
+много разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им
+более всегда конечно всю между это также которые который которая которых
+'''.split())
+
+TOKEN_RE = re.compile(r'[а-яёa-z0-9]+')
+
+
+def _regions(word):
+    """Возвращает начало областей RV и R2"""
+    rv = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in VOWELS and word[i - 1] in VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def _remove_ending(word, rv, endings, preceded_by_a=False):
+    """Удаляет самое длинное подходящее окончание внутри RV"""
+    for ending in sorted(endings, key=len, reverse=True):
+        if word.endswith(ending) and len(word) - len(ending) >= rv:
+            if preceded_by_a:
+                pos = len(word) - len(ending) - 1
+                if pos < rv or word[pos] not in 'ая':
+                    continue
+            return word[:-len(ending)], True
+    return word, False
+
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    """Основа русского слова (Snowball). Нерусские слова возвращаются без изменений."""
+    word = word.lower().replace('ё', 'е')
+    if not any(char in VOWELS for char in word):
+        return word
+
+    rv, r2 = _regions(word)
+
+    # Шаг 1
+    word, found = _remove_ending(word, rv, PERFECTIVE_GERUND_1, preceded_by_a=True)
+    if not found:
+        word, found = _remove_ending(word, rv, PERFECTIVE_GERUND_2)
+    if not found:
+        word, _ = _remove_ending(word, rv, REFLEXIVE)
+
+        word, found = _remove_ending(word, rv, ADJECTIVE)
+        if found:
+            word, participle = _remove_ending(word, rv, PARTICIPLE_1, preceded_by_a=True)
+            if not participle:
+                word, _ = _remove_ending(word, rv, PARTICIPLE_2)
+        else:
+            word, found = _remove_ending(word, rv, VERB_1, preceded_by_a=True)
+            if not found:
+                word, found = _remove_ending(word, rv, VERB_2)
+            if not found:
+                word, _ = _remove_ending(word, rv, NOUN)
+
+    # Шаг 2
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Шаг 3
+    word, _ = _remove_ending(word, r2, DERIVATIONAL)
+
+    # Шаг 4
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        word = word[:-1]
+    else:
+        word, found = _remove_ending(word, rv, SUPERLATIVE)
+        if found and word.endswith('нн'):
+            word = word[:-1]
+        elif word.endswith('ь') and len(word) - 1 >= rv:
+            word = word[:-1]
+
+    return word
+
+
+def tokenize(text):
+    """Слова текста в нижнем регистре"""
+    return TOKEN_RE.findall((text or '').lower().replace('ё', 'е'))
+
+
+def analyze_terms(text):
+    """Нормализованные термы для поиска: без стоп-слов, в виде основ"""
+    return [stem(token) for token in tokenize(text) if token not in STOP_WORDS and len(token) > 1]
@@ -0,0 +1,283 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+import tiktoken
+
+from .metrics import LLM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+# Кодировка tiktoken для подсчета токенов. Токенизатор YandexGPT другой, поэтому
+# подсчет приблизительный; запас закладывается в бюджет LLM_INPUT_TOKEN_BUDGET
+DEFAULT_ENCODING = 'cl100k_base'
+# Оценка без tiktoken (кодировка не скачана, нет сети): символов кириллицы на токен
+HEURISTIC_CHARS_PER_TOKEN = 3
+# Через сколько секунд после ошибки загрузки кодировки tiktoken пробовать снова
+TOKENIZER_RETRY_SECONDS = float(os.getenv('LLM_TOKENIZER_RETRY_SECONDS', 300))
+
+# Из обрезанного письма сохраняются начало и конец: в конце обычно просьба и подпись
+LETTER_HEAD_SHARE = 0.75
+TRUNCATION_MARK = "\n[…часть текста пропущена…]\n"
+# Заголовки между частями промпта ("Текст письма:", "Контекст для анализа:") не считаются по частям
+FRAMING_RESERVE_TOKENS = 32
+
+
+class HeuristicEncoder:
+    """Оценка числа токенов по длине текста, когда tiktoken недоступен"""
+    name = 'heuristic'
+
+    def count(self, text):
+        return math.ceil(len(text) / HEURISTIC_CHARS_PER_TOKEN)
+
+    def head(self, text, tokens):
+        text = text[:tokens * HEURISTIC_CHARS_PER_TOKEN]
+        # Не обрываем слово посередине
+        return text.rsplit(' ', 1)[0] if ' ' in text else text
+
+    def tail(self, text, tokens):
+        if tokens <= 0:
+            return ''
+        text = text[-tokens * HEURISTIC_CHARS_PER_TOKEN:]
+        return text.split(' ', 1)[-1]
+
+
+class TiktokenEncoder:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.name = encoding.name
+
+    def count(self, text):
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def head(self, text, tokens):
+        # Разрезанный посередине многобайтный символ отбрасывается
+        return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:tokens]).rstrip('\ufffd')
+
+    def tail(self, text, tokens):
+        if tokens <= 0:
+            return ''
+        return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[-tokens:]).lstrip('\ufffd')
+
+
+_encoder = None
+_fallback_encoder = HeuristicEncoder()
+_encoder_retry_at = 0.0
+_encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    """Кодировщик для подсчета токенов: tiktoken или оценка по длине (один на процесс).
+
+    Кодировка загружается при первом использовании (без сети - скачивается, см. warmup_llm).
+    Пока она недоступна, токены оцениваются по длине текста, а загрузка повторяется
+    не чаще раза в TOKENIZER_RETRY_SECONDS; запросы не ждут загрузку в другом потоке.
+    """
+    global _encoder, _encoder_retry_at
+    if _encoder is not None:
+        return _encoder
+    name = os.getenv('LLM_TOKENIZER', DEFAULT_ENCODING)
+    if name == HeuristicEncoder.name:
+        _encoder = _fallback_encoder
+        return _encoder
+    if time.monotonic() < _encoder_retry_at or not _encoder_lock.acquire(blocking=False):
+        return _fallback_encoder
+    try:
+        if _encoder is None:
+            try:
+                encoding = tiktoken.get_encoding(name)
+            except Exception as e:
+                _encoder_retry_at = time.monotonic() + TOKENIZER_RETRY_SECONDS
+                logger.warning("Кодировка tiktoken %s недоступна (%s), токены оцениваются по длине текста, "
+                               "повтор через %s с", name, e, TOKENIZER_RETRY_SECONDS)
+                return _fallback_encoder
+            _encoder = TiktokenEncoder(encoding)
+            # Оценки по длине, посчитанные до загрузки кодировки, больше не нужны
+            count_tokens.cache_clear()
+        return _encoder
+    finally:
+        _encoder_lock.release()
+
+
+@lru_cache(maxsize=1024)
+def count_tokens(text):
+    """Число токенов текста. Кэшируется: постоянные части промптов считаются один раз."""
+    return get_encoder().count(text) if text else 0
+
+
+@dataclass
+class PromptPart:
+    """Часть промпта. trim - очередь обрезки (меньше - раньше), None - часть не обрезается.
+
+    Часть с separator обрезается целыми блоками с конца (фрагменты RAG),
+    без него - из середины с сохранением начала и конца (текст письма).
+    repeat - сколько раз часть входит в запрос.
+    """
+    name: str
+    text: str
+    trim: int = None
+    min_tokens: int = 0
+    separator: str = None
+    repeat: int = 1
+
+    @property
+    def tokens(self):
+        return count_tokens(self.text) * self.repeat
+
+
+@dataclass
+class PromptUsage:
+    """Размер запроса: токены по частям до и после обрезки"""
+    operation: str
+    budget: int
+    tokens_before: int
+    tokens: int
+    prompt_version: str = None
+    parts: dict = field(default_factory=dict)
+    trimmed: list = field(default_factory=list)
+
+    @property
+    def over_budget(self):
+        return self.tokens > self.budget
+
+
+def _trim_blocks(part, limit):
+    """Оставляет блоки с начала (самые релевантные), пока укладываются в limit токенов"""
+    blocks = part.text.split(part.separator)
+    kept, used = [], 0
+    separator_tokens = count_tokens(part.separator)
+    for block in blocks:
+        block_tokens = count_tokens(block) + (separator_tokens if kept else 0)
+        if used + block_tokens > limit:
+            break
+        kept.append(block)
+        used += block_tokens
+    return part.separator.join(kept)
+
+
+def _trim_middle(part, limit):
+    """Сокращает текст до limit токенов, выбрасывая середину"""
+    encoder = get_encoder()
+    available = max(0, limit - count_tokens(TRUNCATION_MARK))
+    head_tokens = int(available * LETTER_HEAD_SHARE)
+    return encoder.head(part.text, head_tokens) + TRUNCATION_MARK + encoder.tail(part.text, available - head_tokens)
+
+
+def fit_prompt(operation, parts, budget, prompt_version=None):
+    """Обрезает части промпта, чтобы запрос уложился в budget токенов.
+
+    Части обрезаются по очереди trim: каждая - ровно настолько, насколько нужно,
+    но не меньше min_tokens. Возвращает ({имя части: текст}, PromptUsage).
+    """
+    tokens = {part.name: part.tokens for part in parts}
+    usage = PromptUsage(
+        operation=operation, budget=budget, tokens_before=sum(tokens.values()), tokens=0, prompt_version=prompt_version
+    )
+
+    excess = usage.tokens_before - budget
+    for part in sorted((part for part in parts if part.trim is not None), key=lambda part: part.trim):
+        if excess <= 0:
+            break
+        if not part.text:
+            continue
+        limit = max(part.min_tokens, (tokens[part.name] - excess) // part.repeat)
+        if limit * part.repeat >= tokens[part.name]:
+            continue
+        part.text = _trim_blocks(part, limit) if part.separator else _trim_middle(part, limit)
+        excess -= tokens[part.name] - part.tokens
+        tokens[part.name] = part.tokens
+        usage.trimmed.append(part.name)
+
+    usage.parts = tokens
+    usage.tokens = sum(tokens.values())
+    return {part.name: part.text for part in parts}, usage
+
+
+class TokenUsageStats:
+    """Токены запросов к LLM по операциям и версиям промптов: оценка до отправки
+    и фактический расход по ответу API"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    def record_prompt(self, usage):
+        with self._lock:
+            stats = self._stats[(usage.operation, usage.prompt_version)]
+            stats['calls'] += 1
+            stats['estimated_input_tokens'] += usage.tokens
+            stats['trimmed_calls'] += bool(usage.trimmed)
+            stats['over_budget_calls'] += usage.over_budget
+        LLM_TOKENS.inc(usage.tokens, operation=usage.operation, prompt_version=usage.prompt_version or '',
+                       kind='estimated_input')
+
+    def record_response(self, operation, response, prompt_version=None):
+        """Фактические токены из ответа Responses API (если провайдер их вернул)"""
+        usage = getattr(response, 'usage', None)
+        if usage is None:
+            return
+        input_tokens = getattr(usage, 'input_tokens', None) or 0
+        output_tokens = getattr(usage, 'output_tokens', None) or 0
+        with self._lock:
+            stats = self._stats[(operation, prompt_version)]
+            stats['responses'] += 1
+            stats['input_tokens'] += input_tokens
+            stats['output_tokens'] += output_tokens
+        LLM_TOKENS.inc(input_tokens, operation=operation, prompt_version=prompt_version or '', kind='input')
+        LLM_TOKENS.inc(output_tokens, operation=operation, prompt_version=prompt_version or '', kind='output')
+        logger.debug("%s: израсходовано токенов - вход %s, выход %s", operation, input_tokens, output_tokens)
+
+    def snapshot(self):
+        """[{operation, prompt_version, calls, ...}] - по строке на операцию и версию промпта"""
+        with self._lock:
+            return [
+                {'operation': operation, 'prompt_version': prompt_version, **stats}
+                for (operation, prompt_version), stats in self._stats.items()
+            ]
+
+
+class TokenBudget:
+    """Бюджет входных токенов одного запроса к LLM (LLM_INPUT_TOKEN_BUDGET).
+
+    Сначала сокращается контекст RAG, затем текст письма, в последнюю очередь -
+    указания пользователя; инструкции промпта не обрезаются.
+    """
+
+    def __init__(self, budget=None):
+        self.budget = int(budget or os.getenv('LLM_INPUT_TOKEN_BUDGET', 8000))
+        # Письмо не сокращается меньше этого размера, даже если бюджет превышен
+        self.min_letter_tokens = int(os.getenv('LLM_MIN_LETTER_TOKENS', 1000))
+        self.stats = get_token_usage_stats()
+
+    def fit(self, operation, parts, prompt_version=None):
+        texts, usage = fit_prompt(operation, parts, self.budget - FRAMING_RESERVE_TOKENS, prompt_version)
+        usage.budget = self.budget
+        self.stats.record_prompt(usage)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            parts_info = ', '.join(f"{name} {tokens}" for name, tokens in usage.parts.items())
+            logger.debug("%s: промпт %s токенов из %s (%s)", operation, usage.tokens, self.budget, parts_info)
+        if usage.trimmed:
+            logger.info("%s: промпт сокращен с %s токенов, обрезано: %s",
+                        operation, usage.tokens_before, ', '.join(usage.trimmed))
+        if usage.over_budget:
+            logger.warning("%s: промпт не уложился в бюджет %s токенов", operation, self.budget)
+        return texts
+
+
+_token_usage_stats = None
+_token_usage_lock = threading.Lock()
+
+
+def get_token_usage_stats():
+    global _token_usage_stats
+    if _token_usage_stats is None:
+        with _token_usage_lock:
+            if _token_usage_stats is None:
+                _token_usage_stats = TokenUsageStats()
+    return _token_usage_stats
@@ -0,0 +1,192 @@
+"""Замер представлений на больших объемах данных: время ответа, число запросов к БД и пик памяти.
+
+Запросы выполняются тестовым клиентом Django в текущем процессе (через все middleware).
+Данные готовит services/synthetic_data.py; сравнение результатов на разных объемах
+показывает, какие страницы замедляются с ростом числа писем.
+"""
+import json
+import random
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from urllib.parse import urlencode
+
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from bank_letters.models import Letter
+from bank_letters.services.category_registry import get_category_registry
+from bank_letters.services.letter_pagination import paginate_letters
+from bank_letters.services.pipeline_benchmark import percentile
+from bank_letters.services.synthetic_data import SYNTHETIC_SUBJECT_PREFIX
+
+
+@dataclass
+class ViewRequest:
+    name: str
+    method: str
+    url: str
+    data: dict = None
+    expected_statuses: tuple = (200,)
+
+
+@dataclass
+class ViewResult:
+    """Замеры одного представления при заданном числе писем"""
+    name: str
+    letters: int
+    times: list = field(default_factory=list)
+    queries: int = 0
+    peak_memory: int = 0
+    errors: int = 0
+    last_error: str = ''
+
+    def as_dict(self):
+        return {
+            'view': self.name,
+            'letters': self.letters,
+            'requests': len(self.times),
+            'errors': self.errors,
+            'last_error': self.last_error,
+            'p50_ms': _ms(percentile(self.times, 50)),
+            'p95_ms': _ms(percentile(self.times, 95)),
+            'max_ms': _ms(max(self.times) if self.times else None),
+            'queries': self.queries,
+            'peak_memory_kb': round(self.peak_memory / 1024),
+        }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def real_letters_exist():
+    """Есть ли в базе письма, созданные не генератором синтетических данных"""
+    return Letter.objects.exclude(subject__startswith=SYNTHETIC_SUBJECT_PREFIX).exists()
+
+
+def _random_letter_id(queryset, rng):
+    """Случайное письмо без ORDER BY random(): первое с id не меньше случайного"""
+    bounds = queryset.aggregate(first=Min('id'), last=Max('id'))
+    if bounds['first'] is None:
+        return None
+    return (queryset.filter(id__gte=rng.randint(bounds['first'], bounds['last']))
+            .order_by('id').values_list('id', flat=True).first())
+
+
+class ViewBenchmark:
+    """Выполняет запросы к представлениям repeat раз и собирает ViewResult по каждому.
+
+    Сценарии смены и сброса категорий проходят реальный путь (форма, подтверждение,
+    применение). Весь замер выполняется в одной транзакции, которая затем откатывается:
+    категории, их версия и запуск повторного анализа не видны другим процессам
+    (обработчикам очереди) и не остаются в базе. Транзакции представлений при этом
+    становятся точками сохранения - сценарии смены категорий не включают время фиксации.
+    """
+
+    def __init__(self, repeat=5, seed=None, classification_flows=True):
+        self.repeat = repeat
+        self.rng = random.Random(seed)
+        self.classification_flows = classification_flows
+
+    def run(self):
+        client = Client()
+        letters = Letter.objects.count()
+        results = {}
+        with transaction.atomic():
+            # Первый проход прогревает кэши процесса (реестр категорий, шаблоны) и не учитывается
+            for request in self._requests():
+                self._execute(client, request)
+
+            for _ in range(self.repeat):
+                for request in self._requests():
+                    result = results.setdefault(request.name, ViewResult(name=request.name, letters=letters))
+                    self._measure(client, request, result)
+
+            # Пик памяти - отдельным проходом: трассировка выделений замедляет запросы
+            for request in self._requests():
+                result = results.setdefault(request.name, ViewResult(name=request.name, letters=letters))
+                self._measure_memory(client, request, result)
+            transaction.set_rollback(True)
+        return list(results.values())
+
+    def _requests(self):
+        """Запросы одного прохода; письма для страниц письма выбираются заново"""
+        registry = get_category_registry()
+        list_url = reverse('letter_list')
+        requests = [
+            ViewRequest('letter_list', 'get', list_url),
+            ViewRequest('letter_list_status', 'get', f"{list_url}?status=analyzed"),
+        ]
+        if registry.choices:
+            requests.append(ViewRequest(
+                'letter_list_classification', 'get', f"{list_url}?classification={registry.choices[0][0]}"
+            ))
+        next_cursor = paginate_letters(Letter.objects.defer('original_text', 'final_response')).next_cursor
+        if next_cursor:
+            requests.append(ViewRequest(
+                'letter_list_next_page', 'get', f"{list_url}?{urlencode({'cursor': next_cursor})}"
+            ))
+        requests.append(ViewRequest('letter_statistics', 'get', reverse('letter_statistics')))
+
+        letter_id = _random_letter_id(Letter.objects.all(), self.rng)
+        if letter_id is not None:
+            requests.append(ViewRequest('letter_detail', 'get', reverse('letter_detail', args=[letter_id])))
+        analyzed_id = _random_letter_id(Letter.objects.exclude(status='new'), self.rng)
+        if analyzed_id is not None:
+            requests.append(ViewRequest('analysis_results', 'get', reverse('analysis_results', args=[analyzed_id])))
+
+        if self.classification_flows:
+            requests.extend(self._classification_requests(registry))
+        return requests
+
+    def _classification_requests(self, registry):
+        """Смена категорий (последняя переименовывается) и сброс к базовым"""
+        categories = [
+            {'number': number, 'name': name, 'description': description}
+            for number, name, description in registry.categories
+        ]
+        categories[-1]['name'] = f"{categories[-1]['name'].removesuffix(' *')} *"
+        confirm_change = reverse('confirm_classification_change')
+        confirm_reset = reverse('confirm_classification_reset')
+        return [
+            ViewRequest('classification_change_submit', 'post', reverse('classification_settings'),
+                        {'categories_json': json.dumps(categories, ensure_ascii=False)}, (302,)),
+            ViewRequest('classification_change_confirm_page', 'get', confirm_change),
+            ViewRequest('classification_change_apply', 'post', confirm_change, {'confirm': '1'}, (302,)),
+            ViewRequest('classification_settings', 'get', reverse('classification_settings')),
+            ViewRequest('classification_reset_submit', 'post', reverse('reset_to_default_categories'), {}, (302,)),
+            ViewRequest('classification_reset_confirm_page', 'get', confirm_reset),
+            ViewRequest('classification_reset_apply', 'post', confirm_reset, {'confirm': '1'}, (302,)),
+        ]
+
+    def _execute(self, client, request):
+        method = getattr(client, request.method)
+        response = method(request.url, request.data) if request.data is not None else method(request.url)
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+        return response
+
+    def _measure(self, client, request, result):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = self._execute(client, request)
+            elapsed = time.perf_counter() - started
+        if response.status_code not in request.expected_statuses:
+            result.errors += 1
+            result.last_error = f"HTTP {response.status_code}"
+            return
+        result.times.append(elapsed)
+        # Число запросов может отличаться на проверку версии категорий - берем наибольшее
+        result.queries = max(result.queries, len(queries))
+
+    def _measure_memory(self, client, request, result):
+        tracemalloc.start()
+        try:
+            self._execute(client, request)
+            result.peak_memory = max(result.peak_memory, tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
@@ -17,10 +17,15 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'bank_letters',
 ]
 
 MIDDLEWARE = [
+    # Время обработки запросов для /metrics (первым - чтобы учитывать и остальные middleware)
+    'bank_letters.middleware.ViewMetricsMiddleware',
+    # request_id и letter_id в записях журнала
+    'bank_letters.middleware.RequestContextMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +55,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'bank_letters.wsgi.application'
+ASGI_APPLICATION = 'bank_letters.asgi.application'
+
+# Под ASGI (uvicorn) анализ, генерация ответов и вопросы к письму обрабатываются
+# асинхронными представлениями, не занимающими поток на время запроса к LLM
+ASYNC_LLM_VIEWS = os.getenv('ASYNC_LLM_VIEWS', 'false').lower() == 'true'
 
 DATABASES = {
     'default': {
@@ -88,4 +98,32 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 LLM_API_URL = 'https://api.example.com/analyze'
-LLM_API_KEY = 'your-api-key'
\ No newline at end of file
+LLM_API_KEY = 'your-api-key'
+# Журнал приложения: JSON записи с request_id и letter_id; в stdout пишет фоновый поток
+# (см. bank_letters/structured_logging.py). LOG_LEVEL=DEBUG включает подробные записи,
+# объемные данные (контекст RAG) из них попадают в журнал с долей LOG_PAYLOAD_SAMPLE_RATE
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'context': {'()': 'bank_letters.structured_logging.ContextFilter'},
+        'sampling': {'()': 'bank_letters.structured_logging.SamplingFilter'},
+    },
+    'formatters': {
+        'json': {'()': 'bank_letters.structured_logging.JsonFormatter'},
+    },
+    'handlers': {
+        'queue': {
+            '()': 'bank_letters.structured_logging.AsyncQueueHandler',
+            'filters': ['sampling', 'context'],
+            'formatter': 'json',
+        },
+    },
+    'loggers': {
+        'bank_letters': {
+            'handlers': ['queue'],
+            'level': os.getenv('LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,135 @@
+"""Структурированное журналирование: JSON записи с контекстом запроса, запись в поток вывода
+отдельным потоком через очередь (обработчик запроса на вводе-выводе не ждет)."""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Контекст текущего запроса (или задачи обработчика очереди)
+request_id_var = contextvars.ContextVar('request_id', default=None)
+letter_id_var = contextvars.ContextVar('letter_id', default=None)
+
+# Стандартные атрибуты LogRecord: все остальные (переданные через extra) попадают в JSON
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+
+def payload_sample_rate():
+    """Доля записей с объемными данными (контекст RAG, ответы LLM), которые попадают в журнал"""
+    return float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', 0.01))
+
+
+def payload_max_chars():
+    return int(os.getenv('LOG_PAYLOAD_MAX_CHARS', 2000))
+
+
+def payload(text):
+    """extra для записи с объемными данными: текст обрезается и журналируется выборочно"""
+    text = text or ''
+    limit = payload_max_chars()
+    return {
+        'payload': text if len(text) <= limit else text[:limit] + '…',
+        'payload_chars': len(text),
+        'sample_rate': payload_sample_rate(),
+    }
+
+
+@contextmanager
+def log_context(request_id=None, letter_id=None):
+    """Добавляет request_id и letter_id ко всем записям внутри блока"""
+    tokens = []
+    if request_id is not None:
+        tokens.append((request_id_var, request_id_var.set(request_id)))
+    if letter_id is not None:
+        tokens.append((letter_id_var, letter_id_var.set(letter_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Копирует контекст запроса в запись (до очереди, в потоке запроса)"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        # letter_id можно передать и явно через extra (например, из потокового ответа)
+        if getattr(record, 'letter_id', None) is None:
+            record.letter_id = letter_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает запись с атрибутом sample_rate с этой вероятностью; остальные - всегда"""
+
+    def filter(self, record):
+        rate = getattr(record, 'sample_rate', None)
+        return rate is None or rate >= 1 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != 'sample_rate' and value is not None:
+                data[key] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """Обработчик журнала: запись форматируется в потоке запроса и кладется в очередь,
+    в поток вывода ее пишет фоновый поток.
+
+    Очередь ограничена LOG_QUEUE_SIZE записями: при переполнении новые записи
+    отбрасываются, а не задерживают запрос.
+    """
+
+    def __init__(self, queue_size=None):
+        super().__init__(queue.Queue(int(queue_size or os.getenv('LOG_QUEUE_SIZE', 10000))))
+        self.dropped = 0
+        self._pid = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        # Поток записи не переживает fork - воркер gunicorn запускает свой
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            output = logging.StreamHandler(sys.stdout)
+            output.setFormatter(logging.Formatter('%(message)s'))
+            self._listener = QueueListener(self.queue, output)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Дописывает оставшиеся в очереди записи (при завершении процесса)"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
@@ -0,0 +1,32 @@
+from django.test import SimpleTestCase
+
+from bank_letters.services.analysis_cache import make_cache_key, normalize_letter_text
+
+CATEGORIES = [{'id': 1, 'name': 'Жалоба', 'description': ''}]
+
+
+def _key(text):
+    return make_cache_key(text, CATEGORIES, 'yandexgpt/rc', 1)
+
+
+class NormalizeLetterTextTests(SimpleTestCase):
+    def test_greeting_and_body_on_one_line_get_different_keys(self):
+        first = "Здравствуйте, у меня списали 5000 руб. комиссии без предупреждения."
+        second = "Здравствуйте, карта заблокирована после перевода на 300 руб."
+        self.assertNotEqual(_key(first), _key(second))
+
+    def test_greeting_without_punctuation_keeps_body(self):
+        first = "Добрый день у меня списали комиссию"
+        second = "Добрый день прошу выдать выписку по счету"
+        self.assertNotEqual(_key(first), _key(second))
+
+    def test_recipient_in_greeting_line_is_ignored(self):
+        first = "Уважаемый Иван Иванович!\nПросим подтвердить участие в конференции."
+        second = "Уважаемая Анна Сергеевна!\nПросим подтвердить участие в конференции."
+        self.assertEqual(_key(first), _key(second))
+
+    def test_only_greeting_phrase_is_removed(self):
+        self.assertEqual(
+            normalize_letter_text("Здравствуйте, у меня списали 5000 руб."),
+            "у меня списали 5000 руб.",
+        )
@@ -0,0 +1,44 @@
+from django.test import TestCase
+
+from bank_letters.models import GeneratedResponse, Letter
+from bank_letters.views import _save_generated_responses
+
+RESPONSES = {1: "Официальный ответ", 2: "Дружелюбный ответ", 3: "Краткий ответ", 4: "Подробный ответ"}
+
+
+class SaveGeneratedResponsesTests(TestCase):
+    def setUp(self):
+        self.letter = Letter.objects.create(
+            subject='Тема', sender='client@example.com', original_text='Текст письма', status='analyzed',
+        )
+
+    def test_selected_response_is_kept(self):
+        selected = GeneratedResponse.objects.create(
+            letter=self.letter, response_style=2, response_text="Выбранный ответ", is_selected=True
+        )
+        GeneratedResponse.objects.create(letter=self.letter, response_style=1, response_text="Старый вариант")
+        self.letter.final_response = selected.response_text
+        self.letter.response_style = 2
+        self.letter.status = 'response_generated'
+        self.letter.save()
+
+        _save_generated_responses(self.letter, RESPONSES)
+
+        texts = set(GeneratedResponse.objects.filter(letter=self.letter).values_list('response_text', flat=True))
+        self.assertEqual(texts, {"Выбранный ответ", *RESPONSES.values()})
+        self.letter.refresh_from_db()
+        self.assertEqual(self.letter.final_response, "Выбранный ответ")
+        self.assertEqual(self.letter.status, 'response_generated')
+
+    def test_final_response_without_variant_is_reset(self):
+        self.letter.final_response = "Ответ без варианта"
+        self.letter.response_style = 1
+        self.letter.status = 'response_generated'
+        self.letter.save()
+
+        _save_generated_responses(self.letter, RESPONSES)
+
+        self.letter.refresh_from_db()
+        self.assertEqual((self.letter.final_response, self.letter.response_style, self.letter.status),
+                         ('', None, 'analyzed'))
+        self.assertEqual(GeneratedResponse.objects.filter(letter=self.letter).count(), len(RESPONSES))
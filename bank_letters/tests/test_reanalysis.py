@@ -0,0 +1,31 @@
+from django.test import TestCase
+
+from bank_letters.models import Letter
+from bank_letters.services.reanalysis import stale_letters
+
+
+class StaleClassificationTests(TestCase):
+    def _letter(self, status, version):
+        return Letter.objects.create(
+            subject='Тема', sender='client@example.com', original_text='Текст письма',
+            status=status, classification_version=version,
+        )
+
+    def test_queryset_and_instance_agree(self):
+        letters = [
+            self._letter('new', None),
+            self._letter('analyzed', None),
+            self._letter('analyzed', 1),
+            self._letter('analyzed', 2),
+            self._letter('response_generated', 1),
+        ]
+        for version in (0, 1, 2):
+            with self.subTest(version=version):
+                expected = {letter.id for letter in letters if letter.is_classification_stale_for(version)}
+                self.assertEqual(set(stale_letters(version).values_list('id', flat=True)), expected)
+
+    def test_letter_without_version_is_stale_after_category_change(self):
+        letter = self._letter('analyzed', None)
+        self.assertFalse(letter.is_classification_stale_for(0))
+        self.assertTrue(letter.is_classification_stale_for(1))
+        self.assertFalse(self._letter('new', None).is_classification_stale_for(1))
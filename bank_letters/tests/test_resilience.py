@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+from django.test import SimpleTestCase
+
+from bank_letters.services.resilience import CircuitBreaker, CircuitOpenError, LLMResilience
+
+
+def _half_open_resilience(reset_seconds=30):
+    """Предохранитель, открытый reset_seconds назад: следующий запрос станет пробным"""
+    resilience = LLMResilience()
+    resilience.breaker = CircuitBreaker(failure_threshold=1, reset_seconds=reset_seconds)
+    resilience.breaker.record_failure()
+    resilience.breaker.opened_at = time.monotonic() - reset_seconds
+    return resilience
+
+
+async def _ok(timeout):
+    return 'ok'
+
+
+class HalfOpenProbeTests(SimpleTestCase):
+    def test_cancelled_half_open_acall_releases_probe(self):
+        resilience = _half_open_resilience()
+
+        async def scenario():
+            started = asyncio.Event()
+
+            async def hang(timeout):
+                started.set()
+                await asyncio.sleep(60)
+
+            task = asyncio.create_task(resilience.acall('analyze', hang, resilience.new_deadline()))
+            await started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return await resilience.acall('analyze', _ok, resilience.new_deadline())
+
+        self.assertEqual(asyncio.run(scenario()), 'ok')
+        self.assertEqual(resilience.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_interrupted_half_open_call_releases_probe(self):
+        resilience = _half_open_resilience()
+
+        def interrupt(timeout):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            resilience.call('analyze', interrupt, resilience.new_deadline())
+        self.assertEqual(resilience.call('analyze', lambda timeout: 'ok', resilience.new_deadline()), 'ok')
+
+    def test_probe_in_flight_rejects_other_requests(self):
+        resilience = _half_open_resilience()
+
+        async def scenario():
+            started = asyncio.Event()
+
+            async def hang(timeout):
+                started.set()
+                await asyncio.sleep(60)
+
+            probe = asyncio.create_task(resilience.acall('analyze', hang, resilience.new_deadline()))
+            await started.wait()
+            try:
+                with self.assertRaises(CircuitOpenError):
+                    await resilience.acall('analyze', _ok, resilience.new_deadline(), max_attempts=1)
+                # Отмена чужого запроса не освобождает пробный
+                resilience.release_probe()
+                self.assertFalse(resilience.breaker.allow())
+            finally:
+                probe.cancel()
+
+        asyncio.run(scenario())
+
+    def test_lost_probe_expires_after_reset_seconds(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+        breaker.record_failure()
+        breaker.opened_at = time.monotonic() - 30
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker._probe_started_at = time.monotonic() - 30
+        self.assertTrue(breaker.allow())
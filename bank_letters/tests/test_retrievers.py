@@ -0,0 +1,36 @@
+import json
+from dataclasses import asdict
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase
+from openai.types import VectorStoreSearchResponse
+
+from bank_letters.services.retrievers import VectorStoreRetriever, merge_chunks
+
+
+def _search_page(*results):
+    """Ответ vector_stores.search в форме SDK: страница с результатами в data"""
+    return SimpleNamespace(data=[VectorStoreSearchResponse.model_validate(result) for result in results])
+
+
+class VectorStoreRetrieverTests(SimpleTestCase):
+    def test_chunk_text_is_joined_from_content_parts(self):
+        page = _search_page(
+            {
+                'file_id': 'file-1', 'filename': 'tariffs.txt', 'score': 0.9, 'attributes': {},
+                'content': [{'type': 'text', 'text': 'Комиссия за перевод '}, {'type': 'text', 'text': '1%.'}],
+            },
+            {
+                'file_id': 'file-2', 'filename': 'cards.txt', 'score': 0.4, 'attributes': None,
+                'content': [{'type': 'text', 'text': 'Карта блокируется после трех ошибок ПИН.'}],
+            },
+        )
+        chunks = VectorStoreRetriever(llm_client=None)._to_chunks(page)
+
+        self.assertEqual([chunk.text for chunk in chunks],
+                         ['Комиссия за перевод 1%.', 'Карта блокируется после трех ошибок ПИН.'])
+        self.assertEqual([chunk.source for chunk in chunks], ['tariffs.txt', 'cards.txt'])
+        self.assertEqual(chunks[0].score, 0.9)
+        # Фрагменты проходят объединение и сериализацию для кэша RAG
+        self.assertEqual(len(merge_chunks([chunks], 1000)), 2)
+        json.dumps([asdict(chunk) for chunk in chunks], ensure_ascii=False)
@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from bank_letters.services import token_budget
+
+
+class FakeEncoding:
+    name = 'cl100k_base'
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+
+class GetEncoderTests(SimpleTestCase):
+    def setUp(self):
+        self._reset()
+
+    def tearDown(self):
+        self._reset()
+
+    def _reset(self):
+        token_budget._encoder = None
+        token_budget._encoder_retry_at = 0.0
+        token_budget.count_tokens.cache_clear()
+
+    def test_download_error_is_retried_after_pause(self):
+        get_encoding = mock.Mock(side_effect=[OSError("нет сети"), FakeEncoding()])
+        clock = SimpleNamespace(now=1000.0)
+        with mock.patch.object(token_budget.tiktoken, 'get_encoding', get_encoding), \
+                mock.patch.object(token_budget.time, 'monotonic', lambda: clock.now):
+            self.assertIsInstance(token_budget.get_encoder(), token_budget.HeuristicEncoder)
+            self.assertEqual(token_budget.count_tokens("один два три четыре пять шесть"), 10)
+            # До конца паузы загрузка не повторяется
+            self.assertIsInstance(token_budget.get_encoder(), token_budget.HeuristicEncoder)
+            self.assertEqual(get_encoding.call_count, 1)
+
+            clock.now += token_budget.TOKENIZER_RETRY_SECONDS
+            self.assertIsInstance(token_budget.get_encoder(), token_budget.TiktokenEncoder)
+            # Оценка по длине, посчитанная до загрузки, не остается в кэше
+            self.assertEqual(token_budget.count_tokens("один два три четыре пять шесть"), 6)
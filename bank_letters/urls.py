@@ -1,13 +1,32 @@
 # urls.py
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.ASYNC_LLM_VIEWS:
+    analyze_letter_view = views.analyze_letter_async
+    generate_responses_view = views.generate_responses_async
+    ask_question_view = views.ask_question_async
+    generate_response_stream_view = views.generate_response_stream_async
+    ask_question_stream_view = views.ask_question_stream_async
+else:
+    analyze_letter_view = views.analyze_letter
+    generate_responses_view = views.generate_responses
+    ask_question_view = views.ask_question
+    generate_response_stream_view = views.generate_response_stream
+    ask_question_stream_view = views.ask_question_stream
+
 urlpatterns = [
     path('', views.letter_list, name='letter_list'),
+    path('search/', views.search_letters_view, name='search_letters'),
     path('upload/', views.upload_letter, name='upload_letter'),
-    path('letter/<int:letter_id>/analyze/', views.analyze_letter, name='analyze_letter'),
+    path('upload/bulk/', views.bulk_import_letters, name='bulk_import_letters'),
+    path('letter/<int:letter_id>/analyze/', analyze_letter_view, name='analyze_letter'),
+    path('letter/<int:letter_id>/status/', views.letter_status, name='letter_status'),
     path('letter/<int:letter_id>/analysis/', views.analysis_results, name='analysis_results'),
-    path('letter/<int:letter_id>/generate-response/', views.generate_responses, name='generate_responses'),
+    path('letter/<int:letter_id>/generate-response/', generate_responses_view, name='generate_responses'),
+    path('letter/<int:letter_id>/generate-response/stream/', generate_response_stream_view,
+         name='generate_response_stream'),
     path('letter/<int:letter_id>/', views.letter_detail, name='letter_detail'),
     path('letter/<int:letter_id>/update-status/', views.update_letter_status, name='update_letter_status'),
     path('statistics/', views.get_letter_statistics, name='letter_statistics'),
@@ -16,5 +35,7 @@ urlpatterns = [
     path('classification-settings/reset/', views.reset_to_default_categories, name='reset_to_default_categories'),
     path('classification-settings/reset/confirm/', views.confirm_classification_reset,
          name='confirm_classification_reset'),
-    path('letter/<int:letter_id>/ask-question/', views.ask_question, name='ask_question'),
+    path('letter/<int:letter_id>/ask-question/', ask_question_view, name='ask_question'),
+    path('letter/<int:letter_id>/ask-question/stream/', ask_question_stream_view, name='ask_question_stream'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
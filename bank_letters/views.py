@@ -1,15 +1,34 @@
+import json
+import logging
+import os
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
 from django.utils import timezone
 from django.contrib import messages
 from django.db import transaction
+from django.views.decorators.http import require_POST
 from datetime import timedelta
-from .forms import LetterUploadForm, ClassificationCategoriesForm
+from .forms import LetterUploadForm, LetterBulkImportForm, ClassificationCategoriesForm
 from .models import Letter, AnalysisResult, GeneratedResponse, ClassificationCategory, LetterQuestion
 from .services.llm_client import LLMClient
+from .services.async_llm_client import AsyncLLMClient
+from .services.analysis_queue import enqueue_analysis, get_active_job
+from .services.letter_import import LetterImporter
+from .services.letter_statistics import collect_letter_statistics
+from .services.reanalysis import start_reanalysis, reanalysis_progress
+from .services.letter_pagination import paginate_letters, InvalidCursor, DEFAULT_PAGE_SIZE
+from .services.letter_search import search_letters, attach_snippets
+from .services.near_duplicates import index_letter
+from .services.metrics import DB_SAVE_SECONDS, render_metrics
+
+logger = logging.getLogger(__name__)
 
 llm_client = LLMClient()
 
+LETTER_PAGE_SIZE = int(os.getenv('LETTER_PAGE_SIZE', DEFAULT_PAGE_SIZE))
+
 def classification_settings(request):
     """Настройка классификаторов"""
     custom_categories = ClassificationCategory.objects.filter(is_active=True).order_by('number')
@@ -19,12 +38,12 @@ def classification_settings(request):
         if form.is_valid():
             categories_data = form.cleaned_data['categories_json']
 
-            # Предупреждение о потере данных
+            # Предупреждение о повторном анализе писем
             if Letter.objects.exclude(classification__isnull=True).exists() or AnalysisResult.objects.exists():
                 messages.warning(request,
-                                 "Внимание! Все существующие результаты анализа писем будут удалены, "
-                                 "так как изменятся категории классификации. Это необходимо для "
-                                 "предотвращения конфликта данных."
+                                 "Внимание! Проанализированные письма будут повторно проанализированы "
+                                 "по новым категориям в фоне. До повторного анализа у писем "
+                                 "остаются прежние результаты."
                                  , extra_tags='classification')
                 # Сохраняем данные в сессии для подтверждения
                 request.session['pending_categories'] = categories_data
@@ -45,12 +64,13 @@ def classification_settings(request):
         'base_classification_choices': base_classification_choices,  # Добавляем базовые категории
         'has_existing_data': Letter.objects.exclude(
             classification__isnull=True).exists() or AnalysisResult.objects.exists(),
+        'reanalysis': reanalysis_progress(),
     }
     return render(request, 'classification_settings.html', context)
 
 
 def confirm_classification_change(request):
-    """Подтверждение изменения классификаторов с удалением данных"""
+    """Подтверждение изменения классификаторов с повторным анализом писем"""
     if 'pending_categories' not in request.session:
         return redirect('classification_settings')
 
@@ -64,14 +84,12 @@ def confirm_classification_change(request):
             del request.session['pending_categories']
             return redirect('classification_settings')
 
-    # Подсчет данных для удаления
-    letters_count = Letter.objects.exclude(classification__isnull=True).count()
-    analysis_count = AnalysisResult.objects.count()
-    responses_count = GeneratedResponse.objects.count()
+    # Письма, которые будут проанализированы повторно
+    letters_count = Letter.objects.exclude(status='new').count()
+    responses_count = Letter.objects.exclude(final_response='').count()
 
     context = {
         'letters_count': letters_count,
-        'analysis_count': analysis_count,
         'responses_count': responses_count,
         'new_categories': categories_data,  # Передаем как есть - список словарей
     }
@@ -94,23 +112,16 @@ def apply_classification_changes(request, categories_data):
                     is_active=True
                 )
 
-            # Удаляем все данные анализа
-            AnalysisResult.objects.all().delete()
-            GeneratedResponse.objects.all().delete()
-
-            # Сбрасываем классификацию у всех писем
-            Letter.objects.all().update(
-                classification=None,
-                summary='',
-                criticality_level=None,
-                response_style=None,
-                processing_time_hours=None,
-                sla_deadline=None,
-                final_response='',
-                status='new'
-            )
+            # Сбрасываем кэш категорий во всех процессах
+            Letter.clear_classification_cache()
 
-            messages.success(request, "Классификаторы успешно обновлены! Все письма помечены для повторного анализа.", extra_tags='classification')
+            # Письма не сбрасываются: обработчики очереди анализируют их повторно
+            # порциями по SLA, а до этого показываются прежние результаты
+            start_reanalysis()
+
+            messages.success(request,
+                             "Классификаторы успешно обновлены! Письма будут повторно "
+                             "проанализированы в фоне.", extra_tags='classification')
 
             # Очищаем сессию
             if 'pending_categories' in request.session:
@@ -122,14 +133,8 @@ def apply_classification_changes(request, categories_data):
     return redirect('classification_settings')
 
 
-def letter_list(request):
-    """Главная страница - список всех писем"""
-    # Базовый queryset
-    letters = Letter.objects.all()
-
-    # Определяем временной порог для "истекающего срока" (например, 24 часа)
-    time_threshold = timezone.now() + timedelta(hours=24)
-
+def _filter_letters(request, letters):
+    """Фильтры списка писем из параметров запроса: статус и классификация"""
     # Фильтрация по статусу
     status_filter = request.GET.get('status')
     if status_filter:
@@ -145,59 +150,101 @@ def letter_list(request):
             # Если не удалось преобразовать в число, игнорируем фильтр
             pass
 
-    # Аннотируем письма флагом "истекающий срок"
-    from django.db.models import Case, When, Value, BooleanField
-    letters = letters.annotate(
-        is_urgent=Case(
-            When(
-                sla_deadline__isnull=False,
-                sla_deadline__lte=time_threshold,
-                then=Value(True)
-            ),
-            default=Value(False),
-            output_field=BooleanField()
-        )
-    )
-
-    from django.db.models import Case, When, Value, IntegerField
-    letters = letters.annotate(
-        status_order=Case(
-            # Незавершенные письма (в работе) - приоритет 1
-            When(status__in=['new', 'analyzed', 'response_generated'], then=Value(1)),
-            # Завершенные письма - приоритет 2 (будут внизу)
-            When(status__in=['done', 'archived'], then=Value(2)),
-            default=Value(3),
-            output_field=IntegerField()
+    return letters
+
+
+def letter_list(request):
+    """Главная страница - список писем постранично"""
+    # Текст письма и ответ в списке не показываются, поэтому не загружаем их
+    letters = Letter.objects.defer('original_text', 'final_response')
+
+    # Определяем временной порог для "истекающего срока" (например, 24 часа)
+    time_threshold = timezone.now() + timedelta(hours=24)
+
+    status_filter = request.GET.get('status')
+    letters = _filter_letters(request, letters)
+
+    # Страница по курсору: письма в работе выше завершенных, срочные (ближайший дедлайн) первыми
+    try:
+        page = paginate_letters(
+            letters,
+            cursor=request.GET.get('cursor'),
+            page_size=LETTER_PAGE_SIZE,
+            group_fixed=bool(status_filter)
         )
-    ).order_by(
-        'status_order',
-        '-is_urgent',
-        'sla_deadline',
-        '-uploaded_at'
-    )
+    except InvalidCursor:
+        messages.warning(request, "Ссылка на страницу устарела, показана первая страница")
+        page = paginate_letters(letters, page_size=LETTER_PAGE_SIZE, group_fixed=bool(status_filter))
+
+    # Ссылка на следующую страницу сохраняет фильтры
+    next_page_url = None
+    if page.next_cursor:
+        query = request.GET.copy()
+        query['cursor'] = page.next_cursor
+        next_page_url = f"?{query.urlencode()}"
+
+    first_page_url = None
+    if request.GET.get('cursor'):
+        query = request.GET.copy()
+        del query['cursor']
+        first_page_url = f"?{query.urlencode()}"
 
     # Получаем текстовые представления для отображения
     status_choices = dict(Letter.STATUS_CHOICES)
     classification_choices = Letter.get_classification_choices()
 
-    print("=== ОТЛАДКА letter_list ===")
-    print(f"classification_choices: {classification_choices}")
-    if classification_choices:
-        print(f"Первый элемент: {classification_choices[0]}")
-        print(f"Длина первого элемента: {len(classification_choices[0])}")
-    print("===========================")
-
     context = {
-        'letters': letters,
+        'letters': page.letters,
         'status_choices': status_choices.items(),
         'classification_choices': classification_choices,
         'now': timezone.now(),
         'time_threshold': time_threshold,
+        'next_page_url': next_page_url,
+        'first_page_url': first_page_url,
     }
 
     return render(request, 'letter_list.html', context)
 
 
+def search_letters_view(request):
+    """Полнотекстовый поиск писем с учетом фильтров статуса и классификации"""
+    query_text = request.GET.get('q', '').strip()
+
+    try:
+        page_number = max(1, int(request.GET.get('page', 1)))
+    except (ValueError, TypeError):
+        page_number = 1
+
+    letters = []
+    has_next = False
+    if query_text:
+        found = search_letters(
+            _filter_letters(request, Letter.objects.defer('original_text', 'final_response')),
+            query_text
+        )
+        # Лишнее письмо на странице показывает, есть ли следующая, без подсчета всех совпадений
+        offset = (page_number - 1) * LETTER_PAGE_SIZE
+        letters = list(found[offset:offset + LETTER_PAGE_SIZE + 1])
+        has_next = len(letters) > LETTER_PAGE_SIZE
+        letters = attach_snippets(letters[:LETTER_PAGE_SIZE], query_text)
+
+    def page_url(number):
+        query = request.GET.copy()
+        query['page'] = number
+        return f"?{query.urlencode()}"
+
+    context = {
+        'query': query_text,
+        'letters': letters,
+        'page_number': page_number,
+        'next_page_url': page_url(page_number + 1) if has_next else None,
+        'previous_page_url': page_url(page_number - 1) if page_number > 1 else None,
+        'status_choices': Letter.STATUS_CHOICES,
+        'classification_choices': Letter.get_classification_choices(),
+    }
+    return render(request, 'search_results.html', context)
+
+
 def upload_letter(request):
     """Страница загрузки нового письма"""
     if request.method == 'POST':
@@ -208,7 +255,13 @@ def upload_letter(request):
             letter.status = 'new'
             letter.save()
 
-            # Перенаправляем на страницу анализа
+            # Похожее письмо уже загружалось - его анализ и ответ можно использовать повторно
+            index_letter(letter)
+
+            # Ставим письмо в очередь анализа и сразу отвечаем
+            enqueue_analysis(letter)
+
+            # Перенаправляем на страницу ожидания анализа
             return redirect('analyze_letter', letter_id=letter.id)
     else:
         form = LetterUploadForm()
@@ -216,60 +269,65 @@ def upload_letter(request):
     return render(request, 'upload_letter.html', {'form': form})
 
 
+def bulk_import_letters(request):
+    """Массовая загрузка писем из mbox, eml, CSV или ZIP"""
+    reports = None
+
+    if request.method == 'POST':
+        form = LetterBulkImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            uploaded_file = form.cleaned_data['file']
+            importer = LetterImporter(enqueue=form.cleaned_data['enqueue_analysis'])
+
+            # Разбираем файл потоково, не читая его целиком в память
+            reports = importer.import_file(uploaded_file.file, uploaded_file.name)
+
+            imported = sum(report.imported for report in reports)
+            skipped = sum(report.skipped for report in reports)
+            if imported:
+                messages.success(request, f"Импортировано писем: {imported}", extra_tags='import')
+            if skipped:
+                messages.warning(request, f"Пропущено писем: {skipped}", extra_tags='import')
+    else:
+        form = LetterBulkImportForm()
+
+    return render(request, 'bulk_import.html', {'form': form, 'reports': reports})
+
+
 def analyze_letter(request, letter_id):
-    """Анализ письма нейросетью"""
+    """Постановка письма в очередь анализа и ожидание результата"""
     letter = get_object_or_404(Letter, id=letter_id)
 
     if letter.status != 'new':
         return redirect('analysis_results', letter_id=letter.id)
 
-    # Для LLM используем метод с полными данными
-    categories_for_llm = Letter.get_classification_choices_for_llm()
-
-    print(f"=== АНАЛИЗ ПИСЬМА {letter_id} ===")
-    print(f"Категории для LLM: {categories_for_llm}")
-
-    # Подготавливаем текст для анализа
-    text_to_analyze = f"""
-    ОТПРАВИТЕЛЬ: {letter.sender}
-    ТЕМА: {letter.subject}
-    ТЕКСТ ПИСЬМА:
-    {letter.original_text}
-    """
+    # Анализ выполняется обработчиками очереди (manage.py run_analysis_workers),
+    # поэтому время ответа не зависит от скорости нейросети
+    job = enqueue_analysis(letter)
 
-    # Анализируем - передаем категории в метод analyze_letter
-    analysis_result = llm_client.analyze_letter(text_to_analyze, categories_for_llm)
+    context = {
+        'letter': letter,
+        'job': job,
+    }
 
-    # Обновляем письмо - данные уже сконвертированы
-    letter.summary = analysis_result['summary']
-    letter.classification = analysis_result['classification']
-    letter.criticality_level = analysis_result['criticality_level']
-    letter.response_style = analysis_result['response_style']
-    letter.processing_time_hours = analysis_result['processing_time_hours']
+    return render(request, 'analysis_pending.html', context)
 
-    # Парсим дедлайн
-    from django.utils.dateparse import parse_datetime
-    sla_deadline_str = analysis_result['sla_deadline']
-    if sla_deadline_str:
-        try:
-            letter.sla_deadline = parse_datetime(sla_deadline_str)
-        except (ValueError, TypeError):
-            # Если не удалось распарсить, используем расчет по часам
-            from datetime import timedelta
-            letter.sla_deadline = timezone.now() + timedelta(
-                hours=letter.processing_time_hours
-            )
 
-    letter.status = 'analyzed'
-    letter.save()
+def letter_status(request, letter_id):
+    """Легковесный статус письма для опроса со страницы ожидания анализа"""
+    letter_data = Letter.objects.filter(id=letter_id).values('id', 'status').first()
+    if letter_data is None:
+        return JsonResponse({'error': 'Письмо не найдено'}, status=404)
 
-    # Сохраняем полный анализ
-    AnalysisResult.objects.create(
-        letter=letter,
-        analysis_data=analysis_result
-    )
+    job = get_active_job(letter_id)
 
-    return redirect('analysis_results', letter_id=letter.id)
+    return JsonResponse({
+        'status': letter_data['status'],
+        'analyzed': letter_data['status'] != 'new',
+        'job_status': job.status if job else None,
+        'job_error': job.last_error if job and job.status == 'failed' else '',
+        'results_url': reverse('analysis_results', args=[letter_id]),
+    })
 
 
 def analysis_results(request, letter_id):
@@ -343,6 +401,34 @@ def generate_responses(request, letter_id):
         except GeneratedResponse.DoesNotExist:
             messages.error(request, "Выбранный ответ не найден.", extra_tags='response')
 
+    # Ответ на похожее письмо используется без обращения к нейросети
+    if request.method == 'POST' and 'reuse_duplicate_response' in request.POST:
+        representative = letter.duplicate_of
+        if representative is not None and representative.final_response:
+            _save_generated_response(
+                letter, representative.response_style or letter.response_style, representative.final_response
+            )
+            messages.success(request, f"Использован ответ на письмо #{representative.id}", extra_tags='response')
+            return redirect('generate_responses', letter_id=letter.id)
+        messages.error(request, "У похожего письма нет финального ответа.", extra_tags='response')
+
+    # Генерация ответов во всех стилях сразу - для сравнения вариантов
+    if request.method == 'POST' and 'generate_all_responses' in request.POST:
+        user_commentary = request.POST.get('user_commentary', '').strip() or _default_response_commentary(letter)
+        try:
+            responses = llm_client.generate_all_responses(
+                old_text_email=letter.original_text,
+                user_commentary=user_commentary
+            )
+            _save_generated_responses(letter, responses)
+
+            return redirect('generate_responses', letter_id=letter.id)
+
+        except Exception as e:
+            error_message = f"Ошибка при генерации ответов: {str(e)}"
+            logger.exception(error_message, extra={'letter_id': letter.id})
+            messages.error(request, error_message, extra_tags='response')
+
     # Обработка формы генерации нового ответа
     if request.method == 'POST' and 'generate_responses' in request.POST:
         selected_style = request.POST.get('response_style')
@@ -351,11 +437,7 @@ def generate_responses(request, letter_id):
         if selected_style:
             # Если пожелания пустые, создаем базовое описание
             if not user_commentary:
-                user_commentary = f"""
-                Краткое содержание письма: {letter.summary}
-                Тип письма: {letter.get_classification_display()}
-                Уровень критичности: {letter.get_criticality_level_display()}
-                """
+                user_commentary = _default_response_commentary(letter)
 
             try:
                 # Генерируем ответ только для выбранного стиля
@@ -365,41 +447,87 @@ def generate_responses(request, letter_id):
                     style=int(selected_style)
                 )
 
-                # Удаляем старые ответы для этого письма
-                GeneratedResponse.objects.filter(letter=letter).delete()
-
-                # Создаем новый ответ
-                generated_response = GeneratedResponse.objects.create(
-                    letter=letter,
-                    response_style=int(selected_style),
-                    response_text=response_text,
-                    is_selected=True  # Помечаем как выбранный сразу
-                )
-
-                # Сохраняем финальный ответ в письмо
-                letter.final_response = response_text
-                letter.status = 'response_generated'
-                letter.response_style = int(selected_style)
-                letter.save()
+                _save_generated_response(letter, int(selected_style), response_text)
 
                 return redirect('generate_responses', letter_id=letter.id)
 
             except Exception as e:
                 error_message = f"Ошибка при генерации ответа: {str(e)}"
-                print(error_message)
+                logger.exception(error_message, extra={'letter_id': letter.id})
                 messages.error(request, error_message, extra_tags='response')
                 # Не перенаправляем, остаемся на странице чтобы пользователь мог попробовать снова
 
+    return _render_generate_responses(request, letter)
+
+
+def _default_response_commentary(letter):
+    """Базовое описание письма, если пользователь не оставил пожеланий к ответу"""
+    return f"""
+                Краткое содержание письма: {letter.summary}
+                Тип письма: {letter.get_classification_display()}
+                Уровень критичности: {letter.get_criticality_level_display()}
+                """
+
+
+def _save_generated_response(letter, style, response_text):
+    """Сохраняет сгенерированный ответ как единственный и выбранный"""
+    with DB_SAVE_SECONDS.time(operation='response'), transaction.atomic():
+        # Удаляем старые ответы для этого письма
+        GeneratedResponse.objects.filter(letter=letter).delete()
+
+        # Создаем новый ответ
+        GeneratedResponse.objects.create(
+            letter=letter,
+            response_style=style,
+            response_text=response_text,
+            is_selected=True  # Помечаем как выбранный сразу
+        )
+
+        # Сохраняем финальный ответ в письмо
+        letter.final_response = response_text
+        letter.status = 'response_generated'
+        letter.response_style = style
+        letter.save()
+
+
+def _save_generated_responses(letter, responses):
+    """Сохраняет варианты ответов {стиль: текст}; финальный ответ пользователь выбирает сам.
+
+    Выбранный ранее ответ остается среди вариантов: финальный ответ письма не должен
+    ссылаться на удаленный вариант.
+    """
+    with DB_SAVE_SECONDS.time(operation='responses'), transaction.atomic():
+        GeneratedResponse.objects.filter(letter=letter, is_selected=False).delete()
+        if letter.final_response and not GeneratedResponse.objects.filter(letter=letter).exists():
+            # Финального ответа нет среди вариантов - сбрасываем его, как при сбросе ответов
+            letter.final_response = ''
+            letter.response_style = None
+            letter.status = 'analyzed'
+            letter.save()
+        GeneratedResponse.objects.bulk_create([
+            GeneratedResponse(letter=letter, response_style=style, response_text=response_text)
+            for style, response_text in responses.items()
+        ])
+
+
+def _render_generate_responses(request, letter):
+    """Страница со сгенерированными ответами"""
     # Получение сгенерированных ответов
-    responses = GeneratedResponse.objects.filter(letter=letter)
+    responses = GeneratedResponse.objects.filter(letter=letter).order_by('response_style')
 
     # Создаем словарь стилей для шаблона
     response_styles_dict = dict(Letter.RESPONSE_STYLES)
 
+    # Готовый ответ на почти дубликат письма можно взять вместо генерации
+    duplicate_response = None
+    if letter.duplicate_of_id:
+        duplicate_response = Letter.objects.filter(id=letter.duplicate_of_id).exclude(final_response='').first()
+
     context = {
         'letter': letter,
         'responses': responses,
         'response_styles': response_styles_dict,
+        'duplicate_response': duplicate_response,
     }
 
     return render(request, 'generate_response.html', context)
@@ -439,75 +567,62 @@ def update_letter_status(request, letter_id):
     return redirect('letter_detail', letter_id=letter.id)
 
 
+def metrics(request):
+    """Метрики всех процессов приложения в текстовом формате Prometheus"""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def get_letter_statistics(request):
     """Статистика по письмам"""
-    total_letters = Letter.objects.count()
+    classification_choices = Letter.get_classification_choices()
+    stats = collect_letter_statistics(number for number, _ in classification_choices)
+    total_letters = stats['total']
+
+    def percentage(count):
+        return round((count / total_letters * 100), 1) if total_letters > 0 else 0
 
     # Статистика по статусам с человекочитаемыми названиями
-    status_choices = dict(Letter.STATUS_CHOICES)
-    by_status = {}
-    for status_value, status_name in status_choices.items():
-        count = Letter.objects.filter(status=status_value).count()
-        percentage = round((count / total_letters * 100), 1) if total_letters > 0 else 0
-        by_status[status_value] = {
+    by_status = {
+        status_value: {
             'name': status_name,
-            'count': count,
-            'percentage': percentage
+            'count': stats['by_status'][status_value],
+            'percentage': percentage(stats['by_status'][status_value])
         }
+        for status_value, status_name in Letter.STATUS_CHOICES
+    }
 
-    # Статистика по классификациям - используем метод модели
-    classification_choices = Letter.get_classification_choices()
-    by_classification = {}
-    for class_value, class_name in classification_choices:
-        count = Letter.objects.filter(classification=class_value).count()
-        if count > 0:  # Показываем только те, где есть письма
-            by_classification[class_value] = {
-                'name': class_name,
-                'count': count,
-                'percentage': round((count / total_letters * 100), 1) if total_letters > 0 else 0
-            }
-
-    # Статистика по критичности
-    criticality_choices = dict(Letter.CRITICALITY_LEVELS)
-    by_criticality = {}
-    for crit_value, crit_name in criticality_choices.items():
-        count = Letter.objects.filter(criticality_level=crit_value).count()
-        if count > 0:  # Показываем только те, где есть письма
-            by_criticality[crit_value] = {
-                'name': crit_name,
-                'count': count,
-                'percentage': round((count / total_letters * 100), 1) if total_letters > 0 else 0
-            }
-
-    # Статистика по срочности (истекающие сроки)
-    time_threshold = timezone.now() + timedelta(hours=24)
-    urgent_letters = Letter.objects.filter(
-        sla_deadline__isnull=False,
-        sla_deadline__lte=time_threshold
-    ).count()
-
-    expired_letters = Letter.objects.filter(
-        sla_deadline__isnull=False,
-        sla_deadline__lt=timezone.now()
-    ).count()
-
-    # Исправляем расчет писем "в обработке"
-    # Письма в обработке - это все письма кроме завершенных и архивных
-    in_progress_letters = Letter.objects.exclude(
-        status__in=['done', 'archived']
-    ).count()
+    # Статистика по классификациям и критичности - показываем только те, где есть письма
+    by_classification = {
+        class_value: {
+            'name': class_name,
+            'count': stats['by_classification'][class_value],
+            'percentage': percentage(stats['by_classification'][class_value])
+        }
+        for class_value, class_name in classification_choices
+        if stats['by_classification'][class_value] > 0
+    }
+
+    by_criticality = {
+        crit_value: {
+            'name': crit_name,
+            'count': stats['by_criticality'][crit_value],
+            'percentage': percentage(stats['by_criticality'][crit_value])
+        }
+        for crit_value, crit_name in Letter.CRITICALITY_LEVELS
+        if stats['by_criticality'][crit_value] > 0
+    }
 
     context = {
         'total_letters': total_letters,
         'by_status': by_status,
         'by_classification': by_classification,
         'by_criticality': by_criticality,
-        'urgent_letters': urgent_letters,
-        'expired_letters': expired_letters,
-        'in_progress_letters': in_progress_letters,  # Добавляем правильный счетчик
-        'urgent_percentage': round((urgent_letters / total_letters * 100), 1) if total_letters > 0 else 0,
-        'expired_percentage': round((expired_letters / total_letters * 100), 1) if total_letters > 0 else 0,
-        'in_progress_percentage': round((in_progress_letters / total_letters * 100), 1) if total_letters > 0 else 0,
+        'urgent_letters': stats['urgent'],
+        'expired_letters': stats['expired'],
+        'in_progress_letters': stats['in_progress'],
+        'urgent_percentage': percentage(stats['urgent']),
+        'expired_percentage': percentage(stats['expired']),
+        'in_progress_percentage': percentage(stats['in_progress']),
     }
 
     return render(request, 'statistics.html', context)
@@ -516,11 +631,12 @@ def get_letter_statistics(request):
 def reset_to_default_categories(request):
     """Сброс категорий к базовым настройкам"""
     if request.method == 'POST':
-        # Предупреждение о потере данных
+        # Предупреждение о повторном анализе писем
         if Letter.objects.exclude(classification__isnull=True).exists() or AnalysisResult.objects.exists():
             messages.warning(request,
-                             "Внимание! Все существующие результаты анализа писем будут удалены "
-                             "при сбросе к базовым категориям."
+                             "Внимание! При сбросе к базовым категориям проанализированные письма "
+                             "будут повторно проанализированы в фоне. До повторного анализа у писем "
+                             "остаются прежние результаты."
                              , extra_tags='classification')
             return redirect('confirm_classification_reset')
 
@@ -538,14 +654,12 @@ def confirm_classification_reset(request):
         else:
             return redirect('classification_settings')
 
-    # Подсчет данных для удаления
-    letters_count = Letter.objects.exclude(classification__isnull=True).count()
-    analysis_count = AnalysisResult.objects.count()
-    responses_count = GeneratedResponse.objects.count()
+    # Письма, которые будут проанализированы повторно
+    letters_count = Letter.objects.exclude(status='new').count()
+    responses_count = Letter.objects.exclude(final_response='').count()
 
     context = {
         'letters_count': letters_count,
-        'analysis_count': analysis_count,
         'responses_count': responses_count,
     }
     return render(request, 'confirm_classification_reset.html', context)
@@ -558,28 +672,16 @@ def apply_classification_reset(request):
             # Деактивируем все пользовательские категории
             ClassificationCategory.objects.filter(is_active=True).update(is_active=False)
 
-            # Очищаем кэш категорий
+            # Сбрасываем кэш категорий во всех процессах
             Letter.clear_classification_cache()
 
-            # Удаляем все данные анализа
-            AnalysisResult.objects.all().delete()
-            GeneratedResponse.objects.all().delete()
-
-            # Сбрасываем классификацию у всех писем
-            Letter.objects.all().update(
-                classification=None,
-                summary='',
-                criticality_level=None,
-                response_style=None,
-                processing_time_hours=None,
-                sla_deadline=None,
-                final_response='',
-                status='new'
-            )
+            # Письма не сбрасываются: обработчики очереди анализируют их повторно
+            # порциями по SLA, а до этого показываются прежние результаты
+            start_reanalysis()
 
             messages.success(request,
                              "Классификаторы успешно сброшены к базовым настройкам! "
-                             "Все письма помечены для повторного анализа."
+                             "Письма будут повторно проанализированы в фоне."
                              , extra_tags='classification')
 
     except Exception as e:
@@ -592,28 +694,14 @@ def ask_question(request, letter_id):
     """Страница для задавания вопросов LLM о письме"""
     letter = get_object_or_404(Letter, id=letter_id)
 
-    # Получаем историю вопросов к этому письму (новые сверху) - ИСПРАВЛЕНО
-    questions = LetterQuestion.objects.filter(letter=letter).order_by('-asked_at')
-
     if request.method == 'POST':
         question_text = request.POST.get('question', '').strip()
 
         if question_text:
-            # Подготавливаем контекст для LLM
-            context = f"""
-            ИНФОРМАЦИЯ О ПИСЬМЕ:
-            Отправитель: {letter.sender}
-            Тема: {letter.subject}
-            Текст письма: {letter.original_text}
-
-            Ответь на вопрос пользователя, основываясь на информации о письме.
-            Будь точным и полезным.
-            """
-
             try:
                 # Используем существующий метод генерации ответа
                 answer = llm_client.generate_text(
-                    text_email=context,
+                    text_email=_question_context(letter),
                     user_commentary=question_text,
                 )
 
@@ -629,9 +717,294 @@ def ask_question(request, letter_id):
             except Exception as e:
                 messages.error(request, f"Ошибка при получении ответа: {str(e)}", extra_tags='question')
 
+    return _render_ask_question(request, letter)
+
+
+def _question_context(letter):
+    """Контекст письма для ответа LLM на вопрос пользователя"""
+    return f"""
+            ИНФОРМАЦИЯ О ПИСЬМЕ:
+            Отправитель: {letter.sender}
+            Тема: {letter.subject}
+            Текст письма: {letter.original_text}
+
+            Ответь на вопрос пользователя, основываясь на информации о письме.
+            Будь точным и полезным.
+            """
+
+
+def _render_ask_question(request, letter):
+    """Страница вопросов к письму"""
+    # Получаем историю вопросов к этому письму (новые сверху)
+    questions = LetterQuestion.objects.filter(letter=letter).order_by('-asked_at')
+
     context = {
         'letter': letter,
         'questions': questions,
     }
 
-    return render(request, 'ask_question.html', context)
\ No newline at end of file
+    return render(request, 'ask_question.html', context)
+
+
+# Потоковая генерация: текст передается браузеру по мере генерации (Server-Sent Events).
+# Обычные формы остаются запасным вариантом для браузеров без поддержки потоков.
+
+# Комментарий SSE в начале потока: браузер сразу получает заголовки ответа
+SSE_OPEN = ": stream\n\n"
+
+
+def _sse_event(event, data):
+    """Событие SSE; данные в JSON, поэтому переносы строк в тексте не ломают формат"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _sse_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    # Прокси (nginx) не должен буферизовать поток
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _stream_response_style(request, letter):
+    """Стиль ответа из запроса на потоковую генерацию или None, если генерация невозможна"""
+    if letter.status == 'new':
+        return None
+    try:
+        style = int(request.POST.get('response_style', ''))
+    except ValueError:
+        return None
+    return style if style in dict(Letter.RESPONSE_STYLES) else None
+
+
+@require_POST
+def generate_response_stream(request, letter_id):
+    """Генерация ответа с передачей текста по мере генерации (SSE)"""
+    letter = get_object_or_404(Letter, id=letter_id)
+    style = _stream_response_style(request, letter)
+    if style is None:
+        return JsonResponse({'error': 'Генерация ответа для этого письма недоступна'}, status=400)
+
+    user_commentary = request.POST.get('user_commentary', '').strip() or _default_response_commentary(letter)
+
+    def events():
+        yield SSE_OPEN
+        parts = []
+        try:
+            for delta in llm_client.stream_response(letter.original_text, user_commentary, style):
+                parts.append(delta)
+                yield _sse_event('delta', {'text': delta})
+            _save_generated_response(letter, style, llm_client.finalize_streamed_text(''.join(parts)))
+        except Exception as e:
+            error_message = f"Ошибка при генерации ответа: {str(e)}"
+            logger.exception(error_message, extra={'letter_id': letter.id})
+            yield _sse_event('error', {'message': error_message})
+            return
+        yield _sse_event('done', {'redirect': reverse('generate_responses', args=[letter.id])})
+
+    return _sse_response(events())
+
+
+@require_POST
+def ask_question_stream(request, letter_id):
+    """Ответ LLM на вопрос о письме с передачей текста по мере генерации (SSE)"""
+    letter = get_object_or_404(Letter, id=letter_id)
+    question_text = request.POST.get('question', '').strip()
+    if not question_text:
+        return JsonResponse({'error': 'Вопрос не задан'}, status=400)
+
+    def events():
+        yield SSE_OPEN
+        parts = []
+        try:
+            for delta in llm_client.stream_text(_question_context(letter), question_text):
+                parts.append(delta)
+                yield _sse_event('delta', {'text': delta})
+            LetterQuestion.objects.create(
+                letter=letter,
+                question=question_text,
+                answer=llm_client.finalize_streamed_text(''.join(parts))
+            )
+        except Exception as e:
+            error_message = f"Ошибка при получении ответа: {str(e)}"
+            logger.exception(error_message, extra={'letter_id': letter.id})
+            yield _sse_event('error', {'message': error_message})
+            return
+        yield _sse_event('done', {'redirect': reverse('ask_question', args=[letter.id])})
+
+    return _sse_response(events())
+
+# Асинхронные версии представлений, обращающихся к LLM.
+# Используются при запуске под ASGI (uvicorn): ожидание ответа нейросети
+# не занимает поток, и один процесс обслуживает сотни запросов одновременно.
+
+_async_llm_client = None
+
+
+def get_async_llm_client():
+    """Асинхронный клиент создается при первом обращении"""
+    global _async_llm_client
+    if _async_llm_client is None:
+        _async_llm_client = AsyncLLMClient()
+    return _async_llm_client
+
+
+async def analyze_letter_async(request, letter_id):
+    """Постановка письма в очередь анализа (асинхронно).
+
+    Как и синхронное представление, письмо анализируют обработчики очереди: задача
+    уже поставлена при загрузке письма, и анализ здесь же привел бы к двум
+    параллельным запросам к нейросети по одному письму.
+    """
+    letter = await sync_to_async(get_object_or_404)(Letter, id=letter_id)
+
+    if letter.status != 'new':
+        return redirect('analysis_results', letter_id=letter.id)
+
+    job = await sync_to_async(enqueue_analysis)(letter)
+
+    context = {
+        'letter': letter,
+        'job': job,
+    }
+
+    return await sync_to_async(render)(request, 'analysis_pending.html', context)
+
+
+async def generate_responses_async(request, letter_id):
+    """Генерация ответа (асинхронно). Остальные действия выполняет синхронное представление."""
+    generate_all = request.method == 'POST' and 'generate_all_responses' in request.POST
+    if not (generate_all or (request.method == 'POST' and 'generate_responses' in request.POST
+                             and request.POST.get('response_style'))):
+        return await sync_to_async(generate_responses)(request, letter_id)
+
+    letter = await sync_to_async(get_object_or_404)(Letter, id=letter_id)
+    if letter.status == 'new':
+        return redirect('analyze_letter', letter_id=letter.id)
+
+    user_commentary = request.POST.get('user_commentary', '').strip()
+    if not user_commentary:
+        user_commentary = await sync_to_async(_default_response_commentary)(letter)
+
+    if generate_all:
+        try:
+            responses = await get_async_llm_client().generate_all_responses(
+                old_text_email=letter.original_text,
+                user_commentary=user_commentary
+            )
+            await sync_to_async(_save_generated_responses)(letter, responses)
+
+            return redirect('generate_responses', letter_id=letter.id)
+
+        except Exception as e:
+            error_message = f"Ошибка при генерации ответов: {str(e)}"
+            logger.exception(error_message, extra={'letter_id': letter.id})
+            messages.error(request, error_message, extra_tags='response')
+            return await sync_to_async(_render_generate_responses)(request, letter)
+
+    selected_style = int(request.POST.get('response_style'))
+    try:
+        response_text = await get_async_llm_client().generate_response(
+            old_text_email=letter.original_text,
+            user_commentary=user_commentary,
+            style=selected_style
+        )
+        await sync_to_async(_save_generated_response)(letter, selected_style, response_text)
+
+        return redirect('generate_responses', letter_id=letter.id)
+
+    except Exception as e:
+        error_message = f"Ошибка при генерации ответа: {str(e)}"
+        logger.exception(error_message, extra={'letter_id': letter.id})
+        messages.error(request, error_message, extra_tags='response')
+
+    return await sync_to_async(_render_generate_responses)(request, letter)
+
+
+async def ask_question_async(request, letter_id):
+    """Вопрос LLM о письме (асинхронно)"""
+    letter = await sync_to_async(get_object_or_404)(Letter, id=letter_id)
+
+    question_text = request.POST.get('question', '').strip() if request.method == 'POST' else ''
+    if question_text:
+        try:
+            answer = await get_async_llm_client().generate_text(
+                text_email=_question_context(letter),
+                user_commentary=question_text,
+            )
+            await LetterQuestion.objects.acreate(
+                letter=letter,
+                question=question_text,
+                answer=answer
+            )
+
+            return redirect('ask_question', letter_id=letter.id)
+
+        except Exception as e:
+            messages.error(request, f"Ошибка при получении ответа: {str(e)}", extra_tags='question')
+
+    return await sync_to_async(_render_ask_question)(request, letter)
+
+
+@require_POST
+async def generate_response_stream_async(request, letter_id):
+    """Потоковая генерация ответа (асинхронно, SSE)"""
+    letter = await sync_to_async(get_object_or_404)(Letter, id=letter_id)
+    style = _stream_response_style(request, letter)
+    if style is None:
+        return JsonResponse({'error': 'Генерация ответа для этого письма недоступна'}, status=400)
+
+    user_commentary = request.POST.get('user_commentary', '').strip()
+    if not user_commentary:
+        user_commentary = await sync_to_async(_default_response_commentary)(letter)
+
+    async def events():
+        yield SSE_OPEN
+        client = get_async_llm_client()
+        parts = []
+        try:
+            async for delta in client.stream_response(letter.original_text, user_commentary, style):
+                parts.append(delta)
+                yield _sse_event('delta', {'text': delta})
+            await sync_to_async(_save_generated_response)(
+                letter, style, client.finalize_streamed_text(''.join(parts))
+            )
+        except Exception as e:
+            error_message = f"Ошибка при генерации ответа: {str(e)}"
+            logger.exception(error_message, extra={'letter_id': letter.id})
+            yield _sse_event('error', {'message': error_message})
+            return
+        yield _sse_event('done', {'redirect': reverse('generate_responses', args=[letter.id])})
+
+    return _sse_response(events())
+
+
+@require_POST
+async def ask_question_stream_async(request, letter_id):
+    """Потоковый ответ на вопрос о письме (асинхронно, SSE)"""
+    letter = await sync_to_async(get_object_or_404)(Letter, id=letter_id)
+    question_text = request.POST.get('question', '').strip()
+    if not question_text:
+        return JsonResponse({'error': 'Вопрос не задан'}, status=400)
+
+    async def events():
+        yield SSE_OPEN
+        client = get_async_llm_client()
+        parts = []
+        try:
+            async for delta in client.stream_text(_question_context(letter), question_text):
+                parts.append(delta)
+                yield _sse_event('delta', {'text': delta})
+            await LetterQuestion.objects.acreate(
+                letter=letter,
+                question=question_text,
+                answer=client.finalize_streamed_text(''.join(parts))
+            )
+        except Exception as e:
+            error_message = f"Ошибка при получении ответа: {str(e)}"
+            logger.exception(error_message, extra={'letter_id': letter.id})
+            yield _sse_event('error', {'message': error_message})
+            return
+        yield _sse_event('done', {'redirect': reverse('ask_question', args=[letter.id])})
+
+    return _sse_response(events())
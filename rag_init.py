@@ -1,4 +1,10 @@
+import sys
+
 from bank_letters.services.llm_client import LLMClient
 
 llm_client = LLMClient()
-llm_client.load_txt_files_to_vector_store()
\ No newline at end of file
+report = llm_client.load_txt_files_to_vector_store(
+    dry_run='--dry-run' in sys.argv,
+    prune_untracked='--prune-untracked' in sys.argv,
+)
+sys.exit(1 if report.errors else 0)